@@ -0,0 +1,422 @@
+"""
+Derived views over the datastore document.
+
+Each view is registered with ``DataStore.add_view`` and kept current from the
+changes of every committed store transaction, so endpoints can read totals
+without walking the whole ledger.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from datetime import date, timedelta
+
+
+class LedgerView:
+    """Base for views derived from the confirmed transactions.
+
+    Subclasses implement ``reset()`` and ``_add(txn, sign)``; every change
+    to a transaction record is applied as removing the old version and adding
+    the new one.
+    """
+
+    def rebuild(self, data):
+        self.reset()
+        for txn in data['transactions']:
+            self._add(txn, 1)
+
+    def apply(self, data, changes):
+        for kind, path, old, new in changes:
+            if path[0] != 'transactions':
+                continue
+            if len(path) > 1 or kind in ('set', 'delete'):
+                # The ledger was replaced wholesale
+                self.rebuild(data)
+                return
+            if old is not None:
+                self._add(old, -1)
+            if new is not None:
+                self._add(new, 1)
+
+
+class FinancialTotals(LedgerView):
+    """Running totals behind the dashboard financials.
+
+    Tracks cash on hand, receivables, personal-use recovery and the number of
+    units that left stock. Cost is not stored: total cost sold is
+    ``base_cost * units_sold``, so changing base_cost in settings revalues it
+    at read time without a rescan.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cash_on_hand = 0
+        self.total_receivables = 0
+        self.personal_use_recovery = 0
+        self.units_sold = 0
+
+    def _add(self, txn, sign):
+        qty = txn['quantity']
+        amount = txn['price'] * qty * sign
+
+        if txn['type'] == 'Direct Sale':
+            self.cash_on_hand += amount
+        elif txn['type'] == 'Personal Use':
+            self.personal_use_recovery += amount
+        elif txn['type'] == 'Consignment':
+            if txn['paid']:
+                self.cash_on_hand += amount
+            else:
+                self.total_receivables += amount
+        else:
+            return
+        self.units_sold += qty * sign
+
+    def totals(self):
+        return {
+            'cash_on_hand': self.cash_on_hand,
+            'total_receivables': self.total_receivables,
+            'personal_use_recovery': self.personal_use_recovery,
+            'units_sold': self.units_sold
+        }
+
+
+class LedgerOrder:
+    """Whether the transactions are in timestamp order.
+
+    Transactions are appended when they are confirmed but keep the time they
+    were created, so accepting pending transactions out of order leaves the
+    ledger unsorted. While it is sorted, a time range can be found by binary
+    search. Removing records keeps it sorted and appends are checked against
+    the last timestamp; any other ledger change rechecks the whole ledger.
+    """
+
+    def __init__(self):
+        self.ordered = True
+        self.last = None
+
+    def rebuild(self, data):
+        timestamps = [txn['timestamp'] for txn in data['transactions']]
+        self.ordered = all(earlier <= later for earlier, later in zip(timestamps, timestamps[1:]))
+        self.last = timestamps[-1] if timestamps else None
+
+    def apply(self, data, changes):
+        for kind, path, old, new in changes:
+            if path[0] != 'transactions':
+                continue
+            if (len(path) > 1 or kind in ('set', 'delete')
+                    or kind == 'update' and old['timestamp'] != new['timestamp']):
+                self.rebuild(data)
+                return
+            if kind == 'append':
+                if self.last is not None and new['timestamp'] < self.last:
+                    self.ordered = False
+                self.last = new['timestamp']
+            # A removal keeps the order; removing the last record leaves
+            # self.last too high, which can only make an append look out of order
+
+
+def period_key(day, bucket):
+    """Bucket a YYYY-MM-DD day into 'day', 'week' (ISO YYYY-Www) or 'month' (YYYY-MM)"""
+    if bucket == 'day':
+        return day
+    if bucket == 'month':
+        return day[:7]
+    if bucket == 'week':
+        year, week, _ = date.fromisoformat(day).isocalendar()
+        return f'{year}-W{week:02d}'
+    raise ValueError(f'Unknown bucket: {bucket}')
+
+
+class FlavorMovements(LedgerView):
+    """Units that left stock per flavor and transaction type, overall and per day.
+
+    Reading totals costs O(flavors); bucketed reads cost O(days in range)
+    regardless of how many transactions the ledger holds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.totals = {}
+        self.daily = {}
+
+    def _add(self, txn, sign):
+        flavor, txn_type = txn['flavor'], txn['type']
+        qty = txn['quantity'] * sign
+
+        self._count(self.totals, flavor, txn_type, qty)
+        day = txn['timestamp'][:10]
+        flavors = self.daily.setdefault(day, {})
+        self._count(flavors, flavor, txn_type, qty)
+        if not flavors:
+            del self.daily[day]
+
+    @staticmethod
+    def _count(flavors, flavor, txn_type, qty):
+        # Counts that drop to zero are removed, so the index matches a rebuild
+        by_type = flavors.setdefault(flavor, {})
+        count = by_type.get(txn_type, 0) + qty
+        if count:
+            by_type[txn_type] = count
+        else:
+            by_type.pop(txn_type, None)
+            if not by_type:
+                del flavors[flavor]
+
+    def flavor_totals(self, flavor):
+        """Units moved for one flavor, by transaction type"""
+        return dict(self.totals.get(flavor, {}))
+
+    def buckets(self, bucket, start=None, end=None, flavor=None):
+        """Per-period movements as [(period, {flavor: {type: qty}})], oldest first"""
+        periods = {}
+        for day in sorted(self.daily):
+            if (start and day < start[:10]) or (end and day > end[:10]):
+                continue
+            period = periods.setdefault(period_key(day, bucket), {})
+            for day_flavor, by_type in self.daily[day].items():
+                if flavor and day_flavor != flavor:
+                    continue
+                totals = period.setdefault(day_flavor, {})
+                for txn_type, qty in by_type.items():
+                    totals[txn_type] = totals.get(txn_type, 0) + qty
+        return list(periods.items())
+
+
+def _month_end(month):
+    """Last day (YYYY-MM-DD) of a YYYY-MM month"""
+    year, number = int(month[:4]), int(month[5:7])
+    if not 1 <= number <= 12:
+        raise ValueError(f'Invalid month: {month}')
+    following = date(year + number // 12, number % 12 + 1, 1)
+    return (following - timedelta(days=1)).isoformat()
+
+
+def day_bounds(start=None, end=None):
+    """Inclusive YYYY-MM-DD bounds of a range given as ISO dates or prefixes
+    (``2024`` or ``2024-03``); times of day are ignored. Raises ValueError
+    for anything else."""
+    if start:
+        start = start[:10] + {4: '-01-01', 7: '-01'}.get(len(start), '')
+    if end:
+        if len(end) == 4:
+            end += '-12-31'
+        elif len(end) == 7:
+            end = _month_end(end)
+        else:
+            end = end[:10]
+    for bound in (start, end):
+        if bound:
+            date.fromisoformat(bound)  # ValueError if not a date
+    return start or '', end or ''
+
+
+class SalesRollups(LedgerView):
+    """Sales per day and per month, split by flavor, type and consignee.
+
+    Each rollup table maps a period to ``{(flavor, type, consignee):
+    [transactions, units, revenue, unpaid]}``; ``unpaid`` is the part of the
+    revenue not yet collected. Accepting, deleting or marking a transaction
+    paid adjusts one row of each table, and the period's unfiltered total in
+    ``totals``. A range query reads whole months from the monthly table and
+    only the partial months at its edges from the daily one, so its cost
+    follows the number of periods, not transactions.
+    """
+
+    METRICS = ('transactions', 'units', 'revenue', 'unpaid')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tables = {'day': {}, 'month': {}}
+        self.totals = {'day': {}, 'month': {}}
+        self.periods = {'day': [], 'month': []}
+
+    def _add(self, txn, sign):
+        day = txn['timestamp'][:10]
+        key = (txn['flavor'], txn['type'], txn.get('consignee') or None)
+        amount = txn['price'] * txn['quantity']
+        delta = (sign, txn['quantity'] * sign, amount * sign, 0 if txn['paid'] else amount * sign)
+        for level, period in (('day', day), ('month', day[:7])):
+            table = self.tables[level]
+            rows = table.get(period)
+            if rows is None:
+                rows = table[period] = {}
+                insort(self.periods[level], period)
+            row = rows.setdefault(key, [0, 0, 0, 0])
+            total = self.totals[level].setdefault(period, [0, 0, 0, 0])
+            for index, value in enumerate(delta):
+                row[index] += value
+                total[index] += value
+            if row[0] == 0:
+                del rows[key]
+                if not rows:
+                    del table[period]
+                    del self.totals[level][period]
+                    periods = self.periods[level]
+                    del periods[bisect_left(periods, period)]
+
+    def _rows(self, level, low, high, unfiltered=False):
+        """(period, rows) of one table for periods in [low, high].
+
+        With ``unfiltered`` the rows of each period are replaced by its total.
+        """
+        periods = self.periods[level]
+        table = self.totals[level] if unfiltered else self.tables[level]
+        start = bisect_left(periods, low) if low else 0
+        end = bisect_right(periods, high) if high else len(periods)
+        for period in periods[start:end]:
+            yield period, ({None: table[period]} if unfiltered else table[period])
+
+    def _days(self, start, end, unfiltered=False):
+        """(day, rows) for every day with sales in [start, end], oldest first.
+
+        Whole months inside the range come from the monthly table as a single
+        entry dated the first day of the month.
+        """
+        for month, rows in self._rows('month', start[:7], end[:7], unfiltered):
+            first, last = f'{month}-01', _month_end(month)
+            if (not start or start <= first) and (not end or end >= last):
+                yield first, rows
+            else:
+                yield from self._rows('day', max(start, first), min(end, last) if end else last, unfiltered)
+
+    def series(self, bucket, start=None, end=None, flavor=None, txn_type=None, consignee=None):
+        """Per-period totals as [(period, {metric: value})], oldest first.
+
+        ``bucket`` is 'day', 'week' or 'month'; a week or day bucket reads
+        the daily table throughout, since months do not split into them.
+        """
+        start, end = day_bounds(start, end)
+        unfiltered = not (flavor or txn_type or consignee)
+        if bucket == 'month':
+            days = self._days(start, end, unfiltered)
+        else:
+            days = self._rows('day', start, end, unfiltered)
+
+        totals = {}
+        for day, rows in days:
+            key = period_key(day, bucket)
+            period = totals.get(key)
+            if period is None:
+                period = totals[key] = [0, 0, 0, 0]
+            for row_key, row in rows.items():
+                if not unfiltered and (
+                        (flavor and row_key[0] != flavor) or (txn_type and row_key[1] != txn_type)
+                        or (consignee and row_key[2] != consignee)):
+                    continue
+                for index, value in enumerate(row):
+                    period[index] += value
+        return [(period, dict(zip(self.METRICS, values))) for period, values in totals.items()
+                if values[0]]
+
+
+class ConsigneeBalances:
+    """Outstanding debt and open (unpaid) items per consignee.
+
+    Built from the consignee item lists rather than the ledger: a change to
+    one consignee's items re-summarizes only that consignee, so reads and
+    payments cost O(items of that consignee) however long the ledger is.
+    """
+
+    def __init__(self):
+        self.accounts = {}
+
+    def rebuild(self, data):
+        self.accounts = {}
+        for name, items in data.get('consignees', {}).items():
+            self._summarize(name, items)
+
+    def apply(self, data, changes):
+        names = set()
+        for kind, path, old, new in changes:
+            if path[0] != 'consignees':
+                continue
+            if len(path) == 1:
+                self.rebuild(data)
+                return
+            names.add(path[1])
+        for name in names:
+            items = data.get('consignees', {}).get(name)
+            if items is None:
+                self.accounts.pop(name, None)
+            else:
+                self._summarize(name, items)
+
+    def _summarize(self, name, items):
+        open_items = [index for index, item in enumerate(items) if not item['paid']]
+        self.accounts[name] = {
+            'total_debt': sum(items[index]['quantity'] * items[index]['price'] for index in open_items),
+            'open_items': open_items
+        }
+
+    def total_debt(self, name):
+        account = self.accounts.get(name)
+        return account['total_debt'] if account else 0
+
+    def open_items(self, name):
+        """Positions of the consignee's unpaid items, oldest first"""
+        account = self.accounts.get(name)
+        return list(account['open_items']) if account else []
+
+
+class ChangeFeed:
+    """What each recent commit touched, for incremental client sync.
+
+    Keeps, for the last ``max_versions`` commits, the inventory flavors,
+    transaction and pending ids, and consignee names they changed. ``since``
+    merges them for every commit after a given version. Anything older than
+    the feed's floor (or a wholesale replacement of a section, or a reload)
+    cannot be described as a delta, and the client has to refetch.
+    """
+
+    SECTIONS = ('inventory', 'transactions', 'pending_transactions', 'consignees', 'settings')
+
+    def __init__(self, max_versions=1000):
+        self.max_versions = max_versions
+        self.entries = deque()
+        self.floor = 0
+
+    def rebuild(self, data):
+        self.entries.clear()
+        self.floor = data.get('version', 0)
+
+    def apply(self, data, changes):
+        version = data.get('version', 0)
+        touched = {section: set() for section in self.SECTIONS}
+        for kind, path, old, new in changes:
+            section = path[0]
+            if section not in touched:
+                continue
+            if section in ('transactions', 'pending_transactions'):
+                if len(path) == 1 and kind in ('set', 'delete'):
+                    self.rebuild(data)
+                    return
+                touched[section].update(record['id'] for record in (old, new) if record is not None)
+            elif len(path) == 1:
+                if section != 'settings':
+                    # The whole section was replaced
+                    self.rebuild(data)
+                    return
+                touched[section].add(None)
+            else:
+                touched[section].add(path[1])
+
+        self.entries.append((version, touched))
+        while len(self.entries) > self.max_versions:
+            self.floor = self.entries.popleft()[0]
+
+    def since(self, version):
+        """Keys touched by commits after version, or None if that is not known"""
+        if version < self.floor:
+            return None
+        touched = {section: set() for section in self.SECTIONS}
+        for entry_version, entry in reversed(self.entries):
+            if entry_version <= version:
+                break
+            for section, keys in entry.items():
+                touched[section] |= keys
+        return touched
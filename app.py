@@ -1,17 +1,142 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, g, jsonify, make_response, request, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import json
+import atexit
 import os
+import tempfile
+from functools import wraps
 from datetime import datetime
-import pandas as pd
 from decimal import Decimal, ROUND_HALF_UP
+from datastore import DataStore, GroupCommit, JsonFileBackend, JournalBackend, SQLiteBackend
+from aggregates import ChangeFeed, ConsigneeBalances, FinancialTotals, FlavorMovements, LedgerOrder, SalesRollups
+from ledger import ColumnarLedger
+from pagination import parse_fields, project, in_time_range, time_bounds, paginate
+from exports import XLSX_MIMETYPE, write_xlsx, iter_csv
+from export_jobs import ExportJobManager
+from audit_log import AuditLog
+from events import ChangePublisher, EventBroker, encode_event
+from response_cache import ResponseCache
+from serialization import get_serializer
+from instrumentation import RequestMetrics, RouteProfiler
+from branches import ALL_BRANCHES, BranchRegistry, UnknownBranch, parse_branches, partition_path
 
 app = Flask(__name__)
 CORS(app)
 
 DB_FILE = 'vape_data.json'
 
+# Branches (store locations), comma-separated; each is stored as its own
+# partition. The first is the default, used when a request names no branch
+BRANCHES = parse_branches(os.environ.get('VAPE_BRANCHES', 'main'))
+DEFAULT_BRANCH = BRANCHES[0]
+
+# JSON encoder for storage and responses: 'orjson' (if installed), 'stdlib',
+# or 'auto' for orjson when available. Output is compact unless
+# VAPE_JSON_PRETTY=1, which indents DB_FILE and API responses for reading
+JSON_SERIALIZER = os.environ.get('VAPE_JSON', 'auto')
+JSON_PRETTY = os.environ.get('VAPE_JSON_PRETTY') == '1'
+
+# Storage backend: 'json' rewrites DB_FILE on every change, 'journal' appends
+# each change to a write-ahead log in JOURNAL_DIR and snapshots periodically,
+# 'sqlite' stores indexed tables in SQLITE_FILE
+STORAGE_BACKEND = os.environ.get('VAPE_STORAGE', 'json')
+JOURNAL_DIR = os.environ.get('VAPE_JOURNAL_DIR', 'vape_journal')
+SQLITE_FILE = os.environ.get('VAPE_SQLITE_FILE', 'vape_data.db')
+
+# Binary snapshots for faster startup: the json backend keeps a copy of
+# DB_FILE in SNAPSHOT_FILE, the journal writes snapshot.bin instead of
+# snapshot.json
+BINARY_SNAPSHOT = os.environ.get('VAPE_SNAPSHOT') == '1'
+SNAPSHOT_FILE = os.environ.get('VAPE_SNAPSHOT_FILE', DB_FILE + '.snap')
+
+# Audit history lives in its own log, rotated into compressed monthly (or
+# AUDIT_SEGMENT_EVENTS-sized) archive segments
+AUDIT_DIR = os.environ.get('VAPE_AUDIT_DIR', 'vape_audit')
+AUDIT_SEGMENT_EVENTS = int(os.environ.get('VAPE_AUDIT_SEGMENT_EVENTS', 10000))
+
+# /api/events: messages queued per client before it is dropped as a slow
+# consumer, maximum concurrent clients, and seconds between keep-alives
+EVENTS_QUEUE_SIZE = int(os.environ.get('VAPE_EVENTS_QUEUE_SIZE', 100))
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('VAPE_EVENTS_MAX_SUBSCRIBERS', 1000))
+EVENTS_HEARTBEAT = float(os.environ.get('VAPE_EVENTS_HEARTBEAT', 15))
+
+# Serialized bodies of the dashboard, consignee and payment history
+# responses, kept until a commit changes what they were built from
+RESPONSE_CACHE_BYTES = int(os.environ.get('VAPE_RESPONSE_CACHE_BYTES', 8 * 1024 * 1024))
+
+# Lock and catch up with other worker processes sharing the same storage
+# (e.g. several gunicorn workers); set to 0 for a single-process deployment
+SHARED_STORAGE = os.environ.get('VAPE_SHARED_STORAGE', '1') == '1'
+
+# Group commit: commits arriving within COMMIT_WINDOW_MS of each other (up to
+# COMMIT_MAX_BATCH) are persisted with one write; 0 writes every commit alone
+COMMIT_WINDOW_MS = float(os.environ.get('VAPE_COMMIT_WINDOW_MS', 0))
+COMMIT_MAX_BATCH = int(os.environ.get('VAPE_COMMIT_MAX_BATCH', 64))
+
+# Finished exports are cached here, keyed by data version, oldest evicted first
+EXPORT_DIR = os.environ.get('VAPE_EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'vape_exports'))
+EXPORT_WORKERS = int(os.environ.get('VAPE_EXPORT_WORKERS', 2))
+EXPORT_CACHE_SIZE = int(os.environ.get('VAPE_EXPORT_CACHE_SIZE', 8))
+
+# Cross-check the running financial totals against a full recompute on every read
+VERIFY_AGGREGATES = os.environ.get('VAPE_VERIFY_AGGREGATES') == '1'
+
+# Per-route latency, load/persist/serialize/compute time and payload size
+# histograms at /api/metrics, and cProfile captures at /api/metrics/profile
+METRICS_ENABLED = os.environ.get('VAPE_METRICS') == '1'
+
+serializer = get_serializer(JSON_SERIALIZER)
+file_serializer = get_serializer(JSON_SERIALIZER, pretty=JSON_PRETTY)
+# Keys sorted, as Flask's own encoder does, so clients see the same order
+response_serializer = get_serializer(JSON_SERIALIZER, pretty=JSON_PRETTY, sort_keys=True)
+
+metrics = RequestMetrics(METRICS_ENABLED)
+profiler = RouteProfiler()
+
+class SerializerJSONProvider(DefaultJSONProvider):
+    """Flask's jsonify and request parsing through response_serializer"""
+    
+    def dumps(self, obj, **kwargs):
+        with metrics.phase('serialize'):
+            return response_serializer.dumps(obj, default=self.default).decode()
+    
+    def loads(self, s, **kwargs):
+        return response_serializer.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with metrics.phase('serialize'):
+            body = response_serializer.dumps(obj, default=self.default) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = SerializerJSONProvider(app)
+
+def request_route():
+    """URL rule of the current request, used as its metrics label"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def start_request_metrics():
+    metrics.begin()
+    g.profile = profiler.start(request_route())
+
+def record_request_metrics(response):
+    metrics.end(request_route(), request.method, response.status_code,
+                request.content_length, response.calculate_content_length())
+    return response
+
+def stop_request_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile)
+
+# Registered only when enabled, so requests pay nothing for metrics otherwise
+if METRICS_ENABLED:
+    app.before_request(start_request_metrics)
+    app.after_request(record_request_metrics)
+    app.teardown_request(stop_request_profile)
+
 # Constants
+LOW_STOCK_THRESHOLD = 3
 FLAVORS = [
     "Black Currant", "Matcha", "Watermelon", "Bubblegum", "Mango", "Grapes",
     "Lemon Cola", "Mixed Berries", "Blueberry", "Strawberry", "Banana", "Yakult"
@@ -117,6 +242,7 @@ def initialize_database():
         })
         data['inventory'][flavor] -= 5
         data['consignees']['KJ'].append({
+            'transaction_id': len(data['transactions']),
             'flavor': flavor,
             'quantity': 5,
             'price': PRICE_CONSIGNMENT,
@@ -138,6 +264,7 @@ def initialize_database():
         })
         data['inventory'][flavor] -= 2
         data['consignees']['Jross'].append({
+            'transaction_id': len(data['transactions']),
             'flavor': flavor,
             'quantity': 2,
             'price': PRICE_CONSIGNMENT,
@@ -164,71 +291,272 @@ def initialize_database():
         })
         data['inventory'][flavor] -= qty
         data['consignees']['Gerbe'].append({
+            'transaction_id': len(data['transactions']),
             'flavor': flavor,
             'quantity': qty,
             'price': PRICE_CONSIGNMENT,
             'paid': False
         })
     
-    save_data(data)
     return data
 
-def load_data():
-    """Load data from JSON file"""
-    if not os.path.exists(DB_FILE):
-        return initialize_database()
-    with open(DB_FILE, 'r') as f:
-        return json.load(f)
+def initialize_branch(branch):
+    """Starting state of a new branch: full stock and no history"""
+    if branch == DEFAULT_BRANCH:
+        data = initialize_database()
+    else:
+        data = {
+            'inventory': {flavor: INITIAL_STOCK for flavor in FLAVORS},
+            'transactions': [],
+            'pending_transactions': [],
+            'consignees': {},
+            'settings': DEFAULT_SETTINGS.copy()
+        }
+    data['branch'] = branch
+    return data
 
-def save_data(data):
-    """Save data to JSON file"""
-    with open(DB_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def load_initial_data(branch=DEFAULT_BRANCH):
+    """Seed a new store from the branch's existing JSON file, or from scratch"""
+    path = partition_path(DB_FILE, branch, DEFAULT_BRANCH)
+    return JsonFileBackend(path, file_serializer).load() or initialize_branch(branch)
 
-def log_transaction_event(data, event_type, details):
-    """Log a transaction event to the audit history"""
-    if 'transaction_history' not in data:
-        data['transaction_history'] = []
+def make_backend(kind=STORAGE_BACKEND, branch=DEFAULT_BRANCH):
+    """Build the configured storage backend for a branch's partition"""
+    def path(name):
+        return partition_path(name, branch, DEFAULT_BRANCH)
+    
+    if kind == 'json':
+        return JsonFileBackend(path(DB_FILE), file_serializer, path(SNAPSHOT_FILE) if BINARY_SNAPSHOT else None)
+    if kind == 'journal':
+        return JournalBackend(path(JOURNAL_DIR), serializer=serializer, binary_snapshot=BINARY_SNAPSHOT)
+    if kind == 'sqlite':
+        return SQLiteBackend(path(SQLITE_FILE), serializer)
+    raise ValueError(f'Unknown storage backend: {kind}')
+
+def link_consignee_items(tx):
+    """Record the transaction id on consignee items saved before items were linked.
+    
+    Each item is matched to the oldest unclaimed consignment transaction of the
+    same consignee, flavor and quantity, preferring one with the same paid flag.
+    """
+    data = tx.data
+    unlinked = {
+        name for name, items in data.get('consignees', {}).items()
+        if any('transaction_id' not in item for item in items)
+    }
+    if not unlinked:
+        return
+    
+    claimed = {
+        item['transaction_id'] for name in unlinked
+        for item in data['consignees'][name] if 'transaction_id' in item
+    }
+    candidates = {}
+    for txn in data['transactions']:
+        if txn['type'] == 'Consignment' and txn.get('consignee') in unlinked and txn['id'] not in claimed:
+            candidates.setdefault(txn['consignee'], []).append(txn)
     
+    for name in unlinked:
+        pool = candidates.get(name, [])
+        items = [dict(item) for item in data['consignees'][name]]
+        linked = False
+        for item in items:
+            if 'transaction_id' in item:
+                continue
+            same = [txn for txn in pool if txn['flavor'] == item['flavor'] and txn['quantity'] == item['quantity']]
+            match = next((txn for txn in same if txn['paid'] == item['paid']), same[0] if same else None)
+            if match is not None:
+                item['transaction_id'] = match['id']
+                pool.remove(match)
+                linked = True
+        if linked:
+            tx.set(('consignees', name), items)
+
+def find_consignee_item(items, transaction):
+    """Position of the consignee item created by a consignment transaction"""
+    for index, item in enumerate(items):
+        if item.get('transaction_id') == transaction['id']:
+            return index
+    # Items that could not be linked: first one with the same flavor and quantity
+    for index, item in enumerate(items):
+        if ('transaction_id' not in item and item['flavor'] == transaction['flavor'] and
+                item['quantity'] == transaction['quantity']):
+            return index
+    return None
+
+def move_history_to_audit_log(tx):
+    """Move audit events kept in the document by older versions to the audit log"""
+    if 'transaction_history' not in tx.data:
+        return
+    audit_log.import_events(tx.data['transaction_history'])
+    tx.delete(('transaction_history',))
+    if 'transaction_history' in tx.data.get('sequences', {}):
+        tx.delete(('sequences', 'transaction_history'))
+
+def upgrade_data(tx, branch=DEFAULT_BRANCH):
+    """Bring a document written by an older version up to date"""
+    link_consignee_items(tx)
+    move_history_to_audit_log(tx)
+    if 'branch' not in tx.data:
+        tx.set(('branch',), branch)
+
+audit_log = AuditLog(AUDIT_DIR, AUDIT_SEGMENT_EVENTS, serializer=serializer, shared=SHARED_STORAGE)
+
+metrics.add_histogram('vape_commit_batch_size', 'Commits persisted per group commit write',
+                      (1, 2, 4, 8, 16, 32, 64, 128, 256))
+metrics.add_histogram('vape_commit_write_seconds', 'Time to persist one group commit batch')
+metrics.add_histogram('vape_commit_latency_seconds', 'Time a commit waited until its batch was persisted')
+
+def record_batch(size, seconds):
+    metrics.observe('vape_commit_batch_size', size)
+    metrics.observe('vape_commit_write_seconds', seconds)
+
+def make_group_commit():
+    """Group commit stage of the store, or None when COMMIT_WINDOW_MS is 0"""
+    if COMMIT_WINDOW_MS <= 0:
+        return None
+    return GroupCommit(COMMIT_WINDOW_MS / 1000, COMMIT_MAX_BATCH, on_flush=record_batch,
+                       on_commit=lambda seconds: metrics.observe('vape_commit_latency_seconds', seconds))
+
+export_jobs = ExportJobManager(EXPORT_DIR, EXPORT_WORKERS, EXPORT_CACHE_SIZE)
+atexit.register(audit_log.close)
+atexit.register(export_jobs.close)
+
+def log_transaction_event(tx, event_type, details):
+    """Log a transaction event to the audit history once tx commits"""
     event = {
-        'id': len(data['transaction_history']) + 1,
         'event_type': event_type,
         'timestamp': datetime.now().isoformat(),
+        'branch': tx.data.get('branch', DEFAULT_BRANCH),
         'details': details
     }
     
-    data['transaction_history'].append(event)
+    def persist():
+        with metrics.phase('persist'):
+            audit_log.append(event)
+    
+    tx.on_commit.append(persist)
     return event
 
-def calculate_financials(data):
-    """Calculate all financial metrics"""
-    cash_on_hand = 0
-    total_receivables = 0
-    total_cost_sold = 0
-    personal_use_recovery = 0  # Track personal use separately
-    
-    BASE_COST = data.get('settings', DEFAULT_SETTINGS)['base_cost']
-    
-    for txn in data['transactions']:
-        qty = txn['quantity']
-        price = txn['price']
-        cost = BASE_COST * qty
-        
-        if txn['type'] == 'Direct Sale':
-            cash_on_hand += price * qty
-            total_cost_sold += cost
-        elif txn['type'] == 'Personal Use':
-            personal_use_recovery += price * qty  # Track separately, not as cash
-            total_cost_sold += cost
-        elif txn['type'] == 'Consignment':
-            if txn['paid']:
-                cash_on_hand += price * qty
-            else:
-                total_receivables += price * qty
-            total_cost_sold += cost
+def low_stock_flavors(inventory):
+    """Flavors running low on stock"""
+    return [flavor for flavor, qty in inventory.items() if qty < LOW_STOCK_THRESHOLD]
+
+def describe_changes(branch, data, changes):
+    """Compact delta of one commit for /api/events subscribers"""
+    inventory = {}
+    pending = {'added': [], 'removed': []}
+    consignees = set()
+    for kind, path, old, new in changes:
+        section = path[0]
+        if section not in ('inventory', 'pending_transactions', 'consignees'):
+            continue
+        if len(path) == 1 and kind in ('set', 'delete'):
+            # A whole section was replaced
+            return {'version': data.get('version', 0), 'resync': True}
+        if section == 'inventory':
+            inventory[path[1]] = data['inventory'].get(path[1])
+        elif section == 'consignees':
+            consignees.add(path[1])
+        elif kind == 'append':
+            pending['added'].append(new)
+        elif kind == 'remove':
+            pending['removed'].append(old['id'])
+    
+    delta = {}
+    if inventory:
+        delta['inventory'] = inventory
+        delta['low_stock'] = low_stock_flavors(data['inventory'])
+    if pending['added'] or pending['removed']:
+        pending['count'] = len(data.get('pending_transactions', []))
+        delta['pending'] = pending
+    if consignees:
+        delta['consignee_debt'] = {
+            name: round_currency(branch.consignee_balances.total_debt(name)) for name in consignees
+        }
+    if not delta:
+        return None
+    delta['version'] = data.get('version', 0)
+    return delta
+
+def cached_response_keys(changes):
+    """Response cache keys a commit invalidates: the dashboard follows the
+    inventory, the ledger and settings; consignee summaries and payment
+    histories follow their consignee"""
+    keys = set()
+    for kind, path, old, new in changes:
+        section = path[0]
+        name = path[1] if len(path) > 1 else None
+        if section in ('inventory', 'transactions', 'settings'):
+            keys.add(('dashboard',))
+        elif section == 'consignees':
+            keys.add(('consignees',))
+            keys.add(('payments', name))
+        elif section == 'payments':
+            keys.add(('payments', name))
+    return keys
+
+class Branch:
+    """One branch's partition: a resident datastore (loaded once, reads served
+    from memory, writes persisted through the backend as part of a store
+    transaction), the views derived from it and its /api/events clients"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.store = DataStore(make_backend(branch=name), lambda: load_initial_data(name), shared=SHARED_STORAGE,
+                               upgrade=lambda tx: upgrade_data(tx, name), phase=metrics.phase,
+                               group_commit=make_group_commit())
+        self.financial_totals = self.store.add_view(FinancialTotals())
+        self.flavor_movements = self.store.add_view(FlavorMovements())
+        # The columnar copy only backs the VERIFY_AGGREGATES recompute
+        self.ledger_columns = self.store.add_view(ColumnarLedger()) if VERIFY_AGGREGATES else None
+        self.sales_rollups = self.store.add_view(SalesRollups())
+        self.consignee_balances = self.store.add_view(ConsigneeBalances())
+        self.ledger_order = self.store.add_view(LedgerOrder())
+        self.change_feed = self.store.add_view(ChangeFeed())
+        self.event_broker = EventBroker(EVENTS_QUEUE_SIZE, EVENTS_MAX_SUBSCRIBERS)
+        # Registered after consignee_balances, so debts are already updated when a delta is built
+        self.store.add_view(ChangePublisher(self.event_broker,
+                                            lambda data, changes: describe_changes(self, data, changes)))
+        self.response_cache = self.store.add_view(ResponseCache(cached_response_keys, RESPONSE_CACHE_BYTES))
+        atexit.register(self.store.close)
+
+branches = BranchRegistry(BRANCHES, Branch)
+# The default branch's store, for scripts written before branches existed
+store = branches.default.store
+
+@app.errorhandler(UnknownBranch)
+def unknown_branch(error):
+    return jsonify({'error': f'Unknown branch: {error}'}), 404
+
+def request_branch():
+    """Branch named by the request's ``branch`` parameter, or the default one"""
+    return branches.get(request.args.get('branch'))
+
+def cached_json(branch, key, build):
+    """JSON response served from the branch's response cache, built with
+    build() on a miss; call under its store.read() so the cached body matches
+    the data.
+    
+    The cache is bypassed while VERIFY_AGGREGATES is on, so every read is
+    still cross-checked.
+    """
+    if VERIFY_AGGREGATES:
+        return jsonify(build())
+    body = branch.response_cache.get(key)
+    if body is None:
+        body = branch.response_cache.put(key, jsonify(build()).get_data())
+    return Response(body, mimetype='application/json')
+
+def summarize_financials(totals, inventory, base_cost):
+    """Turn ledger totals into the rounded financial metrics"""
+    cash_on_hand = totals['cash_on_hand']
+    total_receivables = totals['total_receivables']
+    personal_use_recovery = totals['personal_use_recovery']
+    total_cost_sold = base_cost * totals['units_sold']
     
     # Calculate inventory value
-    inventory_value = sum(data['inventory'].values()) * BASE_COST
+    inventory_value = sum(inventory.values()) * base_cost
     
     # Calculate net profit
     net_profit = (cash_on_hand + total_receivables + personal_use_recovery) - total_cost_sold
@@ -242,110 +570,81 @@ def calculate_financials(data):
         'personal_use_recovery': round_currency(personal_use_recovery)
     }
 
-@app.route('/api/dashboard', methods=['GET'])
-def get_dashboard():
-    """Get dashboard data"""
-    data = load_data()
-    financials = calculate_financials(data)
-    
-    # Check for low stock alerts
-    low_stock = [flavor for flavor, qty in data['inventory'].items() if qty < 3]
-    
-    return jsonify({
-        'financials': financials,
-        'inventory': data['inventory'],
-        'low_stock': low_stock
-    })
+def calculate_financials(branch, data):
+    """Calculate all financial metrics over the full ledger (vectorized over
+    its columnar copy, kept while VERIFY_AGGREGATES is on)"""
+    BASE_COST = data.get('settings', DEFAULT_SETTINGS)['base_cost']
+    return summarize_financials(branch.ledger_columns.financial_totals(), data['inventory'], BASE_COST)
 
-@app.route('/api/transactions', methods=['GET', 'POST'])
-def handle_transactions():
-    """Get all transactions or add new transaction"""
-    data = load_data()
+def current_financials(branch, data):
+    """Financial metrics from the running totals, without a ledger scan"""
+    BASE_COST = data.get('settings', DEFAULT_SETTINGS)['base_cost']
+    financials = summarize_financials(branch.financial_totals.totals(), data['inventory'], BASE_COST)
     
-    if request.method == 'GET':
-        return jsonify(data['transactions'])
+    if VERIFY_AGGREGATES:
+        expected = calculate_financials(branch, data)
+        if financials != expected:
+            app.logger.warning('Financial totals of %s drifted from the ledger: %s != %s',
+                               branch.name, financials, expected)
+            branch.financial_totals.rebuild(data)
+            return expected
     
-    # POST - Add new PENDING transaction (not confirmed yet)
-    txn_data = request.json
-    flavor = txn_data['flavor']
-    quantity = int(txn_data['quantity'])
-    txn_type = txn_data['type']
-    price = float(txn_data['price'])
-    consignee = txn_data.get('consignee')
-    
-    # Validate stock
-    current_stock = data['inventory'][flavor]
-    if current_stock < quantity:
-        return jsonify({'error': f'Out of Stock! Only {current_stock} units available.'}), 400
-    
-    # Create PENDING transaction
+    return financials
+
+def parse_transaction(txn_data):
+    """Read the fields of a new transaction from a request body"""
+    return {
+        'flavor': txn_data['flavor'],
+        'quantity': int(txn_data['quantity']),
+        'type': txn_data['type'],
+        'price': float(txn_data['price']),
+        'consignee': txn_data.get('consignee')
+    }
+
+def stock_shortfalls(inventory, demand):
+    """Flavors whose stock cannot cover the summed quantities in demand, with what is available"""
+    return {
+        flavor: inventory.get(flavor, 0)
+        for flavor, quantity in demand.items()
+        if inventory.get(flavor, 0) < quantity
+    }
+
+def add_pending_transaction(tx, fields):
+    """Create a PENDING transaction (stock must already be validated)"""
     pending_transaction = {
-        'id': len(data.get('pending_transactions', [])) + 1,
-        'type': txn_type,
-        'flavor': flavor,
-        'quantity': quantity,
-        'price': price,
-        'consignee': consignee,
+        'id': tx.next_id('pending_transactions'),
+        'type': fields['type'],
+        'flavor': fields['flavor'],
+        'quantity': fields['quantity'],
+        'price': fields['price'],
+        'consignee': fields['consignee'],
         'timestamp': datetime.now().isoformat(),
         'status': 'pending'
     }
     
-    if 'pending_transactions' not in data:
-        data['pending_transactions'] = []
-    
-    data['pending_transactions'].append(pending_transaction)
+    tx.append(('pending_transactions',), pending_transaction)
     
     # Log event
-    log_transaction_event(data, 'transaction_created', {
+    log_transaction_event(tx, 'transaction_created', {
         'transaction_id': pending_transaction['id'],
-        'type': txn_type,
-        'flavor': flavor,
-        'quantity': quantity,
-        'price': price,
-        'consignee': consignee,
+        'type': fields['type'],
+        'flavor': fields['flavor'],
+        'quantity': fields['quantity'],
+        'price': fields['price'],
+        'consignee': fields['consignee'],
         'status': 'pending'
     })
-    
-    save_data(data)
-    
-    return jsonify({
-        'message': 'Transaction created and pending approval',
-        'transaction': pending_transaction
-    }), 201
-
-@app.route('/api/pending-transactions', methods=['GET'])
-def get_pending_transactions():
-    """Get all pending transactions"""
-    data = load_data()
-    return jsonify(data.get('pending_transactions', []))
+    return pending_transaction
 
-@app.route('/api/pending-transactions/<int:txn_id>/accept', methods=['POST'])
-def accept_transaction(txn_id):
-    """Accept a pending transaction"""
-    data = load_data()
-    
-    if 'pending_transactions' not in data:
-        return jsonify({'error': 'No pending transactions'}), 404
-    
-    # Find the pending transaction
-    pending_txn = None
-    for txn in data['pending_transactions']:
-        if txn['id'] == txn_id:
-            pending_txn = txn
-            break
-    
-    if not pending_txn:
-        return jsonify({'error': 'Transaction not found'}), 404
-    
-    # Validate stock again
+def confirm_pending_transaction(tx, pending_txn):
+    """Move a pending transaction to the ledger (stock must already be validated)"""
+    data = tx.data
     flavor = pending_txn['flavor']
     quantity = pending_txn['quantity']
-    if data['inventory'][flavor] < quantity:
-        return jsonify({'error': f'Out of Stock! Only {data["inventory"][flavor]} units available.'}), 400
     
     # Move to confirmed transactions
     confirmed_txn = {
-        'id': len(data['transactions']) + 1,
+        'id': tx.next_id('transactions'),
         'type': pending_txn['type'],
         'flavor': pending_txn['flavor'],
         'quantity': pending_txn['quantity'],
@@ -356,15 +655,13 @@ def accept_transaction(txn_id):
         'paid': pending_txn['type'] != 'Consignment'
     }
     
-    data['transactions'].append(confirmed_txn)
-    data['inventory'][flavor] -= quantity
+    tx.append(('transactions',), confirmed_txn)
+    tx.set(('inventory', flavor), data['inventory'][flavor] - quantity)
     
     # Update consignee tracking if consignment
     if pending_txn['type'] == 'Consignment' and pending_txn['consignee']:
-        consignee = pending_txn['consignee']
-        if consignee not in data['consignees']:
-            data['consignees'][consignee] = []
-        data['consignees'][consignee].append({
+        tx.append(('consignees', pending_txn['consignee']), {
+            'transaction_id': confirmed_txn['id'],
             'flavor': flavor,
             'quantity': quantity,
             'price': pending_txn['price'],
@@ -372,10 +669,10 @@ def accept_transaction(txn_id):
         })
     
     # Remove from pending
-    data['pending_transactions'] = [t for t in data['pending_transactions'] if t['id'] != txn_id]
+    tx.remove(('pending_transactions',), pending_txn['id'])
     
     # Log event
-    log_transaction_event(data, 'transaction_accepted', {
+    log_transaction_event(tx, 'transaction_accepted', {
         'transaction_id': confirmed_txn['id'],
         'type': confirmed_txn['type'],
         'flavor': confirmed_txn['flavor'],
@@ -383,227 +680,637 @@ def accept_transaction(txn_id):
         'price': confirmed_txn['price'],
         'consignee': confirmed_txn['consignee']
     })
+    return confirmed_txn
+
+def discard_pending_transaction(tx, rejected_txn):
+    """Remove a rejected pending transaction"""
+    tx.remove(('pending_transactions',), rejected_txn['id'])
     
-    save_data(data)
-    return jsonify({'message': 'Transaction accepted', 'transaction': confirmed_txn})
+    # Log event
+    log_transaction_event(tx, 'transaction_rejected', {
+        'transaction_id': rejected_txn['id'],
+        'type': rejected_txn['type'],
+        'flavor': rejected_txn['flavor'],
+        'quantity': rejected_txn['quantity'],
+        'price': rejected_txn['price'],
+        'consignee': rejected_txn.get('consignee')
+    })
 
-@app.route('/api/pending-transactions/<int:txn_id>/reject', methods=['POST'])
-def reject_transaction(txn_id):
-    """Reject a pending transaction"""
-    data = load_data()
+def tagged_response(etag, view, *args, **kwargs):
+    """Answer 304 when the client's If-None-Match already names etag, without
+    running the view, and tag the response with etag"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(view(*args, **kwargs))
     
-    if 'pending_transactions' not in data:
-        return jsonify({'error': 'No pending transactions'}), 404
+    if response.status_code in (200, 304):
+        response.set_etag(etag)
+        # Let browsers keep the response but revalidate it every time
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def all_branches_etag():
+    """ETag of a response built from every branch: all their data versions"""
+    versions = []
+    for branch in branches.all():
+        with branch.store.read():
+            versions.append(str(branch.store.version))
+    return 'v' + '.'.join(versions)
+
+def conditional(view):
+    """Tag GET responses with the branch's data version as ETag and answer
+    304 when the client's If-None-Match already names it, without running
+    the view"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        
+        if request.args.get('branch') == ALL_BRANCHES:
+            return tagged_response(all_branches_etag(), view, *args, **kwargs)
+        branch = request_branch()
+        with branch.store.read():
+            return tagged_response(f'v{branch.store.version}', view, *args, **kwargs)
+    return wrapper
+
+@app.route('/api/dashboard', methods=['GET'])
+@conditional
+def get_dashboard():
+    """Get dashboard data, for one branch or merged over all of them (branch=all)"""
+    if request.args.get('branch') == ALL_BRANCHES:
+        return jsonify(merged_dashboard())
+    
+    branch = request_branch()
+    with branch.store.read() as data:
+        def build():
+            financials = current_financials(branch, data)
+            
+            # Check for low stock alerts
+            low_stock = low_stock_flavors(data['inventory'])
+            
+            return {
+                'financials': financials,
+                'inventory': data['inventory'],
+                'low_stock': low_stock
+            }
+        
+        return cached_json(branch, ('dashboard',), build)
+
+def merged_dashboard():
+    """Dashboard over every branch, summed from each branch's running totals"""
+    financials = {}
+    inventory = {}
+    per_branch = {}
+    for branch in branches.all():
+        with branch.store.read() as data:
+            branch_financials = current_financials(branch, data)
+            branch_inventory = dict(data['inventory'])
+        
+        for key, value in branch_financials.items():
+            financials[key] = financials.get(key, 0) + value
+        for flavor, qty in branch_inventory.items():
+            inventory[flavor] = inventory.get(flavor, 0) + qty
+        per_branch[branch.name] = {
+            'financials': branch_financials,
+            'inventory': branch_inventory,
+            'low_stock': low_stock_flavors(branch_inventory)
+        }
     
-    # Find the transaction before removing
-    rejected_txn = None
-    for t in data['pending_transactions']:
-        if t['id'] == txn_id:
-            rejected_txn = t
-            break
+    return {
+        'financials': {key: round_currency(value) for key, value in financials.items()},
+        'inventory': inventory,
+        'low_stock': low_stock_flavors(inventory),
+        'branches': per_branch
+    }
+
+def page_response(fetch_page):
+    """Run a paginated list query for the current request.
+
+    Supports ``page_size``, ``cursor`` and ``fields``. Without ``page_size``
+    or ``cursor`` the matching records are returned as a plain list, as
+    before; otherwise as ``{'items': [...], 'next_cursor': id}``.
+    """
+    fields = parse_fields(request.args.get('fields'))
+    page_size = request.args.get('page_size', type=int)
+    cursor = request.args.get('cursor', type=int)
+    
+    page, next_cursor = fetch_page(page_size, cursor)
+    page = [project(record, fields) for record in page]
+    if page_size is None and cursor is None:
+        return jsonify(page)
+    return jsonify({'items': page, 'next_cursor': next_cursor})
+
+@app.route('/api/transactions', methods=['GET', 'POST'])
+@conditional
+def handle_transactions():
+    """Get all transactions or add new transaction"""
+    if request.method == 'GET':
+        # Optional filters: flavor, type, from/to (ISO dates), order=desc for newest first
+        flavor = request.args.get('flavor')
+        txn_type = request.args.get('type')
+        start = request.args.get('from')
+        end = request.args.get('to')
+        newest_first = request.args.get('order') == 'desc'
+        
+        def matches(txn):
+            return ((not flavor or txn['flavor'] == flavor) and
+                    (not txn_type or txn['type'] == txn_type) and
+                    in_time_range(txn['timestamp'], start, end))
+        
+        branch = request_branch()
+        with branch.store.read() as data:
+            transactions = data['transactions']
+            # The from/to range is found by binary search while the ledger is in
+            # time order; otherwise the filter alone applies it
+            bounds = time_bounds(transactions, start, end) if branch.ledger_order.ordered else None
+            return page_response(lambda page_size, cursor: paginate(
+                transactions, page_size, cursor, newest_first,
+                matches if (flavor or txn_type or start or end) else None, bounds
+            ))
     
-    # Remove from pending
-    initial_count = len(data['pending_transactions'])
-    data['pending_transactions'] = [t for t in data['pending_transactions'] if t['id'] != txn_id]
+    # POST - Add new PENDING transaction (not confirmed yet)
+    fields = parse_transaction(request.json)
     
-    if len(data['pending_transactions']) == initial_count:
-        return jsonify({'error': 'Transaction not found'}), 404
+    with request_branch().store.transaction() as tx:
+        # Validate stock
+        current_stock = tx.data['inventory'][fields['flavor']]
+        if current_stock < fields['quantity']:
+            return jsonify({'error': f'Out of Stock! Only {current_stock} units available.'}), 400
+        
+        pending_transaction = add_pending_transaction(tx, fields)
     
-    # Log event
-    if rejected_txn:
-        log_transaction_event(data, 'transaction_rejected', {
-            'transaction_id': rejected_txn['id'],
-            'type': rejected_txn['type'],
-            'flavor': rejected_txn['flavor'],
-            'quantity': rejected_txn['quantity'],
-            'price': rejected_txn['price'],
-            'consignee': rejected_txn.get('consignee')
-        })
+    return jsonify({
+        'message': 'Transaction created and pending approval',
+        'transaction': pending_transaction
+    }), 201
+
+@app.route('/api/pending-transactions', methods=['GET'])
+@conditional
+def get_pending_transactions():
+    """Get all pending transactions"""
+    with request_branch().store.read() as data:
+        return jsonify(data.get('pending_transactions', []))
+
+@app.route('/api/pending-transactions/<int:txn_id>/accept', methods=['POST'])
+def accept_transaction(txn_id):
+    """Accept a pending transaction"""
+    with request_branch().store.transaction() as tx:
+        data = tx.data
+        
+        if 'pending_transactions' not in data:
+            return jsonify({'error': 'No pending transactions'}), 404
+        
+        # Find the pending transaction
+        _, pending_txn = tx.find(('pending_transactions',), txn_id)
+        
+        if not pending_txn:
+            return jsonify({'error': 'Transaction not found'}), 404
+        
+        # Validate stock again
+        flavor = pending_txn['flavor']
+        quantity = pending_txn['quantity']
+        if data['inventory'][flavor] < quantity:
+            return jsonify({'error': f'Out of Stock! Only {data["inventory"][flavor]} units available.'}), 400
+        
+        confirmed_txn = confirm_pending_transaction(tx, pending_txn)
+    
+    return jsonify({'message': 'Transaction accepted', 'transaction': confirmed_txn})
+
+@app.route('/api/pending-transactions/<int:txn_id>/reject', methods=['POST'])
+def reject_transaction(txn_id):
+    """Reject a pending transaction"""
+    with request_branch().store.transaction() as tx:
+        if 'pending_transactions' not in tx.data:
+            return jsonify({'error': 'No pending transactions'}), 404
+        
+        # Find the transaction before removing
+        _, rejected_txn = tx.find(('pending_transactions',), txn_id)
+        
+        if not rejected_txn:
+            return jsonify({'error': 'Transaction not found'}), 404
+        
+        discard_pending_transaction(tx, rejected_txn)
     
-    save_data(data)
     return jsonify({'message': 'Transaction rejected and deleted'})
 
-@app.route('/api/transactions/<int:txn_id>', methods=['DELETE'])
-def delete_transaction(txn_id):
-    """Delete a confirmed transaction and restore inventory"""
-    data = load_data()
+@app.route('/api/transactions/batch', methods=['POST'])
+def create_transactions_batch():
+    """Create many PENDING transactions at once (all or nothing)"""
+    batch = request.json or {}
+    if not isinstance(batch, dict) or not isinstance(batch.get('transactions', []), list):
+        return jsonify({'error': 'Expected a JSON object with a transactions list'}), 400
+    entries = batch.get('transactions', [])
+    if not entries:
+        return jsonify({'error': 'No transactions given'}), 400
+    
+    with request_branch().store.transaction() as tx:
+        data = tx.data
+        
+        # Validate the whole batch up front
+        results = []
+        parsed = []
+        demand = {}
+        for index, txn_data in enumerate(entries):
+            result = {'index': index}
+            try:
+                fields = parse_transaction(txn_data)
+            except (KeyError, TypeError, ValueError):
+                result['error'] = 'Invalid transaction: flavor, quantity, type and price are required'
+                fields = None
+            else:
+                if fields['flavor'] not in data['inventory']:
+                    result['error'] = f'Unknown flavor: {fields["flavor"]}'
+                else:
+                    demand[fields['flavor']] = demand.get(fields['flavor'], 0) + fields['quantity']
+            results.append(result)
+            parsed.append(fields)
+        
+        shortfalls = stock_shortfalls(data['inventory'], demand)
+        for result, fields in zip(results, parsed):
+            if 'error' not in result and fields['flavor'] in shortfalls:
+                result['error'] = f'Out of Stock! Only {shortfalls[fields["flavor"]]} units of {fields["flavor"]} available for this batch.'
+        
+        if any('error' in result for result in results):
+            return jsonify({'error': 'Batch rejected, no transactions were created', 'results': results}), 400
+        
+        # Apply everything in this one store transaction
+        for result, fields in zip(results, parsed):
+            result['transaction'] = add_pending_transaction(tx, fields)
     
-    # Find the transaction
-    transaction = None
-    for txn in data['transactions']:
-        if txn['id'] == txn_id:
-            transaction = txn
-            break
-    
-    if not transaction:
-        return jsonify({'error': 'Transaction not found'}), 404
-    
-    # Restore inventory
-    flavor = transaction['flavor']
-    quantity = transaction['quantity']
-    data['inventory'][flavor] += quantity
-    
-    # Remove from consignee tracking if consignment
-    if transaction['type'] == 'Consignment' and transaction.get('consignee'):
-        consignee = transaction['consignee']
-        if consignee in data['consignees']:
-            # Remove the specific item
-            data['consignees'][consignee] = [
-                item for item in data['consignees'][consignee]
-                if not (item['flavor'] == flavor and item['quantity'] == quantity)
-            ]
-            # Remove consignee if no items left
-            if not data['consignees'][consignee]:
-                del data['consignees'][consignee]
-    
-    # Remove transaction
-    data['transactions'] = [t for t in data['transactions'] if t['id'] != txn_id]
+    return jsonify({
+        'message': f'{len(results)} transactions created and pending approval',
+        'results': results
+    }), 201
+
+@app.route('/api/pending-transactions/batch', methods=['POST'])
+def process_pending_batch():
+    """Accept and/or reject many pending transactions at once (all or nothing)"""
+    batch = request.json or {}
+    if not isinstance(batch, dict):
+        return jsonify({'error': 'Expected a JSON object with accept and/or reject lists'}), 400
+    accept, reject = batch.get('accept', []), batch.get('reject', [])
+    # bool is an int subclass, but true/false are not ids
+    if not all(isinstance(ids, list) and all(type(txn_id) is int for txn_id in ids) for ids in (accept, reject)):
+        return jsonify({'error': 'accept and reject must be lists of transaction ids'}), 400
+    actions = [('accept', txn_id) for txn_id in accept] + [('reject', txn_id) for txn_id in reject]
+    
+    if not actions:
+        return jsonify({'error': 'No transactions given'}), 400
+    
+    with request_branch().store.transaction() as tx:
+        data = tx.data
+        
+        # Validate the whole batch up front
+        results = []
+        pending = []
+        demand = {}
+        seen = set()
+        for action, txn_id in actions:
+            result = {'id': txn_id, 'action': action}
+            _, pending_txn = tx.find(('pending_transactions',), txn_id)
+            if txn_id in seen:
+                result['error'] = 'Transaction listed more than once'
+            elif not pending_txn:
+                result['error'] = 'Transaction not found'
+            elif action == 'accept':
+                flavor = pending_txn['flavor']
+                demand[flavor] = demand.get(flavor, 0) + pending_txn['quantity']
+            seen.add(txn_id)
+            results.append(result)
+            pending.append(pending_txn)
+        
+        shortfalls = stock_shortfalls(data['inventory'], demand)
+        for result, pending_txn in zip(results, pending):
+            if 'error' not in result and result['action'] == 'accept' and pending_txn['flavor'] in shortfalls:
+                flavor = pending_txn['flavor']
+                result['error'] = f'Out of Stock! Only {shortfalls[flavor]} units of {flavor} available for this batch.'
+        
+        if any('error' in result for result in results):
+            return jsonify({'error': 'Batch rejected, no transactions were changed', 'results': results}), 400
+        
+        # Apply everything in this one store transaction
+        for result, pending_txn in zip(results, pending):
+            if result['action'] == 'accept':
+                result['transaction'] = confirm_pending_transaction(tx, pending_txn)
+                result['status'] = 'accepted'
+            else:
+                discard_pending_transaction(tx, pending_txn)
+                result['status'] = 'rejected'
     
-    # Log event
-    log_transaction_event(data, 'transaction_deleted', {
-        'transaction_id': txn_id,
-        'type': transaction['type'],
-        'flavor': flavor,
-        'quantity': quantity,
-        'price': transaction['price'],
-        'consignee': transaction.get('consignee'),
-        'inventory_restored': True
+    accepted = sum(1 for result in results if result['status'] == 'accepted')
+    return jsonify({
+        'message': f'{accepted} accepted, {len(results) - accepted} rejected',
+        'results': results
     })
+
+@app.route('/api/transactions/<int:txn_id>', methods=['DELETE'])
+def delete_transaction(txn_id):
+    """Delete a confirmed transaction and restore inventory"""
+    with request_branch().store.transaction() as tx:
+        data = tx.data
+        
+        # Find the transaction
+        _, transaction = tx.find(('transactions',), txn_id)
+        
+        if not transaction:
+            return jsonify({'error': 'Transaction not found'}), 404
+        
+        # Restore inventory
+        flavor = transaction['flavor']
+        quantity = transaction['quantity']
+        tx.set(('inventory', flavor), data['inventory'][flavor] + quantity)
+        
+        # Remove from consignee tracking if consignment
+        if transaction['type'] == 'Consignment' and transaction.get('consignee'):
+            consignee = transaction['consignee']
+            if consignee in data['consignees']:
+                # Remove the item created with this transaction
+                remaining_items = list(data['consignees'][consignee])
+                position = find_consignee_item(remaining_items, transaction)
+                if position is not None:
+                    del remaining_items[position]
+                # Remove consignee if no items left
+                if remaining_items:
+                    tx.set(('consignees', consignee), remaining_items)
+                else:
+                    tx.delete(('consignees', consignee))
+        
+        # Remove transaction
+        tx.remove(('transactions',), txn_id)
+        
+        # Log event
+        log_transaction_event(tx, 'transaction_deleted', {
+            'transaction_id': txn_id,
+            'type': transaction['type'],
+            'flavor': flavor,
+            'quantity': quantity,
+            'price': transaction['price'],
+            'consignee': transaction.get('consignee'),
+            'inventory_restored': True
+        })
     
-    save_data(data)
     return jsonify({
         'message': 'Transaction deleted and inventory restored',
         'restored': {'flavor': flavor, 'quantity': quantity}
     })
 
+@app.route('/api/inventory/movements', methods=['GET'])
+@conditional
+def get_inventory_movements():
+    """Get units moved per flavor and transaction type, optionally per day/week/month"""
+    bucket = request.args.get('bucket')
+    flavor = request.args.get('flavor')
+    
+    if bucket and bucket not in ('day', 'week', 'month'):
+        return jsonify({'error': 'bucket must be day, week or month'}), 400
+    
+    branch = request_branch()
+    with branch.store.read() as data:
+        flavors = [flavor] if flavor else list(data['inventory'])
+        
+        if not bucket:
+            return jsonify({
+                flavor: {
+                    'movements': branch.flavor_movements.flavor_totals(flavor),
+                    'remaining': data['inventory'].get(flavor, 0)
+                }
+                for flavor in flavors
+            })
+        
+        periods = branch.flavor_movements.buckets(bucket, request.args.get('from'), request.args.get('to'), flavor)
+        return jsonify([{'period': period, 'movements': movements} for period, movements in periods])
+
+def sales_metrics(totals, base_cost):
+    """Rounded sales figures of one period, with cost and gross profit at the current base cost"""
+    cost = base_cost * totals['units']
+    return {
+        'transactions': totals['transactions'],
+        'units': totals['units'],
+        'revenue': round_currency(totals['revenue']),
+        'unpaid': round_currency(totals['unpaid']),
+        'cost': round_currency(cost),
+        'gross_profit': round_currency(totals['revenue'] - cost)
+    }
+
+@app.route('/api/analytics/sales', methods=['GET'])
+@conditional
+def get_sales_analytics():
+    """Get confirmed sales per day, week or month from the rollups.
+    
+    Optional filters: flavor, type, consignee, and from/to dates (inclusive;
+    a year or month such as 2024-03 covers all of it).
+    """
+    bucket = request.args.get('bucket', 'month')
+    if bucket not in ('day', 'week', 'month'):
+        return jsonify({'error': 'bucket must be day, week or month'}), 400
+    
+    branch = request_branch()
+    with branch.store.read() as data:
+        base_cost = data.get('settings', DEFAULT_SETTINGS)['base_cost']
+        try:
+            periods = branch.sales_rollups.series(
+                bucket, request.args.get('from'), request.args.get('to'),
+                flavor=request.args.get('flavor'), txn_type=request.args.get('type'),
+                consignee=request.args.get('consignee')
+            )
+        except ValueError:
+            return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    totals = dict.fromkeys(SalesRollups.METRICS, 0)
+    for period, metrics in periods:
+        for key, value in metrics.items():
+            totals[key] += value
+    
+    return jsonify({
+        'bucket': bucket,
+        'periods': [{'period': period, **sales_metrics(metrics, base_cost)} for period, metrics in periods],
+        'totals': sales_metrics(totals, base_cost)
+    })
+
+def consignee_summary(branch, name, items):
+    """Outstanding debt and unpaid items of one consignee"""
+    return {
+        'total_debt': round_currency(branch.consignee_balances.total_debt(name)),
+        'items': [items[index] for index in branch.consignee_balances.open_items(name)]
+    }
+
 @app.route('/api/consignees', methods=['GET'])
+@conditional
 def get_consignees():
     """Get consignee debt summary"""
-    data = load_data()
-    summary = {}
-    
-    for name, items in data['consignees'].items():
-        total_debt = sum(item['quantity'] * item['price'] for item in items if not item['paid'])
-        unpaid_items = [item for item in items if not item['paid']]
-        summary[name] = {
-            'total_debt': round_currency(total_debt),
-            'items': unpaid_items
-        }
-    
-    return jsonify(summary)
+    branch = request_branch()
+    with branch.store.read() as data:
+        def build():
+            summary = {}
+            
+            for name, items in data['consignees'].items():
+                summary[name] = consignee_summary(branch, name, items)
+            
+            return summary
+        
+        return cached_json(branch, ('consignees',), build)
+
+def records_delta(branch, data, section, ids):
+    """Current versions of the touched records of a list, and the ids that are gone"""
+    upserted, deleted = [], []
+    for record_id in sorted(ids):
+        record = branch.store.index.lookup(data, section, record_id)
+        if record is None:
+            deleted.append(record_id)
+        else:
+            upserted.append(record)
+    return {'upserted': upserted, 'deleted': deleted}
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Get what changed since a data version (the ETag / previous 'version')"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since=<version> is required'}), 400
+    
+    branch = request_branch()
+    store = branch.store
+    with store.read() as data:
+        touched = branch.change_feed.since(since)
+        if touched is None or since > store.version:
+            # Too old (or unknown) to describe as a delta: refetch everything
+            return jsonify({'version': store.version, 'resync': True})
+        
+        inventory = data['inventory']
+        consignees = data['consignees']
+        return jsonify({
+            'version': store.version,
+            'resync': False,
+            'inventory': {flavor: inventory.get(flavor) for flavor in touched['inventory']},
+            'transactions': records_delta(branch, data, 'transactions', touched['transactions']),
+            'pending_transactions': records_delta(branch, data, 'pending_transactions',
+                                                  touched['pending_transactions']),
+            'consignees': {
+                name: consignee_summary(branch, name, consignees[name]) if name in consignees else None
+                for name in touched['consignees']
+            },
+            'settings': data.get('settings', DEFAULT_SETTINGS) if touched['settings'] else None
+        })
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Server-sent events: a compact delta of inventory, low stock, pending
+    transactions and consignee debt after every change"""
+    # Subscribe under the read lock so no commit falls between the version
+    # the client starts from and its first delta
+    branch = request_branch()
+    store, event_broker = branch.store, branch.event_broker
+    with store.read():
+        subscriber = event_broker.subscribe()
+        version = store.version
+    if subscriber is None:
+        return jsonify({'error': 'Too many event subscribers'}), 503
+    
+    def generate():
+        try:
+            yield encode_event({'version': version}, 'hello', version)
+            while True:
+                messages = subscriber.drain(EVENTS_HEARTBEAT)
+                if messages:
+                    yield b''.join(messages)
+                if subscriber.dropped:
+                    yield encode_event({'reason': 'Client fell behind; reconnect and resync'}, 'dropped')
+                    return
+                if not messages:
+                    # Reading catches up with commits from other workers,
+                    # which publishes their deltas to this worker's clients
+                    with store.read():
+                        pass
+                    yield b': keep-alive\n\n'
+        finally:
+            event_broker.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/consignees/<name>/pay', methods=['POST'])
 def mark_consignee_paid(name):
     """Mark a consignee's debt as paid"""
-    data = load_data()
-    
-    if name not in data['consignees']:
-        return jsonify({'error': 'Consignee not found'}), 404
-    
-    # Mark all items as paid
-    for item in data['consignees'][name]:
-        item['paid'] = True
-    
-    # Calculate total paid
-    total_paid = sum(item['quantity'] * item['price'] for item in data['consignees'][name] if not item['paid'])
-    
-    # Update transactions
-    for txn in data['transactions']:
-        if txn['consignee'] == name and not txn['paid']:
-            txn['paid'] = True
-    
-    # Log event
-    log_transaction_event(data, 'consignee_full_payment', {
-        'consignee': name,
-        'amount': round_currency(total_paid),
-        'payment_type': 'full'
-    })
+    branch = request_branch()
+    with branch.store.transaction() as tx:
+        data = tx.data
+        
+        if name not in data['consignees']:
+            return jsonify({'error': 'Consignee not found'}), 404
+        
+        # Calculate total paid
+        total_paid = branch.consignee_balances.total_debt(name)
+        items = data['consignees'][name]
+        open_items = [items[index] for index in branch.consignee_balances.open_items(name)]
+        
+        # Mark all items as paid
+        tx.set(('consignees', name), [dict(item, paid=True) for item in items])
+        
+        # Update transactions
+        for item in open_items:
+            _mark_consignment_paid(tx, item)
+        
+        # Log event
+        log_transaction_event(tx, 'consignee_full_payment', {
+            'consignee': name,
+            'amount': round_currency(total_paid),
+            'payment_type': 'full'
+        })
     
-    save_data(data)
     return jsonify({'message': f'{name} marked as paid'})
 
+def _mark_consignment_paid(tx, item):
+    """Flag the consignment transaction behind a paid-off item as paid"""
+    _, txn = tx.find(('transactions',), item.get('transaction_id'))
+    if txn is not None and not txn['paid']:
+        tx.update(('transactions',), txn['id'], {'paid': True})
+
 @app.route('/api/consignees/<name>/partial-pay', methods=['POST'])
 def partial_payment(name):
     """Record a partial payment for a consignee"""
-    data = load_data()
-    
-    if name not in data['consignees']:
-        return jsonify({'error': 'Consignee not found'}), 404
-    
     payment_data = request.json
     amount = float(payment_data.get('amount', 0))
     selected_items = payment_data.get('selected_items', [])  # List of item indices
     
-    if amount <= 0:
-        return jsonify({'error': 'Payment amount must be greater than 0'}), 400
-    
-    # Calculate total debt
-    total_debt = sum(item['quantity'] * item['price'] for item in data['consignees'][name] if not item['paid'])
-    
-    if amount > total_debt:
-        return jsonify({'error': f'Payment amount (₱{amount:.2f}) exceeds total debt (₱{total_debt:.2f})'}), 400
-    
-    # Initialize payment tracking if not exists
-    if 'payments' not in data:
-        data['payments'] = {}
-    if name not in data['payments']:
-        data['payments'][name] = []
-    
-    # Record the payment
-    payment_record = {
-        'amount': round_currency(amount),
-        'timestamp': datetime.now().isoformat(),
-        'remaining_debt': round_currency(total_debt - amount),
-        'items_paid': []
-    }
-    
-    # If specific items are selected, pay those first
-    remaining_payment = amount
-    
-    if selected_items:
-        # Pay selected items first
-        for idx in selected_items:
-            if idx < len(data['consignees'][name]) and remaining_payment > 0:
-                item = data['consignees'][name][idx]
-                if not item['paid']:
-                    item_total = item['quantity'] * item['price']
-                    partial_paid = item.get('partial_payment', 0)
-                    item_remaining = item_total - partial_paid
-                    
-                    if remaining_payment >= item_remaining:
-                        # Fully pay this item
-                        item['paid'] = True
-                        remaining_payment -= item_remaining
-                        payment_record['items_paid'].append({
-                            'flavor': item['flavor'],
-                            'quantity': item['quantity'],
-                            'amount': item_remaining,
-                            'status': 'fully_paid'
-                        })
-                        
-                        # Update corresponding transaction
-                        for txn in data['transactions']:
-                            if (txn['consignee'] == name and 
-                                txn['flavor'] == item['flavor'] and 
-                                txn['quantity'] == item['quantity'] and
-                                not txn['paid']):
-                                txn['paid'] = True
-                                break
-                    else:
-                        # Partial payment for this item
-                        if 'partial_payment' not in item:
-                            item['partial_payment'] = 0
-                        item['partial_payment'] += remaining_payment
-                        payment_record['items_paid'].append({
-                            'flavor': item['flavor'],
-                            'quantity': item['quantity'],
-                            'amount': remaining_payment,
-                            'status': 'partially_paid'
-                        })
-                        remaining_payment = 0
-    else:
-        # No specific items selected, pay proportionally (FIFO)
-        for item in data['consignees'][name]:
+    branch = request_branch()
+    with branch.store.transaction() as tx:
+        data = tx.data
+        
+        if name not in data['consignees']:
+            return jsonify({'error': 'Consignee not found'}), 404
+        
+        if amount <= 0:
+            return jsonify({'error': 'Payment amount must be greater than 0'}), 400
+        
+        # Work on copies so the updated item list is written back in one change
+        items = [dict(item) for item in data['consignees'][name]]
+        
+        # Calculate total debt
+        total_debt = branch.consignee_balances.total_debt(name)
+        
+        if amount > total_debt:
+            return jsonify({'error': f'Payment amount (₱{amount:.2f}) exceeds total debt (₱{total_debt:.2f})'}), 400
+        
+        # Record the payment
+        payment_record = {
+            'amount': round_currency(amount),
+            'timestamp': datetime.now().isoformat(),
+            'remaining_debt': round_currency(total_debt - amount),
+            'items_paid': []
+        }
+        
+        # If specific items are selected, pay those first
+        remaining_payment = amount
+        
+        if selected_items:
+            # Pay selected items first
+            targets = [items[idx] for idx in selected_items if idx < len(items)]
+        else:
+            # No specific items selected, pay proportionally (FIFO)
+            targets = [items[idx] for idx in branch.consignee_balances.open_items(name)]
+        
+        for item in targets:
             if not item['paid'] and remaining_payment > 0:
                 item_total = item['quantity'] * item['price']
                 partial_paid = item.get('partial_payment', 0)
@@ -621,13 +1328,7 @@ def partial_payment(name):
                     })
                     
                     # Update corresponding transaction
-                    for txn in data['transactions']:
-                        if (txn['consignee'] == name and 
-                            txn['flavor'] == item['flavor'] and 
-                            txn['quantity'] == item['quantity'] and
-                            not txn['paid']):
-                            txn['paid'] = True
-                            break
+                    _mark_consignment_paid(tx, item)
                 else:
                     # Partial payment for this item
                     if 'partial_payment' not in item:
@@ -640,19 +1341,18 @@ def partial_payment(name):
                         'status': 'partially_paid'
                     })
                     remaining_payment = 0
-    
-    data['payments'][name].append(payment_record)
-    
-    # Log event
-    log_transaction_event(data, 'consignee_partial_payment', {
-        'consignee': name,
-        'amount': round_currency(amount),
-        'remaining_debt': round_currency(total_debt - amount),
-        'payment_type': 'partial',
-        'items_paid': payment_record['items_paid']
-    })
-    
-    save_data(data)
+        
+        tx.set(('consignees', name), items)
+        tx.append(('payments', name), payment_record)
+        
+        # Log event
+        log_transaction_event(tx, 'consignee_partial_payment', {
+            'consignee': name,
+            'amount': round_currency(amount),
+            'remaining_debt': round_currency(total_debt - amount),
+            'payment_type': 'partial',
+            'items_paid': payment_record['items_paid']
+        })
     
     return jsonify({
         'message': f'Partial payment of ₱{amount:.2f} recorded for {name}',
@@ -661,109 +1361,280 @@ def partial_payment(name):
     })
 
 @app.route('/api/consignees/<name>/payments', methods=['GET'])
+@conditional
 def get_payment_history(name):
     """Get payment history for a consignee"""
-    data = load_data()
+    branch = request_branch()
+    with branch.store.read() as data:
+        if name not in data['consignees']:
+            return jsonify({'error': 'Consignee not found'}), 404
+        
+        return cached_json(branch, ('payments', name), lambda: data.get('payments', {}).get(name, []))
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get response cache size and hit/miss counters"""
+    return jsonify(request_branch().response_cache.stats())
+
+def ledger_size(branch):
+    """Number of confirmed transactions in a branch"""
+    with branch.store.read() as data:
+        return len(data['transactions'])
+
+def loaded_branches_total(read):
+    """Sum of read(branch) over the branches this worker has loaded"""
+    return lambda: sum(read(branch) for branch in branches.loaded())
+
+metrics.add_gauge('vape_data_version', 'Data version (committed transactions), summed over branches',
+                  loaded_branches_total(lambda branch: branch.store.version))
+metrics.add_gauge('vape_ledger_transactions', 'Confirmed transactions in the ledgers',
+                  loaded_branches_total(ledger_size))
+metrics.add_gauge('vape_response_cache_bytes', 'Bytes held by the response caches',
+                  loaded_branches_total(lambda branch: branch.response_cache.size))
+metrics.add_gauge('vape_event_subscribers', 'Connected /api/events clients',
+                  loaded_branches_total(lambda branch: len(branch.event_broker.subscribers)))
+metrics.add_gauge('vape_pinned_snapshots', 'Store snapshots pinned by running exports',
+                  loaded_branches_total(lambda branch: sum(branch.store.pinned.values())))
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request metrics in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled (set VAPE_METRICS=1)'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/profile', methods=['GET', 'POST'])
+def route_profile():
+    """Start a cProfile capture of the next requests of a route (POST), or
+    get the pstats listing of the capture so far (GET)"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled (set VAPE_METRICS=1)'}), 404
+    
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        route = body.get('route')
+        requests = body.get('requests', 10)
+        if route not in {rule.rule for rule in app.url_map.iter_rules()}:
+            return jsonify({'error': 'route must be a URL rule of the API, e.g. /api/dashboard'}), 400
+        if not isinstance(requests, int) or not 1 <= requests <= 1000:
+            return jsonify({'error': 'requests must be between 1 and 1000'}), 400
+        profiler.arm(route, requests)
+        return jsonify(profiler.status())
+    
+    try:
+        limit = int(request.args.get('limit', 40))
+        report = profiler.report(request.args.get('sort', 'cumulative'), limit)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Invalid sort or limit'}), 400
+    if report is None:
+        return jsonify({'error': 'Nothing captured yet', **profiler.status()}), 404
+    return Response(report, mimetype='text/plain')
+
+INVENTORY_COLUMNS = ['Flavor', 'Initial', 'Sold', 'Consigned', 'Personal', 'Remaining', 'Status']
+FINANCIAL_COLUMNS = ['Metric', 'Value (₱)']
+CONSIGNEE_COLUMNS = ['Consignee', 'Flavor', 'Quantity', 'Price (₱)', 'Total (₱)', 'Paid']
+LEDGER_COLUMNS = ['ID', 'Type', 'Flavor', 'Quantity', 'Price (₱)', 'Total (₱)',
+                  'Consignee', 'Timestamp', 'Confirmed At', 'Paid']
+
+def export_snapshot(branch, data):
+    """Pin the data an export needs; call under the branch's store lock.
+    
+    Returns the pinned store snapshot and the export_sheets() arguments. The
+    rows themselves are produced later, while writing, outside the lock, from
+    the pinned version; writes that land meanwhile copy what they change
+    instead of altering it. Release the snapshot once the export is written.
+    """
+    pinned = branch.store.snapshot()
+    return pinned, (
+        data['inventory'],
+        data['transactions'],
+        data['consignees'],
+        current_financials(branch, data),
+        {flavor: branch.flavor_movements.flavor_totals(flavor) for flavor in FLAVORS}
+    )
+
+def export_sheets(inventory, transactions, consignees, financials, movements):
+    """Build the export sheets as (name, columns, row generator) tuples"""
+    def inventory_rows():
+        for flavor in FLAVORS:
+            remaining = inventory[flavor]
+            moved = movements[flavor]
+            status = 'Low Stock' if remaining < LOW_STOCK_THRESHOLD else 'OK'
+            yield [flavor, INITIAL_STOCK, moved.get('Direct Sale', 0), moved.get('Consignment', 0),
+                   moved.get('Personal Use', 0), remaining, status]
+    
+    financial_rows = [
+        ['Cash on Hand', financials['cash_on_hand']],
+        ['Total Receivables', financials['total_receivables']],
+        ['Inventory Value', financials['inventory_value']],
+        ['Total Cost Sold', financials['total_cost_sold']],
+        ['Net Profit', financials['net_profit']]
+    ]
+    
+    def consignee_rows():
+        for name, items in consignees.items():
+            for item in items:
+                yield [name, item['flavor'], item['quantity'], item['price'],
+                       round_currency(item['quantity'] * item['price']), 'Yes' if item['paid'] else 'No']
+    
+    def ledger_rows():
+        for t in transactions:
+            yield [t['id'], t['type'], t['flavor'], t['quantity'], t['price'],
+                   round_currency(t['quantity'] * t['price']), t.get('consignee') or '',
+                   t['timestamp'], t.get('confirmed_at', ''), 'Yes' if t['paid'] else 'No']
+    
+    return [
+        ('Inventory', INVENTORY_COLUMNS, inventory_rows()),
+        ('Financials', FINANCIAL_COLUMNS, financial_rows),
+        ('Consignees', CONSIGNEE_COLUMNS, consignee_rows()),
+        ('Ledger', LEDGER_COLUMNS, ledger_rows())
+    ]
+
+EXPORT_SHEETS = ('inventory', 'financials', 'consignees', 'ledger')
+
+def submit_export(branch, export_format, sheet_name):
+    """Queue an export of a branch's current data, or reuse the cached one for this version"""
+    with branch.store.read() as data:
+        key = (branch.name, branch.store.version, export_format, sheet_name)
+        job = export_jobs.cached(key)
+        if job:
+            return job
+        
+        pinned, snapshot = export_snapshot(branch, data)
+    
+    inventory, transactions, consignees, financials, movements = snapshot
+    sheet_rows = {
+        'inventory': len(FLAVORS),
+        'financials': 5,
+        'consignees': sum(len(items) for items in consignees.values()),
+        'ledger': len(transactions)
+    }
     
-    if name not in data['consignees']:
-        return jsonify({'error': 'Consignee not found'}), 404
+    def build(fileobj, job):
+        try:
+            sheets = [(name, columns, job.track(rows)) for name, columns, rows in export_sheets(*snapshot)]
+            if export_format == 'csv':
+                name, columns, rows = sheets[EXPORT_SHEETS.index(sheet_name)]
+                for chunk in iter_csv(columns, rows):
+                    fileobj.write(chunk.encode('utf-8'))
+            else:
+                write_xlsx(fileobj, sheets)
+        finally:
+            pinned.release()
     
-    payments = data.get('payments', {}).get(name, [])
-    return jsonify(payments)
+    if export_format == 'csv':
+        filename = f'Vape_Business_{sheet_name.capitalize()}.csv'
+        total_rows = sheet_rows[sheet_name]
+    else:
+        filename = 'Vape_Business_Data.xlsx'
+        total_rows = sum(sheet_rows.values())
+    try:
+        return export_jobs.submit(key, total_rows, filename, build, discard=pinned.release)
+    except BaseException:
+        pinned.release()
+        raise
+
+def send_export(job):
+    """Send a finished export artifact"""
+    mimetype = 'text/csv' if job.filename.endswith('.csv') else XLSX_MIMETYPE
+    return send_file(job.path, as_attachment=True, download_name=job.filename, mimetype=mimetype)
+
+def export_job_response(job):
+    return {
+        **job.to_dict(),
+        'status_url': f'/api/export/jobs/{job.id}',
+        'download_url': f'/api/export/jobs/{job.id}/download'
+    }
 
 @app.route('/api/export', methods=['GET'])
 def export_excel():
-    """Export data to Excel"""
-    data = load_data()
-    
-    # Sheet 1: Inventory
-    inventory_data = []
-    for flavor in FLAVORS:
-        initial = INITIAL_STOCK
-        remaining = data['inventory'][flavor]
-        
-        # Calculate sold, consigned, personal
-        sold = sum(t['quantity'] for t in data['transactions'] 
-                  if t['flavor'] == flavor and t['type'] == 'Direct Sale')
-        consigned = sum(t['quantity'] for t in data['transactions'] 
-                       if t['flavor'] == flavor and t['type'] == 'Consignment')
-        personal = sum(t['quantity'] for t in data['transactions'] 
-                      if t['flavor'] == flavor and t['type'] == 'Personal Use')
-        
-        status = 'Low Stock' if remaining < 3 else 'OK'
-        
-        inventory_data.append({
-            'Flavor': flavor,
-            'Initial': initial,
-            'Sold': sold,
-            'Consigned': consigned,
-            'Personal': personal,
-            'Remaining': remaining,
-            'Status': status
+    """Export data to Excel (default) or a single sheet as CSV (format=csv&sheet=ledger).
+    
+    With async=1 the export is queued and a job is returned instead of the file.
+    """
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({'error': f'Unknown export format: {export_format}'}), 400
+    
+    sheet_name = request.args.get('sheet', 'ledger').lower() if export_format == 'csv' else None
+    if sheet_name and sheet_name not in EXPORT_SHEETS:
+        return jsonify({'error': f'Unknown sheet: {sheet_name}'}), 400
+    
+    branch = request_branch()
+    if request.args.get('async') in ('1', 'true'):
+        job = submit_export(branch, export_format, sheet_name)
+        return jsonify(export_job_response(job)), 200 if job.status == 'done' else 202
+    
+    if export_format == 'csv':
+        # Stream straight to the client
+        with branch.store.read() as data:
+            pinned, snapshot = export_snapshot(branch, data)
+        name, columns, rows = export_sheets(*snapshot)[EXPORT_SHEETS.index(sheet_name)]
+        
+        def stream():
+            try:
+                yield from iter_csv(columns, rows)
+            finally:
+                pinned.release()
+        return Response(stream(), mimetype='text/csv', headers={
+            'Content-Disposition': f'attachment; filename=Vape_Business_{name}.csv'
         })
     
-    df_inventory = pd.DataFrame(inventory_data)
-    
-    # Sheet 2: Financials
-    financials = calculate_financials(data)
-    df_financials = pd.DataFrame([
-        {'Metric': 'Cash on Hand', 'Value (₱)': financials['cash_on_hand']},
-        {'Metric': 'Total Receivables', 'Value (₱)': financials['total_receivables']},
-        {'Metric': 'Inventory Value', 'Value (₱)': financials['inventory_value']},
-        {'Metric': 'Total Cost Sold', 'Value (₱)': financials['total_cost_sold']},
-        {'Metric': 'Net Profit', 'Value (₱)': financials['net_profit']}
-    ])
-    
-    # Sheet 3: Consignees
-    consignee_data = []
-    for name, items in data['consignees'].items():
-        for item in items:
-            consignee_data.append({
-                'Consignee': name,
-                'Flavor': item['flavor'],
-                'Quantity': item['quantity'],
-                'Price (₱)': item['price'],
-                'Total (₱)': round_currency(item['quantity'] * item['price']),
-                'Paid': 'Yes' if item['paid'] else 'No'
-            })
-    
-    df_consignees = pd.DataFrame(consignee_data)
-    
-    # Write to Excel
-    filename = 'Vape_Business_Data.xlsx'
-    with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
-        df_inventory.to_excel(writer, sheet_name='Inventory', index=False)
-        df_financials.to_excel(writer, sheet_name='Financials', index=False)
-        df_consignees.to_excel(writer, sheet_name='Consignees', index=False)
-    
-    return send_file(filename, as_attachment=True)
+    job = submit_export(branch, export_format, sheet_name)
+    job.finished.wait()
+    if job.status != 'done':
+        return jsonify({'error': f'Export failed: {job.error}'}), 500
+    return send_export(job)
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+def get_export_job(job_id):
+    """Get the status and progress of an export job"""
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    return jsonify(export_job_response(job))
+
+@app.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    """Download the result of a finished export job"""
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    if job.status != 'done':
+        return jsonify({'error': f'Export is {job.status}', **export_job_response(job)}), 409
+    return send_export(job)
 
 @app.route('/api/reset', methods=['POST'])
 def reset_database():
-    """Reset database to initial state"""
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-    initialize_database()
+    """Reset one branch (branch=<name>), or every branch and the history, to the initial state"""
+    name = request.args.get('branch')
+    if name:
+        branch = branches.get(name)
+        branch.store.reset(initialize_branch(branch.name))
+        return jsonify({'message': f'Branch {branch.name} reset successfully'})
+    
+    audit_log.reset()
+    for branch in branches.all():
+        branch.store.reset(initialize_branch(branch.name))
     return jsonify({'message': 'Database reset successfully'})
 
 @app.route('/api/settings', methods=['GET', 'PUT'])
+@conditional
 def handle_settings():
     """Get or update settings"""
-    data = load_data()
-    
     if request.method == 'GET':
-        return jsonify(data.get('settings', DEFAULT_SETTINGS))
+        with request_branch().store.read() as data:
+            return jsonify(data.get('settings', DEFAULT_SETTINGS))
     
     # PUT - Update settings
     new_settings = request.json
-    data['settings'] = new_settings
-    save_data(data)
+    with request_branch().store.transaction() as tx:
+        tx.set(('settings',), new_settings)
     return jsonify({'message': 'Settings updated successfully', 'settings': new_settings})
 
 @app.route('/api/consignment/bulk', methods=['POST'])
 def add_bulk_consignment():
     """Add bulk consignment for multiple flavors"""
-    data = load_data()
     bulk_data = request.json
     
     consignee = bulk_data['consignee']
@@ -772,66 +1643,67 @@ def add_bulk_consignment():
     if not consignee.strip():
         return jsonify({'error': 'Consignee name is required'}), 400
     
-    # Validate all items first
-    for item in items:
-        flavor = item['flavor']
-        quantity = int(item['quantity'])
+    with request_branch().store.transaction() as tx:
+        data = tx.data
         
-        if data['inventory'][flavor] < quantity:
+        # Validate all items first (a flavor listed twice needs stock for both)
+        demand = {}
+        for item in items:
+            demand[item['flavor']] = demand.get(item['flavor'], 0) + int(item['quantity'])
+        
+        shortfalls = stock_shortfalls(data['inventory'], demand)
+        if shortfalls:
+            flavor, available = next(iter(shortfalls.items()))
             return jsonify({
-                'error': f'Out of Stock! {flavor} only has {data["inventory"][flavor]} units available.'
+                'error': f'Out of Stock! {flavor} only has {available} units available.'
             }), 400
-    
-    # Process all items
-    added_items = []
-    for item in items:
-        flavor = item['flavor']
-        quantity = int(item['quantity'])
-        price = float(item['price'])
         
-        # Create transaction
-        transaction = {
-            'id': len(data['transactions']) + 1,
-            'type': 'Consignment',
-            'flavor': flavor,
-            'quantity': quantity,
-            'price': price,
-            'consignee': consignee,
-            'timestamp': datetime.now().isoformat(),
-            'paid': False
-        }
-        
-        data['transactions'].append(transaction)
-        data['inventory'][flavor] -= quantity
-        
-        # Update consignee tracking
-        if consignee not in data['consignees']:
-            data['consignees'][consignee] = []
-        
-        data['consignees'][consignee].append({
-            'flavor': flavor,
-            'quantity': quantity,
-            'price': price,
-            'paid': False
-        })
+        # Process all items
+        added_items = []
+        for item in items:
+            flavor = item['flavor']
+            quantity = int(item['quantity'])
+            price = float(item['price'])
+            
+            # Create transaction
+            transaction = {
+                'id': tx.next_id('transactions'),
+                'type': 'Consignment',
+                'flavor': flavor,
+                'quantity': quantity,
+                'price': price,
+                'consignee': consignee,
+                'timestamp': datetime.now().isoformat(),
+                'paid': False
+            }
+            
+            tx.append(('transactions',), transaction)
+            tx.set(('inventory', flavor), data['inventory'][flavor] - quantity)
+            
+            # Update consignee tracking
+            tx.append(('consignees', consignee), {
+                'transaction_id': transaction['id'],
+                'flavor': flavor,
+                'quantity': quantity,
+                'price': price,
+                'paid': False
+            })
+            
+            added_items.append({
+                'flavor': flavor,
+                'quantity': quantity,
+                'price': price,
+                'total': round_currency(quantity * price)
+            })
         
-        added_items.append({
-            'flavor': flavor,
-            'quantity': quantity,
-            'price': price,
-            'total': round_currency(quantity * price)
+        # Log event
+        log_transaction_event(tx, 'bulk_consignment_added', {
+            'consignee': consignee,
+            'items_count': len(items),
+            'items': added_items,
+            'total': round_currency(sum(item['total'] for item in added_items))
         })
     
-    # Log event
-    log_transaction_event(data, 'bulk_consignment_added', {
-        'consignee': consignee,
-        'items_count': len(items),
-        'items': added_items,
-        'total': round_currency(sum(item['total'] for item in added_items))
-    })
-    
-    save_data(data)
-    
     return jsonify({
         'message': f'Successfully added {len(items)} items for {consignee}',
         'items': added_items,
@@ -840,33 +1712,28 @@ def add_bulk_consignment():
 
 @app.route('/api/transaction-history', methods=['GET'])
 def get_transaction_history():
-    """Get complete transaction history/audit log"""
-    data = load_data()
-    history = data.get('transaction_history', [])
-    
+    """Get complete transaction history/audit log of every branch, newest first"""
     # Get filter parameters
+    branch = request.args.get('branch')
     event_type = request.args.get('event_type')
     consignee = request.args.get('consignee')
+    flavor = request.args.get('flavor')
+    txn_type = request.args.get('type')
+    start = request.args.get('from')
+    end = request.args.get('to')
     limit = request.args.get('limit', type=int)
     
-    # Apply filters
-    filtered_history = history
-    
-    if event_type:
-        filtered_history = [h for h in filtered_history if h['event_type'] == event_type]
-    
-    if consignee:
-        filtered_history = [h for h in filtered_history 
-                          if h['details'].get('consignee') == consignee]
-    
-    # Sort by newest first
-    filtered_history = sorted(filtered_history, key=lambda x: x['timestamp'], reverse=True)
-    
-    # Apply limit
-    if limit:
-        filtered_history = filtered_history[:limit]
-    
-    return jsonify(filtered_history)
+    # Reading through the store makes sure history from older data files has
+    # been moved into the audit log; archived segments whose index rules out
+    # these filters are never read. The history spans all branches, so it is
+    # tagged with its own position rather than a branch's data version
+    default = branches.default.store
+    with default.read():
+        etag = f'v{default.version}-h{audit_log.last_id}'
+        return tagged_response(etag, page_response, lambda page_size, cursor: audit_log.query(
+            page_size or limit, cursor, start, end, branch=branch,
+            event_type=event_type, consignee=consignee, flavor=flavor, type=txn_type
+        ))
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,327 @@
+"""
+Audit history store, kept apart from the main datastore document.
+
+Events are appended as JSON lines to ``active.jsonl``. When the active segment
+reaches ``segment_events`` events, or an event for a new month arrives, it is
+rotated into a gzip-compressed archive segment (``segment-000001.jsonl.gz``,
+...) and summarized in ``index.json``: id range, time range and the
+event types, consignees, flavors and transaction types it contains. Queries
+walk the log newest first and skip every archived segment whose summary
+cannot match the filters, so they never decompress irrelevant history.
+"""
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+
+from datastore import InterProcessLock
+from pagination import time_bounds
+from serialization import get_serializer
+
+# Filterable fields and how to read them from an event
+FILTER_FIELDS = {
+    'event_type': lambda event: event.get('event_type'),
+    'branch': lambda event: event.get('branch'),
+    'consignee': lambda event: (event.get('details') or {}).get('consignee'),
+    'flavor': lambda event: (event.get('details') or {}).get('flavor'),
+    'type': lambda event: (event.get('details') or {}).get('type')
+}
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _write_atomic(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _below(events, cursor):
+    """Number of events (ordered by id) whose id is below cursor"""
+    low, high = 0, len(events)
+    while low < high:
+        mid = (low + high) // 2
+        if events[mid]['id'] < cursor:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+class AuditLog:
+    """Append-only audit history with compressed, indexed archive segments.
+
+    Every append or query first picks up what other processes wrote. With
+    ``shared=True`` appends also hold an inter-process lock, since writers
+    of different datastore partitions (branches) do not share a store lock.
+
+    Like the journal backend, appended lines are flushed immediately and
+    fsynced in batches (every ``sync_every`` events or ``sync_interval``
+    seconds, whichever comes first), so a power failure can lose the newest
+    events even when the store change they describe was synced.
+    """
+
+    def __init__(self, directory, segment_events=10000, cached_segments=4,
+                 sync_every=32, sync_interval=1.0, serializer=None, shared=False):
+        self.directory = directory
+        self.serializer = serializer or get_serializer()
+        self.segment_events = segment_events
+        self.cached_segments = cached_segments
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.active_path = os.path.join(directory, 'active.jsonl')
+        self.index_path = os.path.join(directory, 'index.json')
+        self.lock = threading.RLock()
+        self.process_lock = InterProcessLock(directory.rstrip('/\\') + '.lock') if shared else None
+        self.segments = None
+        self.active = []
+        self._cache = OrderedDict()
+        self._file = None
+        self._offset = 0
+        self._index_stamp = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'segment-{number:06d}.jsonl.gz')
+
+    @property
+    def last_id(self):
+        with self.lock:
+            self._refresh()
+            return self._last_id()
+
+    def _last_id(self):
+        if self.active:
+            return self.active[-1]['id']
+        return self.segments[-1]['last_id'] if self.segments else 0
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._close_file()
+        self._cache.clear()
+        self._index_stamp = _stamp(self.index_path)
+        self.segments = []
+        if self._index_stamp is not None:
+            with open(self.index_path, 'rb') as f:
+                self.segments = self.serializer.loads(f.read())['segments']
+            for meta in self.segments:
+                meta['values'] = {key: set(values) for key, values in meta['values'].items()}
+
+        # A crash between writing a segment and clearing the active file
+        # leaves events that are already archived
+        archived = self.segments[-1]['last_id'] if self.segments else 0
+        self.active = []
+        self._offset = 0
+        self._read_active(archived)
+
+    def _read_active(self, archived=0):
+        """Read events appended to the active file since the last read"""
+        if not os.path.exists(self.active_path):
+            return
+        with open(self.active_path, 'r+b') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash: drop it
+                    f.truncate(self._offset)
+                    break
+                self._offset += len(line)
+                event = self.serializer.loads(line)
+                if event['id'] > archived:
+                    self.active.append(event)
+
+    def _refresh(self):
+        """Load the log, or pick up events and rotations from other processes"""
+        if self.segments is None or _stamp(self.index_path) != self._index_stamp:
+            self._load()
+            return
+        size = os.path.getsize(self.active_path) if os.path.exists(self.active_path) else 0
+        if size < self._offset:
+            self._load()
+        elif size > self._offset:
+            self._read_active()
+
+    def _open_file(self):
+        if self._file is None:
+            self._file = open(self.active_path, 'ab')
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the log lock and, for shared logs, the inter-process lock"""
+        with self.lock:
+            if self.process_lock is None:
+                yield
+            else:
+                with self.process_lock:
+                    yield
+
+    def append(self, event):
+        """Assign the next id to event, write it and return the stored event"""
+        with self._exclusive():
+            self._refresh()
+            stored = {'id': self._last_id() + 1}
+            stored.update(event)
+            self._write(stored)
+            if (self._unsynced >= self.sync_every
+                    or time.monotonic() - self._last_sync >= self.sync_interval):
+                self.sync()
+            return stored
+
+    def import_events(self, events):
+        """Append events that already carry ids, skipping ids already logged"""
+        with self._exclusive():
+            self._refresh()
+            imported = 0
+            for event in events:
+                if event['id'] > self._last_id():
+                    self._write(event)
+                    imported += 1
+            self.sync()
+            return imported
+
+    def _write(self, event):
+        if self.active and (len(self.active) >= self.segment_events or
+                            event['timestamp'][:7] != self.active[0]['timestamp'][:7]):
+            self.rotate()
+        line = self.serializer.dumps(event) + b'\n'
+        f = self._open_file()
+        f.write(line)
+        f.flush()
+        self._offset += len(line)
+        self._unsynced += 1
+        self.active.append(event)
+
+    def sync(self):
+        """fsync the active file"""
+        with self.lock:
+            if self._file is not None and self._unsynced:
+                os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def rotate(self):
+        """Archive the active events as a compressed segment"""
+        with self.lock:
+            if not self.active:
+                return
+            number = self.segments[-1]['number'] + 1 if self.segments else 1
+            payload = b''.join(self.serializer.dumps(event) + b'\n' for event in self.active)
+            _write_atomic(self._segment_path(number), gzip.compress(payload))
+
+            meta = {
+                'number': number,
+                'count': len(self.active),
+                'first_id': self.active[0]['id'],
+                'last_id': self.active[-1]['id'],
+                'start': min(event['timestamp'] for event in self.active),
+                'end': max(event['timestamp'] for event in self.active),
+                'values': {key: {read(event) for event in self.active} - {None}
+                           for key, read in FILTER_FIELDS.items()}
+            }
+            self.segments.append(meta)
+            self._write_index()
+
+            # The archived segment is already synced; the active file is emptied
+            self._unsynced = 0
+            self._close_file()
+            _write_atomic(self.active_path, b'')
+            self.active = []
+            self._offset = 0
+
+    def _write_index(self):
+        segments = [dict(meta, values={key: sorted(values) for key, values in meta['values'].items()})
+                    for meta in self.segments]
+        _write_atomic(self.index_path, self.serializer.dumps({'segments': segments}))
+        self._index_stamp = _stamp(self.index_path)
+
+    def _segment_events(self, meta):
+        events = self._cache.get(meta['number'])
+        if events is None:
+            with gzip.open(self._segment_path(meta['number']), 'rb') as f:
+                events = [self.serializer.loads(line) for line in f]
+            self._cache[meta['number']] = events
+            if len(self._cache) > self.cached_segments:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(meta['number'])
+        return events
+
+    @staticmethod
+    def _may_match(meta, cursor, start, end, filters):
+        """Whether an archived segment can hold events for this query"""
+        if cursor is not None and meta['first_id'] >= cursor:
+            return False
+        if start and meta['end'] < start:
+            return False
+        if end and meta['start'][:len(end)] > end:
+            return False
+        # Segments archived before a field was indexed hold no events with it
+        return all(value in meta['values'].get(key, ()) for key, value in filters.items())
+
+    def _newest_first(self, cursor, start, end, filters):
+        chunks = [self.active]
+        chunks.extend(meta for meta in reversed(self.segments))
+        for chunk in chunks:
+            if isinstance(chunk, dict):
+                if not self._may_match(chunk, cursor, start, end, filters):
+                    continue
+                chunk = self._segment_events(chunk)
+            low, high = time_bounds(chunk, start, end)
+            if cursor is not None:
+                high = min(high, _below(chunk, cursor))
+            for index in range(high - 1, low - 1, -1):
+                event = chunk[index]
+                if all(FILTER_FIELDS[key](event) == value for key, value in filters.items()):
+                    yield event
+
+    def query(self, page_size=None, cursor=None, start=None, end=None, **filters):
+        """Matching events newest first, as (page, next_cursor).
+
+        ``filters`` are exact matches on the FILTER_FIELDS; ``cursor`` is the
+        id of the last event of the previous page.
+        """
+        filters = {key: value for key, value in filters.items() if value}
+        with self.lock:
+            self._refresh()
+            events = self._newest_first(cursor, start, end, filters)
+            if not page_size:
+                return list(events), None
+            page = list(islice(events, page_size + 1))
+            if len(page) > page_size:
+                return page[:page_size], page[page_size - 1]['id']
+            return page, None
+
+    def reset(self):
+        """Delete the whole history"""
+        with self._exclusive():
+            self._close_file()
+            for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+                os.remove(os.path.join(self.directory, name))
+            self.segments = None
+            self.active = []
+            self._cache.clear()
+            self._offset = 0
+
+    def close(self):
+        with self.lock:
+            self._close_file()
@@ -0,0 +1,90 @@
+"""
+Latency of /api/analytics/sales range queries from the rollups versus a ledger scan.
+
+The synthetic ledger has one transaction per minute, so 1M transactions span
+almost two years. Each query is answered by SalesRollups.series and by
+filtering and bucketing the raw transactions, and both answers are checked to
+be equal.
+
+Usage: python benchmarks/bench_analytics.py [--size 1000000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the app opens its data files in the working directory
+os.chdir(tempfile.mkdtemp(prefix='vape_analytics_'))
+
+from synthetic import make_ledger  # noqa: E402
+from aggregates import SalesRollups, day_bounds, period_key  # noqa: E402
+
+QUERIES = [
+    ('all time by month', 'month', {}),
+    ('all time by week', 'week', {}),
+    ('all time by day', 'day', {}),
+    ('one year by month, one flavor', 'month', {'start': '2024-03-15', 'end': '2025-03-14', 'flavor': 'Mango'}),
+    ('one quarter by day, consignments', 'day', {'start': '2024-04', 'end': '2024-06', 'txn_type': 'Consignment'}),
+    ('one consignee by month', 'month', {'consignee': 'Consignee 7'})
+]
+
+
+def scan(transactions, bucket, start=None, end=None, flavor=None, txn_type=None, consignee=None):
+    """What the rollups answer, computed from the raw transactions"""
+    start, end = day_bounds(start, end)
+    totals = {}
+    for txn in transactions:
+        day = txn['timestamp'][:10]
+        if (start and day < start) or (end and day > end):
+            continue
+        if ((flavor and txn['flavor'] != flavor) or (txn_type and txn['type'] != txn_type)
+                or (consignee and (txn.get('consignee') or None) != consignee)):
+            continue
+        amount = txn['price'] * txn['quantity']
+        row = totals.setdefault(period_key(day, bucket), [0, 0, 0, 0])
+        for index, value in enumerate((1, txn['quantity'], amount, 0 if txn['paid'] else amount)):
+            row[index] += value
+    return [(period, dict(zip(SalesRollups.METRICS, values))) for period, values in sorted(totals.items())]
+
+
+def timed(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sales analytics rollups')
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    transactions = make_ledger(args.size)['transactions']
+    data = {'transactions': transactions}
+    rollups = SalesRollups()
+    start = time.perf_counter()
+    rollups.rebuild(data)
+    print(f'{args.size} transactions, {transactions[0]["timestamp"][:10]} to {transactions[-1]["timestamp"][:10]}; '
+          f'rollups built in {time.perf_counter() - start:.2f} s '
+          f'({len(rollups.periods["day"])} days, {len(rollups.periods["month"])} months)')
+
+    print(f'{"query":<36}{"periods":>8}{"rollups ms":>12}{"scan ms":>10}{"speedup":>10}')
+    for label, bucket, filters in QUERIES:
+        fast, fast_time = timed(args.repeat, lambda: rollups.series(bucket, **filters))
+        slow, slow_time = timed(1, lambda: scan(transactions, bucket, **filters))
+        assert fast == slow, label
+        print(f'{label:<36}{len(fast):>8}{fast_time * 1000:>12.2f}{slow_time * 1000:>10.0f}'
+              f'{slow_time / fast_time:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+"""
+Replay a weighted mix of API requests against a synthetic ledger and report
+latency percentiles, throughput and peak RSS per endpoint.
+
+The app is seeded with ``make_ledger`` (transactions, flavors, consignees,
+partial payments and history events) in a temporary directory, then each
+worker thread sends requests drawn from ``MIX`` with its own seeded RNG, so
+a run with the same arguments sends the same requests. Requests go through
+Flask's test client (``--mode inprocess``) or over HTTP to a threaded server
+started in this process (``--mode http``), or to an already running server
+(``--url``), which is benchmarked on the data it holds and without RSS.
+
+``--output`` saves the results as JSON; ``--baseline`` compares this run with
+an earlier one and exits with status 1 if any endpoint's p95 latency grew, or
+overall throughput fell, by more than ``--threshold``.
+
+Usage: python benchmarks/bench_api.py [--size 100000] [--mode inprocess|http]
+                                      [--backend json|journal|sqlite] [--workers 1]
+                                      [--requests 5000] [--output results.json]
+                                      [--baseline previous.json] [--threshold 0.2]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# (endpoint, weight): reads dominate, as they do from the dashboard UI
+MIX = [
+    ('dashboard', 25),
+    ('transactions_page', 12),
+    ('transactions_filtered', 5),
+    ('pending', 6),
+    ('consignees', 10),
+    ('payment_history', 5),
+    ('history_page', 5),
+    ('movements', 4),
+    ('sales_analytics', 4),
+    ('changes', 5),
+    ('create_pending', 8),
+    ('accept_pending', 6),
+    ('reject_pending', 1),
+    ('partial_payment', 2),
+    ('bulk_consignment', 1),
+    ('settings', 1)
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak if current is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Workload:
+    """Builds the requests of the mix from what the seeded ledger contains.
+
+    Pending transaction ids created by the workers are shared, so accepts
+    and rejects act on real pending transactions.
+    """
+
+    def __init__(self, flavors, consignees, size):
+        self.flavors = flavors
+        self.consignees = consignees
+        self.size = size
+        self.lock = threading.Lock()
+        self.pending = []
+        self.version = 0
+        self.endpoints, self.weights = zip(*MIX)
+
+    def take_pending(self):
+        with self.lock:
+            return self.pending.pop() if self.pending else None
+
+    def next(self, rng):
+        """(endpoint, method, path, body) of the next request"""
+        endpoint = rng.choices(self.endpoints, self.weights)[0]
+        flavor = rng.choice(self.flavors)
+        consignee = rng.choice(self.consignees)
+        if endpoint == 'dashboard':
+            return endpoint, 'GET', '/api/dashboard', None
+        if endpoint == 'transactions_page':
+            cursor = rng.randint(1, max(self.size, 1))
+            return endpoint, 'GET', f'/api/transactions?page_size=50&order=desc&cursor={cursor}', None
+        if endpoint == 'transactions_filtered':
+            month = f'2024-{rng.randint(1, 12):02d}'
+            return (endpoint, 'GET',
+                    f'/api/transactions?page_size=100&flavor={quote(flavor)}&from={month}&to={month}', None)
+        if endpoint == 'pending':
+            return endpoint, 'GET', '/api/pending-transactions', None
+        if endpoint == 'consignees':
+            return endpoint, 'GET', '/api/consignees', None
+        if endpoint == 'payment_history':
+            return endpoint, 'GET', f'/api/consignees/{quote(consignee)}/payments', None
+        if endpoint == 'history_page':
+            return endpoint, 'GET', '/api/transaction-history?page_size=50', None
+        if endpoint == 'movements':
+            return endpoint, 'GET', f'/api/inventory/movements?bucket=month&flavor={quote(flavor)}', None
+        if endpoint == 'sales_analytics':
+            return endpoint, 'GET', f'/api/analytics/sales?bucket={rng.choice(["day", "week", "month"])}', None
+        if endpoint == 'changes':
+            return endpoint, 'GET', f'/api/changes?since={max(self.version - 20, 0)}', None
+        if endpoint == 'create_pending':
+            return endpoint, 'POST', '/api/transactions', {
+                'flavor': flavor, 'quantity': rng.randint(1, 3), 'type': 'Direct Sale', 'price': 300
+            }
+        if endpoint in ('accept_pending', 'reject_pending'):
+            txn_id = self.take_pending()
+            if txn_id is None:
+                return 'create_pending', 'POST', '/api/transactions', {
+                    'flavor': flavor, 'quantity': 1, 'type': 'Direct Sale', 'price': 300
+                }
+            action = 'accept' if endpoint == 'accept_pending' else 'reject'
+            return endpoint, 'POST', f'/api/pending-transactions/{txn_id}/{action}', None
+        if endpoint == 'partial_payment':
+            return endpoint, 'POST', f'/api/consignees/{quote(consignee)}/partial-pay', {'amount': 1}
+        if endpoint == 'bulk_consignment':
+            return endpoint, 'POST', '/api/consignment/bulk', {
+                'consignee': consignee,
+                'items': [{'flavor': rng.choice(self.flavors), 'quantity': 1, 'price': 250} for _ in range(3)]
+            }
+        return endpoint, 'GET', '/api/settings', None
+
+    def observe(self, endpoint, status, body):
+        """Remember created pending ids and the latest data version"""
+        if endpoint == 'create_pending' and status == 201:
+            with self.lock:
+                self.pending.append(json.loads(body)['transaction']['id'])
+        elif endpoint == 'changes' and status == 200:
+            self.version = max(self.version, json.loads(body).get('version', 0))
+
+
+class TestClientTransport:
+    """Requests through Flask's test client, in this process"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, body):
+            response = client.open(path, method=method, json=body)
+            return response.status_code, response.get_data()
+        return send
+
+
+class HttpTransport:
+    """Requests over HTTP/1.1, one keep-alive connection per worker"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+
+    def session(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+        def send(method, path, body):
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body).encode()
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        return send
+
+
+def start_server(app):
+    """Serve app on a free local port from a background thread; returns its URL"""
+    import logging
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    # Keep-alive, so latencies do not include a TCP handshake per request
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def run(transport, workload, workers, requests, warmup, seed, measure_rss):
+    """Send requests (after warmup ones) from workers threads; per-endpoint samples"""
+    samples = {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers + 1)
+    per_worker = max(requests // workers, 1)
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        send = transport.session()
+        for _ in range(warmup):
+            endpoint, method, path, body = workload.next(rng)
+            status, payload = send(method, path, body)
+            workload.observe(endpoint, status, payload)
+        barrier.wait()
+        local = {}
+        for _ in range(per_worker):
+            endpoint, method, path, body = workload.next(rng)
+            start = time.perf_counter()
+            status, payload = send(method, path, body)
+            elapsed = time.perf_counter() - start
+            workload.observe(endpoint, status, payload)
+            record = local.setdefault(endpoint, {'latencies': [], 'errors': 0, 'bytes': 0, 'rss': 0})
+            record['latencies'].append(elapsed)
+            record['bytes'] += len(payload)
+            if status >= 500 or (status >= 400 and endpoint != 'partial_payment'):
+                # Partial payments against a paid-off consignee are expected 400s
+                record['errors'] += 1
+            if measure_rss:
+                record['rss'] = max(record['rss'], current_rss())
+        with lock:
+            for endpoint, record in local.items():
+                merged = samples.setdefault(endpoint, {'latencies': [], 'errors': 0, 'bytes': 0, 'rss': 0})
+                merged['latencies'].extend(record['latencies'])
+                merged['errors'] += record['errors']
+                merged['bytes'] += record['bytes']
+                merged['rss'] = max(merged['rss'], record['rss'])
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed, measure_rss):
+    def stats(latencies, errors, size, rss):
+        latencies = sorted(latencies)
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'mean_response_bytes': round(size / len(latencies)),
+            'peak_rss_mb': round(rss / 2 ** 20, 1) if measure_rss else None
+        }
+
+    endpoints = {
+        endpoint: stats(record['latencies'], record['errors'], record['bytes'], record['rss'])
+        for endpoint, record in sorted(samples.items())
+    }
+    overall = stats([value for record in samples.values() for value in record['latencies']],
+                    sum(record['errors'] for record in samples.values()),
+                    sum(record['bytes'] for record in samples.values()),
+                    max([peak_rss()] + [record['rss'] for record in samples.values()]))
+    return endpoints, overall
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Endpoints whose p95 grew by more than threshold, and 'overall' if
+    throughput also fell by more than that"""
+    regressions = []
+    # p95 of fewer samples than this is mostly noise
+    min_samples = 50
+    meta, before_meta = results['meta'], baseline['meta']
+    print(f'\ncompared with {before_meta.get("revision")} ({before_meta.get("started")}):')
+    for key in ('size', 'mode', 'backend', 'workers', 'requests', 'seed', 'platform'):
+        if meta.get(key) != before_meta.get(key):
+            print(f'  warning: {key} differs ({meta.get(key)} now, {before_meta.get(key)} before)')
+    print(f'{"endpoint":<24}{"p95 ms":>10}{"was":>10}{"change":>9}{"rps":>10}{"was":>10}{"change":>9}')
+    rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+    for endpoint, current in rows:
+        before = baseline['overall'] if endpoint == 'overall' else baseline['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        p95_change = current['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+        rps_change = current['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0
+        # An endpoint's share of the mix is fixed, so only overall throughput is checked
+        flag = ((p95_change > threshold and min(current['requests'], before['requests']) >= min_samples)
+                or (endpoint == 'overall' and rps_change < -threshold))
+        if flag:
+            regressions.append(endpoint)
+        print(f'{endpoint:<24}{current["p95_ms"]:>10.2f}{before["p95_ms"]:>10.2f}{p95_change:>+9.0%}'
+              f'{current["throughput_rps"]:>10.1f}{before["throughput_rps"]:>10.1f}{rps_change:>+9.0%}'
+              f'{"  REGRESSION" if flag else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a request mix against the API')
+    parser.add_argument('--size', type=int, default=100000, help='transactions in the synthetic ledger')
+    parser.add_argument('--consignees', type=int, default=200)
+    parser.add_argument('--flavors', type=int, default=40)
+    parser.add_argument('--partial-payments', type=float, default=0.3,
+                        help='fraction of consignees with partial payments')
+    parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--url', help='benchmark a running server instead (implies --mode http)')
+    parser.add_argument('--backend', choices=['json', 'journal', 'sqlite'], default='journal')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='concurrent clients; above 1, latencies include waiting for the GIL and the store lock')
+    parser.add_argument('--requests', type=int, default=5000, help='measured requests, over all workers')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per worker')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    setup_start = time.perf_counter()
+    if args.url:
+        # A running server is benchmarked on whatever data it holds
+        transport = HttpTransport(args.url)
+        send = transport.session()
+        flavors = list(json.loads(send('GET', '/api/dashboard', None)[1])['inventory'])
+        consignees = list(json.loads(send('GET', '/api/consignees', None)[1])) or ['Consignee 0']
+        size = len(json.loads(send('GET', '/api/transactions?fields=id', None)[1]))
+        measure_rss = False
+    else:
+        # Importing the app opens its data files in the working directory
+        os.chdir(tempfile.mkdtemp(prefix='vape_api_'))
+        os.environ['VAPE_STORAGE'] = args.backend
+        from synthetic import make_ledger
+        import app as app_module
+
+        ledger = make_ledger(args.size, args.consignees, args.seed, args.flavors, args.partial_payments)
+        flavors = list(ledger['inventory'])
+        consignees = list(ledger['consignees'])
+        size = args.size
+        app_module.store.reset(ledger)
+        del ledger
+        if args.mode == 'http':
+            transport = HttpTransport(start_server(app_module.app))
+        else:
+            transport = TestClientTransport(app_module.app)
+        measure_rss = True
+    mode = 'http' if args.url else args.mode
+    backend = None if args.url else args.backend
+    print(f'{size} transactions, {len(flavors)} flavors, {len(consignees)} consignees; '
+          f'ready in {time.perf_counter() - setup_start:.1f} s ({backend or args.url}, {mode})')
+
+    workload = Workload(flavors, consignees, size)
+    samples, elapsed = run(transport, workload, args.workers, args.requests, args.warmup, args.seed,
+                           measure_rss)
+    endpoints, overall = summarize(samples, elapsed, measure_rss)
+
+    results = {
+        'meta': {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'size': size,
+            'flavors': len(flavors),
+            'consignees': len(consignees),
+            'partial_payments': args.partial_payments,
+            'mode': mode,
+            'backend': backend,
+            'workers': args.workers,
+            'requests': args.requests,
+            'seed': args.seed,
+            'elapsed_s': round(elapsed, 3)
+        },
+        'endpoints': endpoints,
+        'overall': overall
+    }
+
+    print(f'{"endpoint":<24}{"n":>6}{"err":>5}{"rps":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"RSS MB":>9}')
+    for endpoint, row in list(endpoints.items()) + [('overall', overall)]:
+        rss = f'{row["peak_rss_mb"]:>9.1f}' if row['peak_rss_mb'] is not None else f'{"-":>9}'
+        print(f'{endpoint:<24}{row["requests"]:>6}{row["errors"]:>5}{row["throughput_rps"]:>9.1f}'
+              f'{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}{row["p99_ms"]:>9.2f}{rss}')
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'results written to {output}')
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'regressions beyond {args.threshold:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
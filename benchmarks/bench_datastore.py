@@ -0,0 +1,116 @@
+"""
+Requests/sec for GET /api/dashboard and POST /api/transactions per storage backend.
+
+Each backend and mode runs in a fresh process with its own data directory,
+where the app's store is seeded with a synthetic ledger (``VAPE_STORAGE``
+picks the backend). The "reload" mode re-reads the data file before every
+request, which is what ``load_data()`` used to do; "resident" serves reads
+from the in-memory store.
+The json backend rewrites the whole file per write, while the journal and
+sqlite backends only write the rows/records a change touches, so their POST
+latency should stay flat as the ledger grows.
+
+Usage: python benchmarks/bench_datastore.py [--sizes 1000,100000,1000000]
+                                            [--backends json,journal,sqlite] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_for(seconds, fn):
+    """Call fn repeatedly for the given time budget and return per-call latencies"""
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds or not latencies:
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+    return latencies
+
+
+def summarize(latencies):
+    return {
+        'rps': round(len(latencies) / sum(latencies), 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3)
+    }
+
+
+def run_config(kind, mode, size, seconds, workdir, results):
+    """Run in a child process: seed the app's store and time both requests"""
+    # Importing the app opens its data files and audit log in the working
+    # directory; keep the benchmark's writes out of the real ones
+    os.chdir(tempfile.mkdtemp(dir=workdir))
+    os.environ['VAPE_STORAGE'] = kind
+    os.environ['VAPE_SHARED_STORAGE'] = '0'
+    from synthetic import make_ledger
+    import app as app_module
+
+    store = app_module.store
+    store.reset(make_ledger(size))
+    client = app_module.app.test_client()
+
+    def dashboard():
+        if mode == 'reload':
+            store.load()
+        assert client.get('/api/dashboard').status_code == 200
+
+    def create():
+        if mode == 'reload':
+            store.load()
+        response = client.post('/api/transactions', json={
+            'flavor': 'Matcha', 'quantity': 1, 'type': 'Direct Sale', 'price': 300
+        })
+        assert response.status_code == 201
+
+    results.put({
+        'dashboard': summarize(run_for(seconds, dashboard)),
+        'create': summarize(run_for(seconds, create))
+    })
+    store.close()
+
+
+def bench_size(size, backends, seconds, workdir):
+    results = {}
+    modes = [(kind, 'resident') for kind in backends]
+    if 'json' in backends:
+        modes.insert(0, ('json', 'reload'))
+
+    for kind, mode in modes:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_config, args=(kind, mode, size, seconds, workdir, queue))
+        process.start()
+        results[f'{kind}/{mode}'] = queue.get()
+        process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--backends', default='json,journal,sqlite')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vape_bench_')
+    try:
+        print(f"{'transactions':>12}  {'backend/mode':<17} {'dashboard req/s':>16} "
+              f"{'POST req/s':>12} {'POST p50 ms':>12}")
+        for size in (int(s) for s in args.sizes.split(',')):
+            results = bench_size(size, args.backends.split(','), args.seconds, workdir)
+            for name, result in results.items():
+                print(f"{size:>12}  {name:<17} {result['dashboard']['rps']:>16} "
+                      f"{result['create']['rps']:>12} {result['create']['p50_ms']:>12}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
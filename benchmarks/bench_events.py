@@ -0,0 +1,188 @@
+"""
+Fan-out cost and delivery latency of the /api/events broker.
+
+"broker" mode drives EventBroker directly: SUBSCRIBERS threads drain their
+queues while events are published at a fixed rate, and a few deliberately
+slow subscribers show that they get dropped instead of delaying the rest.
+"http" mode starts the real app on a local threaded server, opens
+SUBSCRIBERS streaming connections to /api/events and times how long each
+commit (a new pending transaction, then its acceptance) takes to reach
+every client.
+
+Usage: python benchmarks/bench_events.py [--mode broker|http] [--subscribers 500]
+                                         [--events 200] [--rate 100] [--slow 5] [--queue 100]
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from events import EventBroker  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(title, publish_times, latencies, delivered, expected, dropped):
+    print(title)
+    if publish_times:
+        print(f'  publish (fan-out) per event: p50 {statistics.median(publish_times) * 1000:.3f} ms, '
+              f'p99 {percentile(publish_times, 99) * 1000:.3f} ms')
+    if latencies:
+        print(f'  delivery latency: p50 {statistics.median(latencies) * 1000:.2f} ms, '
+              f'p95 {percentile(latencies, 95) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms')
+    print(f'  delivered {delivered}/{expected} messages, {dropped} subscribers dropped')
+
+
+def bench_broker(subscribers, events, rate, slow, queue):
+    broker = EventBroker(max_queued=queue, max_subscribers=subscribers + slow)
+    latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def consume(subscriber, delay):
+        received = []
+        while not stop.is_set() and not subscriber.dropped:
+            for message in subscriber.drain(0.1):
+                sent = float(message.split(b'"t":')[1].split(b'}')[0])
+                received.append(time.perf_counter() - sent)
+            if delay:
+                time.sleep(delay)
+        if not delay:
+            with lock:
+                latencies.extend(received)
+
+    threads = []
+    for index in range(subscribers + slow):
+        subscriber = broker.subscribe()
+        delay = 5 if index >= subscribers else 0
+        thread = threading.Thread(target=consume, args=(subscriber, delay), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    publish_times = []
+    interval = 1.0 / rate
+    for number in range(events):
+        start = time.perf_counter()
+        broker.publish({'version': number, 'inventory': {'Mango': number}, 't': start}, 'change', number)
+        publish_times.append(time.perf_counter() - start)
+        time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+    time.sleep(0.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    report(f'broker: {subscribers} subscribers (+{slow} slow), {events} events at {rate}/s, queue {queue}',
+           publish_times, latencies, len(latencies), subscribers * events, broker.stats()['dropped'])
+
+
+def bench_http(subscribers, events, rate):
+    import logging
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix='vape_events_')
+    os.chdir(workdir)
+    os.environ['VAPE_EVENTS_MAX_SUBSCRIBERS'] = str(subscribers + 10)
+    import app as app_module
+
+    with app_module.store.transaction() as tx:
+        tx.set(('inventory', app_module.FLAVORS[0]), 10 ** 6)
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    server.socket.listen(subscribers + 64)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    sent_at = {}
+    latencies = []
+    lock = threading.Lock()
+    connected = threading.Barrier(subscribers + 1)
+
+    def listen():
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b'GET /api/events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n')
+        connected.wait()
+        buffer = b''
+        seen = 0
+        sock.settimeout(10)
+        try:
+            while seen < events * 2:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                while b'\n\n' in buffer:
+                    message, buffer = buffer.split(b'\n\n', 1)
+                    if b'event: change' in message:
+                        version = int(message.split(b'id: ')[1].split(b'\n')[0])
+                        arrived = time.perf_counter()
+                        with lock:
+                            if version in sent_at:
+                                latencies.append(arrived - sent_at[version])
+                        seen += 1
+        except socket.timeout:
+            pass
+        finally:
+            sock.close()
+
+    threads = [threading.Thread(target=listen, daemon=True) for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    connected.wait()
+    time.sleep(1)
+
+    client = app_module.app.test_client()
+    interval = 1.0 / rate
+    for _ in range(events):
+        start = time.perf_counter()
+        with lock:
+            sent_at[app_module.store.version + 1] = time.perf_counter()
+        response = client.post('/api/transactions', json={
+            'flavor': app_module.FLAVORS[0], 'quantity': 1, 'type': 'Direct Sale', 'price': 300
+        })
+        txn_id = response.get_json()['transaction']['id']
+        with lock:
+            sent_at[app_module.store.version + 1] = time.perf_counter()
+        client.post(f'/api/pending-transactions/{txn_id}/accept')
+        time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+    for thread in threads:
+        thread.join(timeout=15)
+    server.shutdown()
+    report(f'http: {subscribers} EventSource clients, {events} accepted transactions ({events * 2} commits) at {rate}/s',
+           [], latencies, len(latencies), subscribers * events * 2, app_module.branches.default.event_broker.stats()['dropped'])
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/events fan-out')
+    parser.add_argument('--mode', default='broker', choices=['broker', 'http'])
+    parser.add_argument('--subscribers', type=int, default=500)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=100, help='events per second')
+    parser.add_argument('--slow', type=int, default=5, help='slow subscribers (broker mode)')
+    parser.add_argument('--queue', type=int, default=100, help='per-subscriber queue size (broker mode)')
+    args = parser.parse_args()
+
+    if args.mode == 'broker':
+        bench_broker(args.subscribers, args.events, args.rate, args.slow, args.queue)
+    else:
+        bench_http(args.subscribers, args.events, args.rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Throughput and latency of concurrent POST /api/transactions with and without group commit.
+
+Each configuration runs in a fresh process with its own data directory: the
+app is seeded with a synthetic ledger, then ``--clients`` threads (the
+counters) each create ``--requests`` pending transactions as fast as they can.
+With a commit window the commits that arrive together are written with one
+backend write; without one every commit is written on its own. Note that the
+journal backend only fsyncs every 32 records on its own, while a group
+commit batch is fsynced before its commits return.
+
+Usage: python benchmarks/bench_group_commit.py [--size 100000] [--backends json,journal,sqlite]
+                                               [--windows 0,2,5] [--clients 8] [--requests 50]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_config(backend, window_ms, size, clients, requests, results):
+    """Run in a child process: seed the app and time the burst"""
+    os.chdir(tempfile.mkdtemp(prefix='vape_group_commit_'))
+    os.environ['VAPE_STORAGE'] = backend
+    os.environ['VAPE_COMMIT_WINDOW_MS'] = str(window_ms)
+    os.environ['VAPE_COMMIT_MAX_BATCH'] = str(clients * 2)
+    from synthetic import make_ledger
+    import app as app_module
+
+    app_module.store.reset(make_ledger(size))
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def counter(number):
+        client = app_module.app.test_client()
+        flavor = app_module.FLAVORS[number % len(app_module.FLAVORS)]
+        local = []
+        barrier.wait()
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.post('/api/transactions', json={
+                'flavor': flavor, 'quantity': 1, 'type': 'Direct Sale', 'price': 300
+            })
+            local.append(time.perf_counter() - start)
+            if response.status_code != 201:
+                failures.append(response.status_code)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=counter, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    app_module.store.close()
+
+    latencies.sort()
+    group_commit = app_module.store.group_commit
+    results.put({
+        'commits_per_s': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_batch': group_commit.stats()['mean_batch'] if group_commit else 1,
+        'failures': len(failures)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark group commit')
+    parser.add_argument('--size', type=int, default=100000, help='transactions in the seeded ledger')
+    parser.add_argument('--backends', default='json,journal,sqlite')
+    parser.add_argument('--windows', default='0,2,5', help='commit windows in ms; 0 is off')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='POSTs per client')
+    args = parser.parse_args()
+
+    print(f'{args.clients} clients x {args.requests} POST /api/transactions, {args.size}-transaction ledger')
+    print(f'{"backend":<10}{"window ms":>10}{"commits/s":>11}{"p50 ms":>9}{"p99 ms":>9}{"mean batch":>12}')
+    for backend in args.backends.split(','):
+        for window in [float(window) for window in args.windows.split(',')]:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_config, args=(
+                backend, window, args.size, args.clients, args.requests, results))
+            process.start()
+            row = results.get()
+            process.join()
+            print(f'{backend:<10}{window:>10g}{row["commits_per_s"]:>11.1f}{row["p50_ms"]:>9.2f}'
+                  f'{row["p99_ms"]:>9.2f}{row["mean_batch"] or 0:>12.2f}'
+                  f'{"  (" + str(row["failures"]) + " failed)" if row["failures"] else ""}')
+
+
+if __name__ == '__main__':
+    main()
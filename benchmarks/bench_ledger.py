@@ -0,0 +1,96 @@
+"""
+Memory and aggregation time of the columnar ledger versus the list-of-dicts layout.
+
+For each size the transaction list is loaded from JSON (as the backends load
+it) and copied into a ColumnarLedger; both footprints are measured with
+tracemalloc. Then the financial totals are computed over each layout.
+
+Usage: python benchmarks/bench_ledger.py [--sizes 100000,1000000] [--repeat 3]
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the app opens its data files in the working directory
+os.chdir(tempfile.mkdtemp(prefix='vape_ledger_'))
+
+from synthetic import make_ledger  # noqa: E402
+from aggregates import FinancialTotals  # noqa: E402
+from ledger import ColumnarLedger  # noqa: E402
+from serialization import get_serializer  # noqa: E402
+
+
+def measure(build):
+    """(result, bytes allocated by build() and still held)"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, held
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_columnar(transactions):
+    ledger = ColumnarLedger()
+    ledger.rebuild({'transactions': transactions})
+    return ledger
+
+
+def bench_size(size, repeat):
+    serializer = get_serializer()
+    payload = serializer.dumps(make_ledger(size, num_consignees=50)['transactions'])
+
+    transactions, dict_bytes = measure(lambda: serializer.loads(payload))
+    del payload
+    columnar, columnar_bytes = measure(lambda: build_columnar(transactions))
+    # Timed apart from the measurement, which slows allocation down a lot
+    build_time = best_of(1, lambda: build_columnar(transactions))
+
+    def dict_totals():
+        totals = FinancialTotals()
+        totals.rebuild({'transactions': transactions})
+        return totals.totals()
+
+    assert dict_totals() == columnar.financial_totals()
+    rows = [
+        ('financial totals', best_of(repeat, dict_totals), best_of(repeat, columnar.financial_totals))
+    ]
+
+    print(f'{size} transactions')
+    print(f'  memory: list of dicts {dict_bytes / 1e6:.1f} MB ({dict_bytes / size:.0f} B/txn), '
+          f'columnar {columnar_bytes / 1e6:.1f} MB ({columnar_bytes / size:.0f} B/txn), '
+          f'{dict_bytes / columnar_bytes:.1f}x smaller; columnar build {build_time:.2f} s')
+    print(f'  {"aggregate":<24}{"dicts s":>10}{"columnar s":>12}{"speedup":>10}')
+    for label, dict_time, columnar_time in rows:
+        print(f'  {label:<24}{dict_time:>10.4f}{columnar_time:>12.4f}{dict_time / columnar_time:>9.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the columnar ledger')
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        bench_size(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Load, dump and response-encoding time of the JSON serializers on a synthetic ledger.
+
+"baseline" is the path before serializers were pluggable: ``json.dump(...,
+indent=2)`` for the data file, ``json.load`` to read it back and Flask's
+default provider for responses. It is compared with compact stdlib output and
+with orjson (when installed), each as used by JsonFileBackend and by the
+app's JSON provider. The response column encodes the full transaction list,
+i.e. ``GET /api/transactions`` without paging.
+
+Usage: python benchmarks/bench_serialization.py [--size 1000000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the app opens its data files in the working directory
+WORKDIR = tempfile.mkdtemp(prefix='vape_serialization_')
+os.chdir(WORKDIR)
+
+from flask import Flask  # noqa: E402
+from synthetic import make_ledger  # noqa: E402
+import app as app_module  # noqa: E402
+from datastore import JsonFileBackend  # noqa: E402
+from serialization import get_serializer, orjson  # noqa: E402
+
+
+def best_of(repeat, fn):
+    """Fastest of repeat runs, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_baseline(ledger, path, repeat):
+    def dump():
+        with open(path, 'w') as f:
+            json.dump(ledger, f, indent=2)
+
+    def load():
+        with open(path, 'r') as f:
+            json.load(f)
+
+    baseline_app = Flask('baseline')
+    provider = baseline_app.json
+    dump_time = best_of(repeat, dump)
+    size = os.path.getsize(path)
+    load_time = best_of(repeat, load)
+    response_time = best_of(repeat, lambda: provider.response(ledger['transactions']).get_data())
+    return dump_time, load_time, response_time, size
+
+
+def bench_serializer(name, ledger, path, repeat):
+    backend = JsonFileBackend(path, get_serializer(name))
+    app_module.response_serializer = get_serializer(name, sort_keys=True)
+    provider = app_module.app.json
+
+    dump_time = best_of(repeat, lambda: backend.save(ledger))
+    size = os.path.getsize(path)
+    load_time = best_of(repeat, backend.load)
+    response_time = best_of(repeat, lambda: provider.response(ledger['transactions']).get_data())
+    return dump_time, load_time, response_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON serializers')
+    parser.add_argument('--size', type=int, default=1000000, help='transactions in the ledger')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'building a {args.size}-transaction ledger...')
+    ledger = make_ledger(args.size)
+    path = os.path.join(WORKDIR, 'vape_data.json')
+
+    results = {'baseline (indent=2, flask)': bench_baseline(ledger, path, args.repeat)}
+    candidates = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    for name in candidates:
+        results[f'{name} compact'] = bench_serializer(name, ledger, path, args.repeat)
+
+    base_dump, base_load, base_response, base_size = results['baseline (indent=2, flask)']
+    print(f'{"serializer":<28}{"dump s":>9}{"load s":>9}{"response s":>12}{"file MB":>10}')
+    for label, (dump_time, load_time, response_time, size) in results.items():
+        print(f'{label:<28}{dump_time:>9.3f}{load_time:>9.3f}{response_time:>12.3f}{size / 1e6:>10.1f}'
+              f'   ({base_dump / dump_time:.1f}x / {base_load / load_time:.1f}x / '
+              f'{base_response / response_time:.1f}x / {size / base_size:.0%})')
+    if orjson is None:
+        print('orjson is not installed; pip install orjson to include it')
+
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
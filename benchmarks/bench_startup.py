@@ -0,0 +1,126 @@
+"""
+Cold start time of a worker: importing the app, reading the stored document
+and loading the store.
+
+Each measurement runs in a fresh interpreter, as a new gunicorn worker would.
+It reports three times separately: ``import`` (``import app``, i.e. Flask,
+NumPy and the app's own modules), ``read`` (the backend parsing its files
+into a document) and ``load`` (``store.load()``: the read plus building the
+aggregates, indexes and columnar ledger). Backends are compared with and
+without binary snapshots (``VAPE_SNAPSHOT=1``), and "fresh" starts from an
+empty directory, where ``initialize_database()`` seeds and saves the store.
+
+Usage: python benchmarks/bench_startup.py [--sizes 10000,100000,1000000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    'json': {'VAPE_STORAGE': 'json'},
+    'json + snapshot': {'VAPE_STORAGE': 'json', 'VAPE_SNAPSHOT': '1'},
+    'journal': {'VAPE_STORAGE': 'journal'},
+    'journal + snapshot': {'VAPE_STORAGE': 'journal', 'VAPE_SNAPSHOT': '1'}
+}
+
+
+def child():
+    """Runs in the measured interpreter: print the three timings as JSON"""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app
+    imported = time.perf_counter()
+
+    backend = app.make_backend()
+    backend.load()
+    read = time.perf_counter() - imported
+    backend.close()
+
+    loaded = time.perf_counter()
+    app.store.load()
+    load = time.perf_counter() - loaded
+    app.store.close()
+    print(json.dumps({'import': imported - start, 'read': read, 'load': load}))
+
+
+def start_worker(workdir, env):
+    """Time one cold start in workdir"""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], cwd=workdir,
+                            env={**os.environ, 'VAPE_SHARED_STORAGE': '0', **env},
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def best_start(workdir, env, repeat):
+    """Fastest of repeat cold starts, per timing"""
+    runs = [start_worker(workdir, env) for _ in range(repeat)]
+    return {key: min(run[key] for run in runs) for key in runs[0]}
+
+
+def print_row(label, times, base=None):
+    line = f'{label:<32}{times["import"]:>10.3f}{times["read"]:>10.3f}{times["load"]:>10.3f}'
+    if base is not None:
+        line += f'   (read {base["read"] / times["read"]:.1f}x, load {base["load"] / times["load"]:.1f}x)'
+    print(line)
+
+
+def bench_size(size, repeat, workdir):
+    from synthetic import make_ledger
+    from datastore import JsonFileBackend
+
+    print(f'\n{size} transactions')
+    ledger = make_ledger(size)
+    for label, env in CONFIGS.items():
+        directory = os.path.join(workdir, label.replace(' + ', '_'))
+        os.makedirs(directory)
+        JsonFileBackend(os.path.join(directory, 'vape_data.json')).save(ledger)
+        # First start seeds the backend, moves the history out and writes the snapshot
+        start_worker(directory, env)
+        times = best_start(directory, env, repeat)
+        print_row(label, times, base if label.endswith('snapshot') else None)
+        if not label.endswith('snapshot'):
+            base = times
+        shutil.rmtree(directory)
+
+
+def bench_fresh(repeat, workdir):
+    runs = []
+    for _ in range(repeat):
+        directory = tempfile.mkdtemp(dir=workdir)
+        runs.append(start_worker(directory, CONFIGS['json']))
+        shutil.rmtree(directory)
+    print_row('fresh (initialize_database)', {key: min(run[key] for run in runs) for key in runs[0]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark worker cold start')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated ledger sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    # Importing the app (for the synthetic ledger) opens its data files in the working directory
+    workdir = tempfile.mkdtemp(prefix='vape_startup_')
+    os.chdir(workdir)
+    try:
+        print(f'{"backend":<32}{"import s":>10}{"read s":>10}{"load s":>10}')
+        bench_fresh(args.repeat, workdir)
+        for size in [int(s) for s in args.sizes.split(',')]:
+            bench_size(size, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Concurrency stress test for the shared datastore.
+
+Several worker processes, each running several threads, hammer
+accept-pending-transaction and bulk consignment against one shared data store
+until stock runs out. Afterwards the final state is checked:
+
+- no flavor's inventory is negative (nothing was oversold)
+- initial stock minus every confirmed quantity equals the remaining stock
+  (no worker clobbered another worker's changes)
+- every successful accept/consignment left exactly one ledger entry
+
+Usage: python benchmarks/stress_concurrency.py [--backend journal] [--processes 4]
+                                               [--threads 4] [--stock 60]
+Exits with status 1 if any check fails.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def worker(workdir, backend, threads, seed, results):
+    """Run in a child process: hammer the API from several threads"""
+    os.chdir(workdir)
+    os.environ['VAPE_STORAGE'] = backend
+    os.environ['VAPE_SHARED_STORAGE'] = '1'
+    import app as app_module
+
+    counts = {'accepted': 0, 'consigned_items': 0, 'rejected_out_of_stock': 0}
+    counts_lock = threading.Lock()
+
+    def run(thread_seed):
+        rng = random.Random(thread_seed)
+        client = app_module.app.test_client()
+        misses = 0
+        while misses < 20:
+            flavors = rng.sample(app_module.FLAVORS, 3)
+            if rng.random() < 0.5:
+                response = client.post('/api/transactions', json={
+                    'flavor': flavors[0], 'quantity': rng.randint(1, 3),
+                    'type': 'Direct Sale', 'price': 300
+                })
+                if response.status_code == 201:
+                    txn_id = response.get_json()['transaction']['id']
+                    response = client.post(f'/api/pending-transactions/{txn_id}/accept')
+                    ok_key, items = 'accepted', 1
+                else:
+                    ok_key, items = None, 0
+            else:
+                items = rng.randint(1, 3)
+                response = client.post('/api/consignment/bulk', json={
+                    'consignee': f'Stress {thread_seed % 5}',
+                    'items': [{'flavor': f, 'quantity': rng.randint(1, 2), 'price': 250}
+                              for f in flavors[:items]]
+                })
+                ok_key = 'consigned_items'
+            with counts_lock:
+                if response.status_code in (200, 201) and ok_key:
+                    counts[ok_key] += items
+                    misses = 0
+                else:
+                    counts['rejected_out_of_stock'] += 1
+                    misses += 1
+
+    pool = [threading.Thread(target=run, args=(seed * 100 + i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    app_module.store.close()
+    results.put(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrency stress test for the shared datastore')
+    parser.add_argument('--backend', default='journal', choices=['json', 'journal', 'sqlite'])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--stock', type=int, default=60, help='starting units per flavor')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vape_stress_')
+    os.chdir(workdir)
+    os.environ['VAPE_STORAGE'] = args.backend
+    import app as app_module
+    from datastore import DataStore
+
+    initial = {
+        'inventory': {flavor: args.stock for flavor in app_module.FLAVORS},
+        'transactions': [],
+        'pending_transactions': [],
+        'consignees': {},
+        'settings': app_module.DEFAULT_SETTINGS.copy()
+    }
+    app_module.store.reset(initial)
+    app_module.store.close()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start = time.perf_counter()
+    processes = [context.Process(target=worker, args=(workdir, args.backend, args.threads, seed, results))
+                 for seed in range(args.processes)]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    final = DataStore(app_module.make_backend(args.backend), None).load()
+    failures = []
+
+    negative = {f: q for f, q in final['inventory'].items() if q < 0}
+    if negative:
+        failures.append(f'negative inventory: {negative}')
+
+    for flavor in app_module.FLAVORS:
+        moved = sum(t['quantity'] for t in final['transactions'] if t['flavor'] == flavor)
+        if args.stock - moved != final['inventory'][flavor]:
+            failures.append(f'{flavor}: {args.stock} - {moved} sold != {final["inventory"][flavor]} remaining')
+
+    succeeded = sum(c['accepted'] + c['consigned_items'] for c in counts)
+    if succeeded != len(final['transactions']):
+        failures.append(f'{succeeded} successful items but {len(final["transactions"])} ledger entries')
+
+    rejected = sum(c['rejected_out_of_stock'] for c in counts)
+    print(f'{args.backend}: {args.processes} processes x {args.threads} threads, '
+          f'{succeeded} items confirmed, {rejected} rejected, {elapsed:.2f}s')
+    print(f'remaining stock: {sum(final["inventory"].values())} units')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print('FAILED')
+        for failure in failures:
+            print(f'  - {failure}')
+        sys.exit(1)
+    print('OK - no overselling, no lost updates')
+
+
+if __name__ == '__main__':
+    main()
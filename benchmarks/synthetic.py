@@ -0,0 +1,132 @@
+"""
+Synthetic ledger generator shared by the benchmark scripts.
+
+Builds documents with the same layout as ``initialize_database()`` but with an
+arbitrary number of transactions, flavors, consignees and history events, and
+optionally partial payments against consignee debt.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import FLAVORS, DEFAULT_SETTINGS  # noqa: E402
+
+TYPES = ['Direct Sale', 'Direct Sale', 'Consignment', 'Personal Use']
+
+
+def make_ledger(num_transactions, num_consignees=50, seed=42, num_flavors=None, partial_payments=0):
+    """Return a document with num_transactions confirmed transactions.
+
+    num_flavors adds generated flavors beyond the app's own. partial_payments
+    is the fraction of consignees that have paid part of their debt, each
+    with a few payment records and history events.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    consignee_names = [f'Consignee {i}' for i in range(num_consignees)]
+    flavors = FLAVORS + [f'Flavor {i}' for i in range(len(FLAVORS), num_flavors or 0)]
+    data = {
+        'inventory': {flavor: 10 ** 9 for flavor in flavors},
+        'transactions': [],
+        'pending_transactions': [],
+        'consignees': {},
+        'payments': {},
+        'settings': DEFAULT_SETTINGS.copy(),
+        'transaction_history': []
+    }
+    for i in range(num_transactions):
+        txn_type = rng.choice(TYPES)
+        flavor = rng.choice(flavors)
+        quantity = rng.randint(1, 5)
+        timestamp = (start + timedelta(minutes=i)).isoformat()
+        consignee = rng.choice(consignee_names) if txn_type == 'Consignment' else None
+        price = {
+            'Direct Sale': DEFAULT_SETTINGS['price_standard'],
+            'Consignment': DEFAULT_SETTINGS['price_consignment'],
+            'Personal Use': DEFAULT_SETTINGS['price_personal']
+        }[txn_type]
+        paid = txn_type != 'Consignment' or rng.random() < 0.5
+        data['transactions'].append({
+            'id': i + 1,
+            'type': txn_type,
+            'flavor': flavor,
+            'quantity': quantity,
+            'price': price,
+            'consignee': consignee,
+            'timestamp': timestamp,
+            'confirmed_at': timestamp,
+            'paid': paid
+        })
+        data['inventory'][flavor] -= quantity
+        if consignee:
+            data['consignees'].setdefault(consignee, []).append({
+                'transaction_id': i + 1,
+                'flavor': flavor,
+                'quantity': quantity,
+                'price': price,
+                'paid': paid
+            })
+        data['transaction_history'].append({
+            'id': i + 1,
+            'event_type': 'transaction_accepted',
+            'timestamp': timestamp,
+            'details': {
+                'transaction_id': i + 1,
+                'type': txn_type,
+                'flavor': flavor,
+                'quantity': quantity,
+                'price': price,
+                'consignee': consignee
+            }
+        })
+    if partial_payments:
+        add_partial_payments(data, partial_payments, random.Random(seed + 1), start + timedelta(minutes=num_transactions))
+    return data
+
+
+def add_partial_payments(data, fraction, rng, start):
+    """Pay part of the open items of a fraction of the consignees, as
+    /api/consignees/<name>/partial-pay would"""
+    history = data['transaction_history']
+    timestamp = start
+    for name, items in data['consignees'].items():
+        if rng.random() >= fraction:
+            continue
+        debt = sum(item['quantity'] * item['price'] for item in items if not item['paid'])
+        for _ in range(rng.randint(1, 3)):
+            open_items = [item for item in items if not item['paid']]
+            if not open_items:
+                break
+            item = rng.choice(open_items)
+            remaining = item['quantity'] * item['price'] - item.get('partial_payment', 0)
+            amount = round(remaining * rng.uniform(0.1, 0.9), 2)
+            item['partial_payment'] = item.get('partial_payment', 0) + amount
+            debt -= amount
+            timestamp += timedelta(minutes=1)
+            items_paid = [{
+                'flavor': item['flavor'],
+                'quantity': item['quantity'],
+                'amount': amount,
+                'status': 'partially_paid'
+            }]
+            data['payments'].setdefault(name, []).append({
+                'amount': amount,
+                'timestamp': timestamp.isoformat(),
+                'remaining_debt': round(debt, 2),
+                'items_paid': items_paid
+            })
+            history.append({
+                'id': len(history) + 1,
+                'event_type': 'consignee_partial_payment',
+                'timestamp': timestamp.isoformat(),
+                'details': {
+                    'consignee': name,
+                    'amount': amount,
+                    'remaining_debt': round(debt, 2),
+                    'payment_type': 'partial',
+                    'items_paid': items_paid
+                }
+            })
@@ -0,0 +1,84 @@
+"""
+Branch (store location) partitions of the datastore.
+
+Every branch keeps its own inventory, ledger, pending transactions,
+consignees, payments and settings in its own ``DataStore``, persisted by its
+own backend files and with its own views, locks and data version. A request
+for one branch only ever locks, loads and writes that branch's partition, so
+branches never contend with each other. A partition is created and loaded
+the first time something asks for it.
+
+The default branch keeps the original file names, so data written before
+branches existed is its partition. Other branches get the branch name
+inserted before the extension (``vape_data.json`` -> ``vape_data.roxas.json``,
+``vape_journal`` -> ``vape_journal.roxas``).
+"""
+import os
+import re
+import threading
+
+ALL_BRANCHES = 'all'
+
+_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class UnknownBranch(LookupError):
+    """A request named a branch that is not configured"""
+
+
+def parse_branches(names):
+    """Branch names from a comma-separated list; the first is the default"""
+    branches = [name.strip() for name in names.split(',') if name.strip()]
+    if not branches:
+        raise ValueError('At least one branch is required')
+    for name in branches:
+        if not _NAME.match(name) or name == ALL_BRANCHES:
+            raise ValueError(f'Invalid branch name: {name!r}')
+    if len(set(branches)) != len(branches):
+        raise ValueError('Branch names must be unique')
+    return branches
+
+
+def partition_path(path, branch, default):
+    """File or directory holding branch's partition of the data at path"""
+    if branch == default:
+        return path
+    root, ext = os.path.splitext(path.rstrip('/\\'))
+    return f'{root}.{branch}{ext}'
+
+
+class BranchRegistry:
+    """The configured branches, each built by ``factory(name)`` on first use"""
+
+    def __init__(self, names, factory):
+        self.names = list(names)
+        self.default_name = self.names[0]
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.branches = {}
+
+    def get(self, name=None):
+        """The branch called name (the default branch if None)"""
+        name = name or self.default_name
+        branch = self.branches.get(name)
+        if branch is not None:
+            return branch
+        if name not in self.names:
+            raise UnknownBranch(name)
+        with self.lock:
+            if name not in self.branches:
+                self.branches[name] = self.factory(name)
+            return self.branches[name]
+
+    @property
+    def default(self):
+        return self.get(self.default_name)
+
+    def all(self):
+        """Every configured branch, in configuration order"""
+        return [self.get(name) for name in self.names]
+
+    def loaded(self):
+        """The branches built so far"""
+        with self.lock:
+            return list(self.branches.values())
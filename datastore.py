@@ -0,0 +1,1340 @@
+"""
+Resident in-memory datastore for the Vape Inventory Manager.
+
+The whole document (inventory, transactions, pending transactions, consignees,
+payments and settings) is loaded once at startup and kept in
+memory. Reads are served straight from memory; writes go through a
+``Transaction`` that records every change as a small operation so the active
+backend can persist it.
+"""
+import copy
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import snapshot
+from serialization import get_serializer
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_MISSING = object()
+
+
+def _copy(value):
+    """Shallow copy containers so a recorded change is not altered by later ops"""
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class InterProcessLock:
+    """Exclusive lock on a file shared by every worker process using the same data.
+
+    Re-entrant within a process (the store serializes its own threads), so
+    nested acquisitions only lock the file once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def acquire(self):
+        if self._depth == 0:
+            self._file = open(self.path, 'a+b')
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        self._file.seek(0)
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue  # LK_LOCK gives up after ~10s; keep waiting
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _no_phase(name):
+    return nullcontext()
+
+
+def _file_stamp(path):
+    """(mtime, size, inode) of a file, or None if it does not exist.
+
+    Files rewritten with os.replace get a new inode, so a rewrite is seen
+    even when it keeps the size and lands within the mtime granularity.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class JsonFileBackend:
+    """Persist the full document to a single JSON file.
+
+    Written compact by default; pass a pretty serializer for a file meant
+    to be read by people.
+
+    With ``snapshot_path`` a binary copy of the document (see ``snapshot``)
+    is kept next to the file and read instead of it at startup. It records
+    the (mtime, size, inode) of the JSON file it was taken from and is ignored as
+    soon as that file changes; a stale or unreadable snapshot is rebuilt
+    after the JSON is parsed, and the current document is snapshotted again
+    on ``close``, so a clean restart never parses the JSON.
+    """
+
+    name = 'json'
+
+    def __init__(self, path, serializer=None, snapshot_path=None):
+        self.path = path
+        self.serializer = serializer or get_serializer()
+        self.snapshot_path = snapshot_path
+        self.lock_path = path + '.lock'
+        self._stamp = None
+        self._document = None
+        self._snapshot_current = False
+
+    def _read_snapshot(self):
+        """The snapshotted document if it matches the JSON file, else None"""
+        try:
+            stored = snapshot.read(self.snapshot_path)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        if not isinstance(stored, dict) or stored.get('source') != list(self._stamp):
+            return None
+        return stored['data']
+
+    def _write_snapshot(self, data):
+        try:
+            snapshot.write(self.snapshot_path, {'source': list(self._stamp), 'data': data})
+        except OSError:
+            return
+        self._snapshot_current = True
+
+    def load(self):
+        """Return the stored document, or None if nothing has been saved yet"""
+        self._stamp = _file_stamp(self.path)
+        if self._stamp is None:
+            return None
+        data = self._read_snapshot() if self.snapshot_path else None
+        self._snapshot_current = data is not None
+        if data is None:
+            with open(self.path, 'rb') as f:
+                data = self.serializer.loads(f.read())
+            if self.snapshot_path:
+                self._write_snapshot(data)
+        self._document = data
+        return data
+
+    def save(self, data, ops=None):
+        """Rewrite the document atomically (temp file + rename)"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.serializer.dumps(data))
+        os.replace(tmp_path, self.path)
+        self._stamp = _file_stamp(self.path)
+        self._document = data
+        self._snapshot_current = False
+
+    def changed(self):
+        """True if another process rewrote the file since we last read or wrote it"""
+        return _file_stamp(self.path) != self._stamp
+
+    def catch_up(self):
+        """A whole-file backend can only be caught up by reloading it"""
+        return None
+
+    def reset(self):
+        """Remove all persisted state"""
+        for path in (self.path, self.snapshot_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        self._stamp = None
+        self._document = None
+        self._snapshot_current = False
+
+    def close(self):
+        """Snapshot the document for the next start, unless the file moved on since"""
+        if (self.snapshot_path and self._document is not None and not self._snapshot_current
+                and not self.changed()):
+            self._write_snapshot(self._document)
+
+
+class JournalBackend:
+    """Append-only journal of operations on top of a periodic snapshot.
+
+    Each committed store transaction becomes one compact JSON line in the
+    current segment file (``journal-<n>.log``), so write cost depends on the
+    size of the change rather than the size of the document. Lines are flushed
+    immediately and fsynced in batches (every ``sync_every`` records or
+    ``sync_interval`` seconds, whichever comes first).
+
+    ``snapshot.json`` holds the full document plus the number of the first
+    segment that still has to be replayed on top of it. After
+    ``compact_every`` records the backend writes a fresh snapshot and deletes
+    the segments it covers. A torn final line left by a crash is ignored on
+    replay. With ``binary_snapshot=True`` the snapshot is written as
+    ``snapshot.bin`` in the binary format of ``snapshot`` instead, which loads
+    faster; an existing ``snapshot.json`` is still read until the next
+    compaction replaces it.
+    """
+
+    name = 'journal'
+
+    def __init__(self, directory, sync_every=32, sync_interval=1.0,
+                 segment_bytes=16 * 1024 * 1024, compact_every=10000, serializer=None,
+                 binary_snapshot=False):
+        self.directory = directory
+        self.serializer = serializer or get_serializer()
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.segment_bytes = segment_bytes
+        self.compact_every = compact_every
+        self.binary_snapshot = binary_snapshot
+        self.json_snapshot_path = os.path.join(directory, 'snapshot.json')
+        self.binary_snapshot_path = os.path.join(directory, 'snapshot.bin')
+        self.snapshot_path = self.binary_snapshot_path if binary_snapshot else self.json_snapshot_path
+        self.lock_path = directory.rstrip('/\\') + '.lock'
+        self._segment = None
+        self._file = None
+        self._offset = 0
+        self._snapshot_stamp = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._records_since_snapshot = 0
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'journal-{number:06d}.log')
+
+    def _segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('journal-') and name.endswith('.log'):
+                numbers.append(int(name[len('journal-'):-len('.log')]))
+        return sorted(numbers)
+
+    def _open_segment(self, number):
+        if self._file:
+            self.sync()
+            self._file.close()
+        self._segment = number
+        self._file = open(self._segment_path(number), 'ab')
+        self._offset = self._file.seek(0, os.SEEK_END)
+
+    def _read_records(self, number, offset=0, truncate_torn=False):
+        """Yield (end_offset, ops) for each complete record of a segment"""
+        with open(self._segment_path(number), 'r+b') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    if truncate_torn:
+                        # Torn write from a crash: it was never acknowledged, so drop it
+                        f.truncate(offset)
+                    break
+                offset += len(line)
+                yield offset, self.serializer.loads(line)['ops']
+
+    def _read_snapshot(self):
+        """The newest snapshot on disk, in either format, or None"""
+        if os.path.exists(self.binary_snapshot_path):
+            return snapshot.read(self.binary_snapshot_path)
+        if os.path.exists(self.json_snapshot_path):
+            with open(self.json_snapshot_path, 'rb') as f:
+                return self.serializer.loads(f.read())
+        return None
+
+    def load(self):
+        """Return the snapshot with all later journal records replayed on top"""
+        os.makedirs(self.directory, exist_ok=True)
+        data = None
+        first_segment = 1
+        self._snapshot_stamp = _file_stamp(self.snapshot_path)
+        stored = self._read_snapshot()
+        if stored is not None:
+            data = stored['data']
+            first_segment = stored['segment']
+
+        segments = [n for n in self._segments() if n >= first_segment]
+        replayed = 0
+        index = RecordIndex()
+        for number in segments:
+            for _, ops in self._read_records(number, truncate_torn=True):
+                if data is None:
+                    data = {}
+                tx = Transaction(data, index)
+                for op in ops:
+                    tx.apply(op)
+                replayed += 1
+
+        self._records_since_snapshot = replayed
+        self._open_segment(segments[-1] if segments else first_segment)
+        return data
+
+    def save(self, data, ops=None):
+        """Append one record for ops, or write a full snapshot when ops is None"""
+        if ops is None:
+            self.compact(data)
+            return
+        record = self.serializer.dumps({'ops': ops}) + b'\n'
+        self._file.write(record)
+        self._file.flush()
+        self._offset = self._file.tell()
+        self._unsynced += 1
+        self._records_since_snapshot += 1
+        if (self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+        if self._records_since_snapshot >= self.compact_every:
+            self.compact(data)
+        elif self._file.tell() >= self.segment_bytes:
+            self._open_segment(self._segment + 1)
+
+    def sync(self):
+        """fsync the current segment"""
+        if self._file and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def compact(self, data):
+        """Fold every segment so far into a new snapshot and delete them"""
+        os.makedirs(self.directory, exist_ok=True)
+        next_segment = (self._segment or 0) + 1
+        self._open_segment(next_segment)
+        stored = {'segment': next_segment, 'data': data}
+        if self.binary_snapshot:
+            snapshot.write(self.snapshot_path, stored, sync=True)
+            if os.path.exists(self.json_snapshot_path):
+                os.remove(self.json_snapshot_path)
+        else:
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self.serializer.dumps(stored))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            if os.path.exists(self.binary_snapshot_path):
+                os.remove(self.binary_snapshot_path)
+        self._snapshot_stamp = _file_stamp(self.snapshot_path)
+        for number in self._segments():
+            if number < next_segment:
+                os.remove(self._segment_path(number))
+        self._records_since_snapshot = 0
+
+    def changed(self):
+        """True if another process appended, rotated or compacted since our last read"""
+        if self._segment is None:
+            return True
+        if _file_stamp(self.snapshot_path) != self._snapshot_stamp:
+            return True
+        stamp = _file_stamp(self._segment_path(self._segment))
+        if stamp is None or stamp[1] != self._offset:
+            return True
+        return os.path.exists(self._segment_path(self._segment + 1))
+
+    def catch_up(self):
+        """Return the op lists other processes appended since our last read.
+
+        Returns None (reload everything) if a new snapshot was written, since
+        the records it folded in may already be gone.
+        """
+        if (self._segment is None or _file_stamp(self.snapshot_path) != self._snapshot_stamp
+                or not os.path.exists(self._segment_path(self._segment))):
+            return None
+        batches = []
+        number, offset = self._segment, self._offset
+        while os.path.exists(self._segment_path(number)):
+            for offset, ops in self._read_records(number, offset):
+                batches.append(ops)
+            if not os.path.exists(self._segment_path(number + 1)):
+                break
+            number, offset = number + 1, 0
+        if number != self._segment:
+            self._open_segment(number)
+        self._offset = offset
+        self._records_since_snapshot += len(batches)
+        return batches
+
+    def reset(self):
+        """Remove the snapshot and every journal segment"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._segment = None
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def close(self):
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+class SQLiteBackend:
+    """Persist the document in SQLite (WAL mode) with indexed tables.
+
+    Transactions, pending transactions and the audit history are stored one
+    row per record with indexed id, flavor, type, consignee, paid and
+    timestamp columns next to the full JSON record. Inventory and consignee
+    items get their own tables; any other top-level section (settings,
+    payments, ...) is kept as JSON documents. Each store transaction becomes
+    a single SQLite transaction touching only the rows its operations name.
+    """
+
+    name = 'sqlite'
+
+    # Record lists and the indexed columns extracted from each record
+    RECORD_TABLES = {
+        'transactions': {
+            'flavor': lambda r: r.get('flavor'),
+            'type': lambda r: r.get('type'),
+            'consignee': lambda r: r.get('consignee'),
+            'paid': lambda r: r.get('paid'),
+            'timestamp': lambda r: r.get('timestamp')
+        },
+        'pending_transactions': {
+            'flavor': lambda r: r.get('flavor'),
+            'type': lambda r: r.get('type'),
+            'consignee': lambda r: r.get('consignee'),
+            'timestamp': lambda r: r.get('timestamp')
+        },
+        'transaction_history': {
+            'event_type': lambda r: r.get('event_type'),
+            'consignee': lambda r: (r.get('details') or {}).get('consignee'),
+            'timestamp': lambda r: r.get('timestamp')
+        }
+    }
+    # Document sections stored one row per key instead of as a single blob
+    KEYED_SECTIONS = ('payments', 'sequences')
+
+    def __init__(self, path, serializer=None):
+        self.path = path
+        self.serializer = serializer or get_serializer()
+        self.lock_path = path + '.lock'
+        self.conn = None
+        self._data_version = None
+
+    def _read_data_version(self):
+        return self._connect().execute('PRAGMA data_version').fetchone()[0]
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self._create_schema()
+        return self.conn
+
+    def _create_schema(self):
+        statements = [
+            'CREATE TABLE IF NOT EXISTS inventory (flavor TEXT PRIMARY KEY, quantity INTEGER NOT NULL)',
+            'CREATE TABLE IF NOT EXISTS consignees (seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL)',
+            'CREATE TABLE IF NOT EXISTS consignee_items (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'consignee TEXT NOT NULL, flavor TEXT, paid INTEGER, record TEXT NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS idx_consignee_items_consignee ON consignee_items (consignee)',
+            'CREATE TABLE IF NOT EXISTS documents (section TEXT NOT NULL, name TEXT NOT NULL, '
+            'value TEXT NOT NULL, PRIMARY KEY (section, name))'
+        ]
+        for table, columns in self.RECORD_TABLES.items():
+            column_sql = ''.join(f', {column}' for column in columns)
+            statements.append(f'CREATE TABLE IF NOT EXISTS {table} (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                              f'id INTEGER{column_sql}, record TEXT NOT NULL)')
+            for column in ('id',) + tuple(columns):
+                statements.append(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})')
+        for statement in statements:
+            self.conn.execute(statement)
+
+    def load(self):
+        """Rebuild the document from the tables, or None if the database is empty"""
+        conn = self._connect()
+        self._data_version = self._read_data_version()
+        if not conn.execute('SELECT 1 FROM inventory LIMIT 1').fetchone():
+            return None
+
+        data = {
+            'inventory': dict(conn.execute('SELECT flavor, quantity FROM inventory ORDER BY rowid')),
+            'consignees': {}
+        }
+        for table in self.RECORD_TABLES:
+            records = [self.serializer.loads(record) for (record,) in
+                       conn.execute(f'SELECT record FROM {table} ORDER BY seq')]
+            # The audit history now lives in its own log; only databases
+            # written by older versions still hold rows for it
+            if records or table != 'transaction_history':
+                data[table] = records
+        for (name,) in conn.execute('SELECT name FROM consignees ORDER BY seq'):
+            data['consignees'][name] = []
+        for consignee, record in conn.execute('SELECT consignee, record FROM consignee_items ORDER BY seq'):
+            data['consignees'][consignee].append(self.serializer.loads(record))
+        for section, name, value in conn.execute('SELECT section, name, value FROM documents'):
+            if section in self.KEYED_SECTIONS:
+                data.setdefault(section, {})[name] = self.serializer.loads(value)
+            else:
+                data[section] = self.serializer.loads(value)
+        return data
+
+    def save(self, data, ops=None):
+        """Apply ops in one SQLite transaction, or rewrite everything when ops is None"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if ops is None:
+                for section in set(data) | set(self.RECORD_TABLES) | {'inventory', 'consignees'}:
+                    self._replace_section(data, section)
+            else:
+                for op in ops:
+                    self._apply(data, op)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def changed(self):
+        """True if another connection committed since our last load"""
+        return self._read_data_version() != self._data_version
+
+    def catch_up(self):
+        """Changes made by other processes are picked up by reloading"""
+        return None
+
+    def _encode(self, value):
+        # Stored as TEXT, like rows written by earlier versions
+        return self.serializer.dumps(value).decode()
+
+    def _insert_record(self, table, record):
+        columns = self.RECORD_TABLES[table]
+        names = ', '.join(('id',) + tuple(columns) + ('record',))
+        placeholders = ', '.join('?' * (len(columns) + 2))
+        values = [record.get('id')] + [extract(record) for extract in columns.values()]
+        self.conn.execute(f'INSERT INTO {table} ({names}) VALUES ({placeholders})',
+                          values + [self._encode(record)])
+
+    def _write_consignee(self, data, name):
+        self.conn.execute('DELETE FROM consignee_items WHERE consignee = ?', (name,))
+        items = data.get('consignees', {}).get(name)
+        if items is None:
+            self.conn.execute('DELETE FROM consignees WHERE name = ?', (name,))
+            return
+        self.conn.execute('INSERT OR IGNORE INTO consignees (name) VALUES (?)', (name,))
+        for item in items:
+            self._insert_consignee_item(name, item)
+
+    def _insert_consignee_item(self, name, item):
+        self.conn.execute('INSERT INTO consignee_items (consignee, flavor, paid, record) VALUES (?, ?, ?, ?)',
+                          (name, item.get('flavor'), item.get('paid'), self._encode(item)))
+
+    def _write_document(self, data, section, name=''):
+        value = data.get(section)
+        if name and value is not None:
+            value = value.get(name)
+        if value is None:
+            self.conn.execute('DELETE FROM documents WHERE section = ? AND name = ?', (section, name))
+        else:
+            self.conn.execute('INSERT OR REPLACE INTO documents (section, name, value) VALUES (?, ?, ?)',
+                              (section, name, self._encode(value)))
+
+    def _replace_section(self, data, section):
+        conn = self.conn
+        if section in self.RECORD_TABLES:
+            conn.execute(f'DELETE FROM {section}')
+            for record in data.get(section, []):
+                self._insert_record(section, record)
+        elif section == 'inventory':
+            conn.execute('DELETE FROM inventory')
+            conn.executemany('INSERT INTO inventory (flavor, quantity) VALUES (?, ?)',
+                             data.get('inventory', {}).items())
+        elif section == 'consignees':
+            conn.execute('DELETE FROM consignee_items')
+            conn.execute('DELETE FROM consignees')
+            for name in data.get('consignees', {}):
+                self._write_consignee(data, name)
+        else:
+            conn.execute('DELETE FROM documents WHERE section = ?', (section,))
+            if section in self.KEYED_SECTIONS:
+                for name in data.get(section) or {}:
+                    self._write_document(data, section, name)
+            else:
+                self._write_document(data, section)
+
+    def _apply(self, data, op):
+        kind, path = op[0], tuple(op[1])
+        section = path[0]
+        conn = self.conn
+
+        if len(path) == 1 and kind in ('set', 'delete'):
+            # Write the recorded value rather than the current document:
+            # later ops of the same batch are already applied to it
+            self._replace_section({section: op[2]} if kind == 'set' else {}, section)
+        elif section in self.RECORD_TABLES and len(path) == 1 and kind in ('append', 'update', 'remove'):
+            if kind == 'append':
+                self._insert_record(section, op[2])
+                return
+            row = conn.execute(f'SELECT seq, record FROM {section} WHERE id = ? ORDER BY seq LIMIT 1',
+                               (op[2],)).fetchone()
+            if row is None:
+                return
+            if kind == 'remove':
+                conn.execute(f'DELETE FROM {section} WHERE seq = ?', (row[0],))
+                return
+            record = self.serializer.loads(row[1])
+            record.update(op[3])
+            columns = self.RECORD_TABLES[section]
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            conn.execute(f'UPDATE {section} SET {assignments}, record = ? WHERE seq = ?',
+                         [extract(record) for extract in columns.values()] + [self._encode(record), row[0]])
+        elif section == 'inventory' and len(path) == 2:
+            if kind == 'delete':
+                conn.execute('DELETE FROM inventory WHERE flavor = ?', (path[1],))
+            else:
+                conn.execute('INSERT INTO inventory (flavor, quantity) VALUES (?, ?) '
+                             'ON CONFLICT (flavor) DO UPDATE SET quantity = excluded.quantity',
+                             (path[1], data['inventory'][path[1]]))
+        elif section == 'consignees' and len(path) >= 2:
+            if kind == 'append' and len(path) == 2:
+                conn.execute('INSERT OR IGNORE INTO consignees (name) VALUES (?)', (path[1],))
+                self._insert_consignee_item(path[1], op[2])
+            elif kind in ('set', 'delete') and len(path) == 2:
+                items = {path[1]: op[2]} if kind == 'set' else {}
+                self._write_consignee({'consignees': items}, path[1])
+            else:
+                self._write_consignee(data, path[1])
+        elif section in self.KEYED_SECTIONS and len(path) >= 2:
+            self._write_document(data, section, path[1])
+        else:
+            self._replace_section(data, section)
+
+    def reset(self):
+        """Delete the database files"""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class RecordIndex:
+    """id -> record maps for the top-level record lists.
+
+    A section's map is built on first lookup and then kept in step by
+    ``Transaction`` as records are appended and removed; replacing the whole
+    list drops it. Legacy data may contain duplicate ids: the first record
+    wins, as with a scan, and the map is rebuilt after such a record is
+    removed.
+    """
+
+    def __init__(self):
+        self._maps = {}
+        self._duplicates = set()
+
+    def lookup(self, data, section, record_id):
+        records = self._maps.get(section)
+        if records is None:
+            records = self._build(data, section)
+        return records.get(record_id)
+
+    def _build(self, data, section):
+        records = {}
+        items = data.get(section) or []
+        for record in items:
+            records.setdefault(record['id'], record)
+        if len(records) < len(items):
+            self._duplicates.add(section)
+        else:
+            self._duplicates.discard(section)
+        self._maps[section] = records
+        return records
+
+    def added(self, section, record):
+        records = self._maps.get(section)
+        if records is not None:
+            if record['id'] in records:
+                self._duplicates.add(section)
+            else:
+                records[record['id']] = record
+
+    def removed(self, section, record):
+        records = self._maps.get(section)
+        if records is None:
+            return
+        if section in self._duplicates:
+            self.invalidate(section)
+        elif records.get(record['id']) is record:
+            del records[record['id']]
+
+    def invalidate(self, section=None):
+        if section is None:
+            self._maps.clear()
+        else:
+            self._maps.pop(section, None)
+
+
+class Transaction:
+    """A set of changes applied to the in-memory document as one unit.
+
+    Every mutation is applied immediately (so later reads in the same
+    transaction see it) and recorded as an operation tuple:
+
+    - ``('set', path, value)``          set a dict key
+    - ``('delete', path)``              remove a dict key
+    - ``('append', path, value)``       append to a list
+    - ``('update', path, id, fields)``  update the list record with ``id``
+    - ``('remove', path, id)``          remove the list record with ``id``
+
+    ``path`` is a tuple of dict keys starting at the document root. Values are
+    recorded by reference, so a value handed to ``set``/``append`` should only
+    be changed afterwards through further operations. If the transaction body
+    raises, the changes are undone in reverse order.
+
+    Alongside the ops, ``changes`` lists ``(kind, path, old, new)`` for store
+    views: for list records ``old``/``new`` are copies of the record before and
+    after the op (None when it did not exist), for ``set``/``delete`` they are
+    the previous and new values.
+
+    Callables added to ``on_commit`` run once the transaction has been
+    persisted, still under the store lock; they are dropped on rollback.
+
+    ``owned`` (id -> container), when given, makes the transaction copy on
+    write: a dict, list or list record that is not in it may be shared with
+    a pinned ``Snapshot``, so it is replaced by a copy (which is then owned)
+    before the first change to it. The root must already be owned.
+    """
+
+    def __init__(self, data, index=None, owned=None):
+        self.data = data
+        self.index = RecordIndex() if index is None else index
+        self.owned = owned
+        self.ops = []
+        self.changes = []
+        self.on_commit = []
+        self._undo = []
+
+    def apply(self, op):
+        """Replay a recorded operation (paths may arrive as JSON lists)"""
+        kind, path, *args = op
+        return getattr(self, kind)(path, *args)
+
+    def _create(self, path, empty):
+        # Record a fresh empty value so later in-place appends are not
+        # captured twice (once by this op and once by their own op)
+        self.set(path, empty)
+        self.ops[-1] = ('set', path, type(empty)())
+
+    def _own(self, node, key):
+        """node[key], first replaced by a private copy if a snapshot may share it"""
+        child = node[key]
+        if self.owned is not None and id(child) not in self.owned and isinstance(child, (dict, list)):
+            child = _copy(child)
+            node[key] = child
+            self.owned[id(child)] = child
+        return child
+
+    def _parent(self, path, create=False):
+        node = self.data
+        for depth, key in enumerate(path[:-1]):
+            if key not in node:
+                if not create:
+                    raise KeyError(key)
+                self._create(path[:depth + 1], {})
+            node = self._own(node, key)
+        return node
+
+    def _list(self, path, create=False):
+        parent = self._parent(path, create)
+        key = path[-1]
+        if key not in parent:
+            if not create:
+                raise KeyError(key)
+            self._create(path, [])
+        return self._own(parent, key)
+
+    def get(self, path, default=None):
+        """Read a value by path, returning default if any key is missing"""
+        node = self.data
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return default
+            node = node[key]
+        return node
+
+    def set(self, path, value):
+        path = tuple(path)
+        parent = self._parent(path, create=True)
+        key = path[-1]
+        old = parent.get(key, _MISSING)
+        parent[key] = value
+        self.ops.append(('set', path, value))
+        self.changes.append(('set', path, None if old is _MISSING else old, _copy(value)))
+        self._undo.append(lambda: parent.pop(key) if old is _MISSING else parent.__setitem__(key, old))
+        self._invalidate(path)
+
+    def delete(self, path):
+        path = tuple(path)
+        parent = self._parent(path)
+        key = path[-1]
+        old = parent.pop(key)
+        self.ops.append(('delete', path))
+        self.changes.append(('delete', path, old, None))
+        self._undo.append(lambda: parent.__setitem__(key, old))
+        self._invalidate(path)
+
+    def _invalidate(self, path):
+        # A whole record list (or the document above it) was replaced
+        if len(path) == 1:
+            self.index.invalidate(path[0])
+            self._undo.append(lambda: self.index.invalidate(path[0]))
+
+    def append(self, path, value):
+        path = tuple(path)
+        items = self._list(path, create=True)
+        items.append(value)
+        self.ops.append(('append', path, value))
+        self.changes.append(('append', path, None, _copy(value)))
+        if len(path) == 1 and isinstance(value, dict) and 'id' in value:
+            self.index.added(path[0], value)
+
+            def undo():
+                items.pop()
+                self.index.removed(path[0], value)
+            self._undo.append(undo)
+        else:
+            self._undo.append(items.pop)
+        return value
+
+    def next_id(self, section):
+        """Allocate the next id for a top-level record list.
+
+        The last id handed out is kept in ``data['sequences']`` and persisted
+        with the transaction, so ids never repeat after records are removed.
+        A section without a sequence yet starts after its highest existing id.
+        """
+        last = self.get(('sequences', section))
+        if last is None:
+            last = max((record['id'] for record in self.data.get(section) or []), default=0)
+        self.set(('sequences', section), last + 1)
+        return last + 1
+
+    def find(self, path, record_id):
+        """Return (index, record) for the list record with the given id"""
+        path = tuple(path)
+        items = self.get(path) or []
+        if len(path) == 1:
+            record = self.index.lookup(self.data, path[0], record_id)
+            if record is None:
+                return None, None
+            return self._position(items, record), record
+        for index, record in enumerate(items):
+            if record['id'] == record_id:
+                return index, record
+        return None, None
+
+    @staticmethod
+    def _position(items, record):
+        # Ids increase along the list, so binary search first; lists with
+        # out-of-order ids fall back to a scan
+        low, high = 0, len(items)
+        while low < high:
+            mid = (low + high) // 2
+            if items[mid]['id'] < record['id']:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(items) and items[low] is record:
+            return low
+        for index, item in enumerate(items):
+            if item is record:
+                return index
+        return None
+
+    def update(self, path, record_id, fields):
+        path = tuple(path)
+        index, record = self.find(path, record_id)
+        if record is None:
+            raise KeyError(record_id)
+        if self.owned is not None and id(record) not in self.owned:
+            items = self._list(path)
+            shared, record = record, dict(record)
+            items[index] = record
+            self.owned[id(record)] = record
+            if len(path) == 1:
+                self.index.removed(path[0], shared)
+                self.index.added(path[0], record)
+        old = {key: record.get(key, _MISSING) for key in fields}
+        before = dict(record)
+        record.update(fields)
+        self.ops.append(('update', path, record_id, fields))
+        self.changes.append(('update', path, before, dict(record)))
+
+        def undo():
+            for key, value in old.items():
+                if value is _MISSING:
+                    record.pop(key, None)
+                else:
+                    record[key] = value
+        self._undo.append(undo)
+        return record
+
+    def remove(self, path, record_id):
+        path = tuple(path)
+        index, record = self.find(path, record_id)
+        if record is None:
+            raise KeyError(record_id)
+        items = self._list(path)
+        del items[index]
+        self.ops.append(('remove', path, record_id))
+        self.changes.append(('remove', path, record, None))
+        if len(path) == 1:
+            self.index.removed(path[0], record)
+
+        def undo():
+            items.insert(index, record)
+            if len(path) == 1:
+                self.index.added(path[0], record)
+        self._undo.append(undo)
+        return record
+
+    def rollback(self):
+        while self._undo:
+            self._undo.pop()()
+        self.ops = []
+        self.changes = []
+        self.on_commit = []
+
+
+class GroupCommit:
+    """Settings and counters of the store's group commit stage.
+
+    Commits that arrive within ``window`` seconds of the first one of a
+    batch, up to ``max_batch`` of them, are persisted together with one
+    backend write (and one fsync where the backend has ``sync``). Each
+    commit returns only once its batch is written. ``on_flush(size,
+    seconds)`` is called with the number of commits and the write time of
+    every batch, ``on_commit(seconds)`` with the time each commit waited
+    for its batch.
+    """
+
+    def __init__(self, window=0.002, max_batch=64, on_flush=None, on_commit=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.on_flush = on_flush
+        self.on_commit = on_commit
+        self.batches = 0
+        self.commits = 0
+        self.largest = 0
+
+    def flushed(self, size, seconds):
+        self.batches += 1
+        self.commits += size
+        self.largest = max(self.largest, size)
+        if self.on_flush is not None:
+            self.on_flush(size, seconds)
+
+    def committed(self, seconds):
+        if self.on_commit is not None:
+            self.on_commit(seconds)
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch': self.max_batch,
+            'batches': self.batches,
+            'commits': self.commits,
+            'mean_batch': round(self.commits / self.batches, 2) if self.batches else None,
+            'largest_batch': self.largest
+        }
+
+
+class Snapshot:
+    """A pinned, read-only version of a store's document (see ``DataStore.snapshot``)"""
+
+    def __init__(self, store, data, version):
+        self.store = store
+        self.data = data
+        self.version = version
+        self._released = False
+
+    def release(self):
+        """Unpin the version; its data must not be used afterwards"""
+        if not self._released:
+            self._released = True
+            self.store._unpin(self.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _Batch:
+    """Ops of the commits waiting for the same backend write"""
+
+    def __init__(self):
+        self.ops = []
+        self.commits = 0
+        self.done = threading.Event()
+        self.error = None
+
+
+class DataStore:
+    """Lock-protected, resident copy of the document backed by a pluggable backend.
+
+    Views registered with ``add_view`` keep derived state (aggregates,
+    indexes) in step with the document. A view implements ``rebuild(data)``,
+    called whenever the whole document is (re)loaded, and
+    ``apply(data, changes)``, called with ``Transaction.changes`` once a
+    transaction has been persisted.
+
+    With ``shared=True`` several processes (e.g. gunicorn workers) can use the
+    same backend: every transaction holds an exclusive lock on the backend's
+    lock file, and before reading or writing the store checks whether another
+    process committed in the meantime and catches up (replaying just the new
+    journal records where the backend supports it, reloading otherwise). A
+    stock check and the decrement that follows it therefore always see the
+    latest committed inventory, in any worker.
+
+    ``upgrade(tx)``, if given, runs in a transaction every time the document
+    is loaded, to bring data written by older versions up to date.
+
+    ``phase(name)``, if given, returns a context manager wrapped around the
+    store's I/O: 'load' for loading and catching up, 'persist' for backend
+    writes (see ``instrumentation.RequestMetrics.phase``).
+
+    With ``group_commit`` (a ``GroupCommit``), the ops of transactions
+    committed close together are written in one batch. A transaction is
+    applied to the document (and views) at once and the store lock is
+    released for the next one, but it only returns after its batch is
+    written; the inter-process lock is held from the first commit of a
+    batch until its write, so other workers never see a partial batch.
+    Reads in this process may see a commit up to ``window`` before it is
+    durable. If a batch write fails, every transaction in it raises and the
+    document is reloaded from the backend.
+
+    ``version`` counts committed transactions. It is stored in the document
+    (``data['version']``) by every commit, so all processes sharing a backend
+    agree on it, and it keeps increasing across resets.
+
+    ``snapshot()`` pins the current version for a long read without copying
+    it; writers carry on and copy what they change instead (see
+    ``snapshot``).
+    """
+
+    def __init__(self, backend, initializer, shared=False, upgrade=None, phase=None, group_commit=None):
+        self.backend = backend
+        self.initializer = initializer
+        self.upgrade = upgrade
+        self.phase = phase or _no_phase
+        self.group_commit = group_commit
+        self._batch = None
+        self._loading = False
+        self.lock = threading.RLock()
+        self.process_lock = InterProcessLock(backend.lock_path) if shared else None
+        self.version = 0
+        self.views = []
+        self.index = RecordIndex()
+        self._data = None
+        # Containers of the document not shared with any snapshot, by id;
+        # None while nothing is pinned
+        self._owned = None
+        self._pins = {}
+
+    def add_view(self, view):
+        """Register a derived view and build it from the current document"""
+        with self.lock:
+            self.views.append(view)
+            if self._data is not None:
+                view.rebuild(self._data)
+            return view
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the store lock and, for shared stores, the inter-process lock"""
+        with self.lock:
+            if self.process_lock is None:
+                yield
+            else:
+                with self.process_lock:
+                    yield
+
+    def _install(self, data):
+        self._data = data
+        self._owned = None
+        self.version = data.get('version', 0)
+        self.index.invalidate()
+        for view in self.views:
+            view.rebuild(data)
+
+    def _upgrade(self):
+        if self.upgrade is not None:
+            self._loading = True
+            try:
+                with self.transaction() as tx:
+                    self.upgrade(tx)
+            finally:
+                self._loading = False
+
+    def _writable(self):
+        """Transaction on the document, copying its root first if a snapshot shares it"""
+        if self._owned is not None and id(self._data) not in self._owned:
+            self._data = dict(self._data)
+            self._owned[id(self._data)] = self._data
+        return Transaction(self._data, self.index, self._owned)
+
+    def _apply_ops(self, ops):
+        tx = self._writable()
+        for op in ops:
+            tx.apply(op)
+        for view in self.views:
+            view.apply(self._data, tx.changes)
+        self.version = self._data.get('version', 0)
+
+    def _refresh(self):
+        """Load the document, or catch up with commits from other processes"""
+        if self._data is None:
+            self.load()
+        elif self.process_lock is not None and self.backend.changed():
+            with self.phase('load'):
+                batches = self.backend.catch_up()
+                if batches is None:
+                    self.load()
+                else:
+                    for ops in batches:
+                        self._apply_ops(ops)
+
+    def load(self):
+        """Load the document from the backend, initializing it if missing"""
+        with self._exclusive(), self.phase('load'):
+            self._flush_batch()
+            data = self.backend.load()
+            if data is None:
+                data = self.initializer()
+                self.backend.save(data)
+            self._install(data)
+            self._upgrade()
+            return data
+
+    def reset(self, data=None):
+        """Drop all persisted state and start again from data (or the initializer)"""
+        with self._exclusive():
+            self._flush_batch()
+            self._refresh()
+            version = self.version + 1
+            self.backend.reset()
+            self._data = None
+            if data is None:
+                data = self.initializer()
+            data['version'] = version
+            with self.phase('persist'):
+                self.backend.save(data)
+            self._install(data)
+            self._upgrade()
+            return data
+
+    def close(self):
+        """Flush anything the backend still buffers"""
+        with self.lock:
+            self._flush_batch()
+            self.backend.close()
+
+    @property
+    def data(self):
+        if self._data is None:
+            self.load()
+        return self._data
+
+    @contextmanager
+    def read(self):
+        """Hold the store lock while reading the in-memory document"""
+        with self.lock:
+            if self._data is None or (self.process_lock is not None and self.backend.changed()):
+                with self._exclusive():
+                    self._refresh()
+            yield self._data
+
+    def snapshot(self):
+        """Pin the current version of the document for a long read.
+
+        Nothing is copied: the returned ``Snapshot`` shares the document's
+        containers. While any snapshot is pinned, transactions copy each
+        dict, list or list record the first time they change it and leave
+        the pinned one alone, so the snapshot never changes and writers never
+        wait for its reader. ``release()`` (or leaving a ``with`` block)
+        unpins it; a version is freed with its last snapshot, and once none
+        are pinned writes change the document in place again. Views are not
+        pinned: read what a snapshot needs from them under ``read()``.
+        """
+        with self.read() as data:
+            self._owned = {}
+            self._pins[self.version] = self._pins.get(self.version, 0) + 1
+            return Snapshot(self, data, self.version)
+
+    def _unpin(self, version):
+        with self.lock:
+            self._pins[version] -= 1
+            if not self._pins[version]:
+                del self._pins[version]
+            if not self._pins:
+                self._owned = None
+
+    @property
+    def pinned(self):
+        """Number of live snapshots per pinned version"""
+        with self.lock:
+            return dict(self._pins)
+
+    @contextmanager
+    def transaction(self):
+        """Apply changes atomically and persist them when the block exits"""
+        # Upgrades run while loading, often inside the first transaction's
+        # batch, and are written on their own
+        if self.group_commit is not None and not self._loading:
+            with self._grouped_transaction() as txn:
+                yield txn
+            return
+
+        with self._exclusive():
+            self._refresh()
+            txn = self._writable()
+            try:
+                yield txn
+            except BaseException:
+                txn.rollback()
+                raise
+            if txn.ops:
+                txn.set(('version',), self.version + 1)
+                try:
+                    with self.phase('persist'):
+                        self.backend.save(self._data, txn.ops)
+                except BaseException:
+                    txn.rollback()
+                    raise
+                for view in self.views:
+                    view.apply(self._data, txn.changes)
+                self.version += 1
+            for callback in txn.on_commit:
+                callback()
+
+    def _open_batch(self):
+        """The batch the next commit joins, locking out other processes while it is open"""
+        if self._batch is None:
+            if self.process_lock is not None:
+                self.process_lock.acquire()
+            self._batch = _Batch()
+        return self._batch
+
+    def _close_batch(self):
+        batch, self._batch = self._batch, None
+        if self.process_lock is not None:
+            self.process_lock.release()
+        batch.done.set()
+
+    def _flush_batch(self):
+        """Write the open batch, if any; call with the store lock held.
+
+        An empty batch belongs to a transaction still running on this thread
+        (e.g. one whose first read loads the store), so it is left open.
+        """
+        batch = self._batch
+        if batch is None or not batch.ops:
+            return
+        start = time.perf_counter()
+        try:
+            with self.phase('persist'):
+                self.backend.save(self._data, batch.ops)
+                sync = getattr(self.backend, 'sync', None)
+                if sync is not None:
+                    sync()
+        except BaseException as exc:
+            batch.error = exc
+        self._close_batch()
+        self.group_commit.flushed(batch.commits, time.perf_counter() - start)
+        if batch.error is not None:
+            # The document holds commits that were never written; start over from disk
+            self._data = None
+
+    @contextmanager
+    def _grouped_transaction(self):
+        with self.lock:
+            batch = self._open_batch()
+            try:
+                self._refresh()
+            except BaseException:
+                if not batch.ops:
+                    self._close_batch()
+                raise
+            txn = self._writable()
+            try:
+                yield txn
+            except BaseException:
+                txn.rollback()
+                if not batch.ops:
+                    self._close_batch()
+                raise
+            if not txn.ops:
+                if not batch.ops:
+                    self._close_batch()
+            else:
+                txn.set(('version',), self.version + 1)
+                for view in self.views:
+                    view.apply(self._data, txn.changes)
+                self.version += 1
+                leader = not batch.ops
+                batch.commits += 1
+                if batch.commits >= self.group_commit.max_batch:
+                    batch.ops.extend(txn.ops)
+                    self._flush_batch()
+                else:
+                    # Ops hold values by reference, and later commits of the
+                    # batch may change them in place before it is written
+                    batch.ops.extend(copy.deepcopy(txn.ops))
+
+        if txn.ops:
+            start = time.perf_counter()
+            with self.phase('persist'):
+                # The first commit of a batch writes it when the window closes,
+                # unless it filled up first
+                if leader and not batch.done.wait(self.group_commit.window):
+                    with self.lock:
+                        if self._batch is batch:
+                            self._flush_batch()
+                batch.done.wait()
+            self.group_commit.committed(time.perf_counter() - start)
+            if batch.error is not None:
+                raise RuntimeError('Group commit failed; the change was not saved') from batch.error
+        for callback in txn.on_commit:
+            callback()
@@ -0,0 +1,127 @@
+"""
+Server-sent event fan-out for /api/events.
+
+Every connected client has a small bounded queue of encoded messages. An
+event is serialized once and the same bytes are offered to every queue, so
+publishing costs one append per subscriber and never waits on a client. A
+client whose queue is full is a slow consumer: it is dropped (its stream
+ends) and has to reconnect and resync, instead of holding up everyone else
+or buffering without limit.
+"""
+import threading
+from collections import deque
+
+from serialization import get_serializer
+
+_serializer = get_serializer()
+
+
+def encode_event(data, event=None, event_id=None):
+    """Encode one SSE message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}'.encode())
+    if event:
+        lines.append(f'event: {event}'.encode())
+    lines.append(b'data: ' + _serializer.dumps(data))
+    return b'\n'.join(lines) + b'\n\n'
+
+
+class Subscriber:
+    """Bounded message queue of one connected client"""
+
+    def __init__(self, max_queued):
+        self.max_queued = max_queued
+        self.queue = deque()
+        self.ready = threading.Event()
+        self.dropped = False
+
+    def offer(self, message):
+        """Queue a message; False if the client has fallen too far behind"""
+        if len(self.queue) >= self.max_queued:
+            return False
+        self.queue.append(message)
+        self.ready.set()
+        return True
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for messages and return all queued ones"""
+        if not self.queue:
+            self.ready.wait(timeout)
+        self.ready.clear()
+        messages = []
+        while self.queue:
+            messages.append(self.queue.popleft())
+        return messages
+
+
+class EventBroker:
+    """Publish messages to every subscriber, dropping the ones that lag"""
+
+    def __init__(self, max_queued=100, max_subscribers=1000):
+        self.max_queued = max_queued
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        """Register a new client, or return None when the server is full"""
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(self.max_queued)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, data, event=None, event_id=None):
+        """Offer one event to every subscriber; returns how many accepted it"""
+        message = encode_event(data, event, event_id)
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.published += 1
+        slow = [subscriber for subscriber in subscribers if not subscriber.offer(message)]
+        if slow:
+            with self.lock:
+                for subscriber in slow:
+                    self.subscribers.discard(subscriber)
+                    subscriber.dropped = True
+                    subscriber.ready.set()
+                self.dropped += len(slow)
+        return len(subscribers) - len(slow)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'published': self.published,
+                'dropped': self.dropped
+            }
+
+
+class ChangePublisher:
+    """Store view that publishes a delta for every committed transaction.
+
+    ``describe(data, changes)`` turns a commit into the event payload (or
+    None to publish nothing). A reload of the whole document cannot be
+    described as a delta, so subscribers get a ``resync`` event instead.
+    """
+
+    def __init__(self, broker, describe):
+        self.broker = broker
+        self.describe = describe
+
+    def rebuild(self, data):
+        version = data.get('version', 0)
+        self.broker.publish({'version': version}, 'resync', version)
+
+    def apply(self, data, changes):
+        payload = self.describe(data, changes)
+        if payload is not None:
+            version = data.get('version', 0)
+            self.broker.publish(payload, 'resync' if payload.get('resync') else 'change', version)
@@ -0,0 +1,145 @@
+"""
+Background export jobs with a version-keyed artifact cache.
+
+Exports run on a small thread pool so they do not hold a Flask worker for the
+whole write. Each finished export is kept on disk under its cache key (the
+data version plus the export options); asking for the same key again returns
+the existing job, so unchanged data is served instantly. The oldest artifacts
+are deleted once more than ``max_artifacts`` are cached.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExportJob:
+    """State of one export: queued -> running -> done (or failed)"""
+
+    def __init__(self, key, total_rows, filename):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.total_rows = total_rows
+        self.filename = filename
+        self.rows_written = 0
+        self.status = 'queued'
+        self.error = None
+        self.path = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def track(self, rows):
+        """Wrap a row iterable so writing it advances the job's progress"""
+        for row in rows:
+            self.rows_written += 1
+            yield row
+
+    @property
+    def progress(self):
+        if self.status == 'done':
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return round(min(1.0, self.rows_written / self.total_rows), 4)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'rows_written': self.rows_written,
+            'total_rows': self.total_rows,
+            'filename': self.filename,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class ExportJobManager:
+    """Run export jobs on a thread pool and cache their artifacts by key"""
+
+    def __init__(self, directory, max_workers=2, max_artifacts=8):
+        self.max_artifacts = max_artifacts
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self._by_key = OrderedDict()
+        # Data versions are per process, so each process keeps its own artifacts
+        os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='exports-', dir=directory)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cached(self, key):
+        """Return the live (queued, running or done) job for key, if any"""
+        with self.lock:
+            job = self._by_key.get(key)
+            if job is None or job.status == 'failed':
+                return None
+            self._by_key.move_to_end(key)
+            return job
+
+    def submit(self, key, total_rows, filename, build, discard=None):
+        """Queue build(fileobj, job) for key unless a live job already covers it.
+        
+        If one does, build never runs and discard() (if given) is called instead.
+        """
+        with self.lock:
+            job = self._by_key.get(key)
+            if job is not None and job.status != 'failed':
+                self._by_key.move_to_end(key)
+                if discard is not None:
+                    discard()
+                return job
+            job = ExportJob(key, total_rows, filename)
+            self.jobs[job.id] = job
+            self._by_key[key] = job
+            self._by_key.move_to_end(key)
+        self.executor.submit(self._run, job, build)
+        return job
+
+    def _run(self, job, build):
+        job.status = 'running'
+        path = os.path.join(self.directory, f'{job.id}-{job.filename}')
+        try:
+            with open(path, 'wb') as f:
+                build(f, job)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            self._remove(path)
+        else:
+            job.path = path
+            job.status = 'done'
+            self._evict()
+        finally:
+            job.finished_at = time.time()
+            job.finished.set()
+
+    def _evict(self):
+        with self.lock:
+            done = [key for key, job in self._by_key.items() if job.status == 'done']
+            for key in done[:max(0, len(done) - self.max_artifacts)]:
+                job = self._by_key.pop(key)
+                self.jobs.pop(job.id, None)
+                self._remove(job.path)
+
+    def close(self):
+        """Stop the workers and delete every cached artifact"""
+        self.executor.shutdown(wait=False)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # already gone, or still open for download on Windows
@@ -0,0 +1,42 @@
+"""
+Excel and CSV export writers.
+
+A sheet is a ``(name, columns, rows)`` tuple where ``rows`` is any iterable of
+row lists, usually a generator. Rows are written straight to the output as
+they are produced: XlsxWriter runs in ``constant_memory`` mode (each row is
+flushed to disk once written) and CSV is streamed in chunks, so memory stays
+bounded however large the ledger is.
+"""
+import csv
+import io
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def write_xlsx(fileobj, sheets):
+    """Write the sheets as an .xlsx workbook into a binary file object"""
+    # Imported on first use, so workers that never export start faster
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    for name, columns, rows in sheets:
+        worksheet = workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, columns, header_format)
+        for row_number, row in enumerate(rows, start=1):
+            worksheet.write_row(row_number, 0, row)
+    workbook.close()
+
+
+def iter_csv(columns, rows, chunk_rows=1000):
+    """Yield a CSV document in chunks of chunk_rows rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
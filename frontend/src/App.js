@@ -57,6 +57,33 @@ function App() {
     loadData();
   }, []);
 
+  useEffect(() => {
+    // Live updates from other tabs and devices; EventSource reconnects on its own
+    const events = new EventSource(`${API_URL}/events`);
+    events.addEventListener('change', (event) => {
+      const delta = JSON.parse(event.data);
+      if (delta.pending) {
+        setPendingCount(delta.pending.count);
+      }
+      if (delta.inventory || delta.consignee_debt) {
+        fetchDashboard();
+      }
+      if (delta.consignee_debt) {
+        fetchConsignees();
+      }
+    });
+    let connected = false;
+    events.addEventListener('hello', () => {
+      // After a reconnect, changes made while disconnected were missed
+      if (connected) {
+        refreshData();
+      }
+      connected = true;
+    });
+    events.addEventListener('resync', refreshData);
+    return () => events.close();
+  }, []);
+
   const handleExport = async () => {
     try {
       const response = await axios.get(`${API_URL}/export`, {
@@ -50,6 +50,23 @@ function PendingTransactions({ onUpdate }) {
     }
   };
 
+  const handleBatch = async (action) => {
+    const label = action === 'accept' ? 'Accept' : 'Reject';
+    if (!window.confirm(`${label} all ${pending.length} pending transactions?`)) return;
+
+    try {
+      const response = await axios.post(`${API_URL}/pending-transactions/batch`, {
+        [action]: pending.map(txn => txn.id)
+      });
+      toast.success(response.data.message);
+      fetchPending();
+      if (action === 'accept') onUpdate();
+    } catch (error) {
+      const failed = (error.response?.data?.results || []).find(result => result.error);
+      toast.error(failed?.error || error.response?.data?.error || `Failed to ${action} transactions`);
+    }
+  };
+
   if (loading) {
     return <div className="loading">Loading pending transactions...</div>;
   }
@@ -68,6 +85,17 @@ function PendingTransactions({ onUpdate }) {
       <h2>⏳ Pending Transactions ({pending.length})</h2>
       <p className="pending-description">Review and approve or reject transactions before they're finalized.</p>
 
+      {pending.length > 1 && (
+        <div className="pending-actions pending-batch-actions">
+          <button className="accept-btn" onClick={() => handleBatch('accept')}>
+            ✅ Accept All
+          </button>
+          <button className="reject-btn" onClick={() => handleBatch('reject')}>
+            ❌ Reject All
+          </button>
+        </div>
+      )}
+
       <div className="pending-list">
         {pending.map(txn => (
           <div key={txn.id} className="pending-card">
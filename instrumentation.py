@@ -0,0 +1,260 @@
+"""
+Opt-in request metrics and on-demand profiling for the API.
+
+``RequestMetrics`` keeps Prometheus-style histograms of request latency per
+route, of the time each request spent in the store's load and persist
+steps, in JSON serialization and in everything else (compute), and of
+request and response payload sizes. Code marks the steps with
+``metrics.phase(name)``; when metrics are off, or outside a request, that
+returns a shared no-op context manager, so the hooks cost one attribute
+check.
+
+``RouteProfiler`` runs cProfile over the next N requests of one route and
+keeps the merged pstats for inspection.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_NO_PHASE = nullcontext()
+
+
+def _label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of one label set"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """Prometheus sample lines for this histogram"""
+        prefix = ','.join(f'{key}="{_label(value)}"' for key, value in labels)
+        separator = ',' if prefix else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts + [self.count - sum(self.counts)]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}{separator}le="{_number(bound)}"}} {cumulative}')
+        labelled = f'{{{prefix}}}' if prefix else ''
+        lines.append(f'{name}_sum{labelled} {_number(self.sum)}')
+        lines.append(f'{name}_count{labelled} {self.count}')
+        return lines
+
+
+class _Phase:
+    """Adds the time spent inside the block to the current request's phase"""
+
+    __slots__ = ('state', 'name', 'start')
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+
+    def __enter__(self):
+        self.state['depth'] += 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        state = self.state
+        state['depth'] -= 1
+        # Only the outermost phase counts, so nested steps are not added twice
+        if state['depth'] == 0:
+            state['phases'][self.name] = state['phases'].get(self.name, 0) + elapsed
+
+
+class RequestMetrics:
+    """Per-route latency, phase and payload-size histograms.
+
+    ``begin`` and ``end`` bracket a request on the current thread. Time in
+    the ``PHASES`` other than compute is measured by ``phase`` blocks;
+    compute is the rest of the request. Every request observes every phase
+    (zero if it never entered it), so a phase's sum over its count is its
+    mean cost per request.
+    """
+
+    PHASES = ('load', 'persist', 'serialize', 'compute')
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.latency = {}
+        self.phases = {}
+        self.request_bytes = {}
+        self.response_bytes = {}
+        self.histograms = {}
+        self.gauges = []
+
+    def phase(self, name):
+        """Context manager timing a step of the current request"""
+        if not self.enabled:
+            return _NO_PHASE
+        state = getattr(self.local, 'state', None)
+        if state is None:
+            return _NO_PHASE
+        return _Phase(state, name)
+
+    def begin(self):
+        self.local.state = {'start': time.perf_counter(), 'depth': 0, 'phases': {}}
+
+    def end(self, route, method, status, request_bytes=None, response_bytes=None):
+        """Record the request begun on this thread"""
+        state = getattr(self.local, 'state', None)
+        if state is None:
+            return
+        self.local.state = None
+        total = time.perf_counter() - state['start']
+        phases = state['phases']
+        phases['compute'] = max(total - sum(phases.values()), 0)
+
+        with self.lock:
+            self._histogram(self.latency, (('route', route), ('method', method), ('status', status)),
+                            LATENCY_BUCKETS).observe(total)
+            for name in self.PHASES:
+                self._histogram(self.phases, (('route', route), ('phase', name)),
+                                LATENCY_BUCKETS).observe(phases.get(name, 0))
+            if request_bytes is not None:
+                self._histogram(self.request_bytes, (('route', route),), SIZE_BUCKETS).observe(request_bytes)
+            if response_bytes is not None:
+                self._histogram(self.response_bytes, (('route', route),), SIZE_BUCKETS).observe(response_bytes)
+
+    @staticmethod
+    def _histogram(family, labels, buckets):
+        histogram = family.get(labels)
+        if histogram is None:
+            histogram = family[labels] = Histogram(buckets)
+        return histogram
+
+    def add_histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """Register an unlabeled histogram, fed with ``observe``"""
+        self.histograms[name] = (help_text, Histogram(buckets))
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms[name][1].observe(value)
+
+    def add_gauge(self, name, help_text, read):
+        """Export read() as a gauge on every scrape"""
+        self.gauges.append((name, help_text, read))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        families = [
+            ('vape_request_duration_seconds', 'Request latency by route, method and status', self.latency),
+            ('vape_request_phase_seconds', 'Time per request spent loading, persisting, serializing and computing',
+             self.phases),
+            ('vape_request_bytes', 'Request body size by route', self.request_bytes),
+            ('vape_response_bytes', 'Response body size by route', self.response_bytes)
+        ]
+        lines = []
+        with self.lock:
+            for name, help_text, family in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(family.items()):
+                    lines.extend(histogram.samples(name, labels))
+            for name, (help_text, histogram) in self.histograms.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                lines.extend(histogram.samples(name, ()))
+        for name, help_text, read in self.gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_number(read())}')
+        return '\n'.join(lines) + '\n'
+
+
+class RouteProfiler:
+    """cProfile capture of the next N requests of one route.
+
+    Only one request is profiled at a time (the interpreter allows a single
+    active profiler); a request of the route that arrives while another is
+    being profiled runs unprofiled and does not count towards N.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.route = None
+        self.remaining = 0
+        self.captured = 0
+        self.stats = None
+        self.active = None
+
+    def arm(self, route, requests):
+        """Profile the next requests of route, discarding any earlier capture"""
+        with self.lock:
+            self.route = route
+            self.remaining = requests
+            self.captured = 0
+            self.stats = None
+
+    def start(self, route):
+        """A running profiler if this request should be profiled, else None"""
+        if route != self.route or not self.remaining:
+            return None
+        with self.lock:
+            if route != self.route or not self.remaining or self.active is not None:
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) is active
+                return None
+            self.active = profile
+            return profile
+
+    def stop(self, profile):
+        profile.disable()
+        with self.lock:
+            self.active = None
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.captured += 1
+            self.remaining = max(self.remaining - 1, 0)
+
+    def status(self):
+        with self.lock:
+            return {'route': self.route, 'remaining': self.remaining, 'captured': self.captured}
+
+    def report(self, sort='cumulative', limit=40):
+        """pstats listing of the capture so far, or None if nothing was captured"""
+        with self.lock:
+            if self.stats is None:
+                return None
+            out = io.StringIO()
+            self.stats.stream = out
+            self.stats.sort_stats(sort).print_stats(limit)
+            return out.getvalue()
@@ -0,0 +1,207 @@
+"""
+Columnar copy of the confirmed transaction ledger.
+
+The datastore keeps transactions as a list of dicts, which is what the store
+operations, backends and routes work with. At millions of rows every
+full-ledger aggregate over that layout is a Python loop. ``ColumnarLedger``
+is a store view holding the fields the financial totals read as NumPy
+columns: ids, quantities, prices and paid flags as typed arrays and the
+transaction type as a categorical code. Totals over it are vectorized.
+"""
+import numpy as np
+
+# Columns and their dtypes; type holds category codes
+COLUMNS = {
+    'id': np.int64,
+    'quantity': np.int64,
+    'price': np.float64,
+    'paid': np.bool_,
+    'type': np.int32,
+    'alive': np.bool_
+}
+ABSENT = object()
+
+
+class Categories:
+    """Codes for the distinct values of a repeated string column.
+
+    Code 0 is None; -1 marks a record without the key at all.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0, ABSENT: -1}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values):
+        """Codes for a list of values (absent keys given as ABSENT)"""
+        codes = list(map(self.codes.get, values))
+        if None in codes:
+            codes = [self.code(value) if code is None else code for value, code in zip(values, codes)]
+        return codes
+
+
+class ColumnarLedger:
+    """Store view keeping the totals fields of data['transactions'] as NumPy columns.
+
+    Rows stay in ledger order. Removed rows are only marked dead and are
+    compacted away once they make up half the table. While ids increase
+    along the ledger (as they do for ids from the store's sequences) a
+    record is found by binary search on the id column; otherwise an id ->
+    row dict is kept.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self.columns = {name: np.zeros(self.capacity, dtype) for name, dtype in COLUMNS.items()}
+        self.types = Categories()
+        self.size = 0
+        self.dead = 0
+        self.rows = None
+        self.duplicates = False
+
+    # Store view interface
+
+    def rebuild(self, data):
+        self.reset()
+        self.extend(data.get('transactions') or [])
+
+    def apply(self, data, changes):
+        for kind, path, old, new in changes:
+            if path[0] != 'transactions':
+                continue
+            if len(path) > 1 or kind in ('set', 'delete'):
+                # The ledger was replaced wholesale
+                self.rebuild(data)
+                return
+            if self.duplicates and kind != 'append':
+                # Legacy duplicate ids: which row the op hit is ambiguous
+                self.rebuild(data)
+                return
+            if kind == 'append':
+                self.extend([new])
+            elif kind == 'update':
+                self._write(self._row(new['id']), new)
+            elif kind == 'remove':
+                self._kill(self._row(old['id']))
+
+    def _row(self, record_id):
+        """Row of the live record with record_id, or None"""
+        if self.rows is not None:
+            return self.rows.get(record_id)
+        ids = self.columns['id'][:self.size]
+        row = int(np.searchsorted(ids, record_id))
+        if row < self.size and ids[row] == record_id and self.columns['alive'][row]:
+            return row
+        return None
+
+    def _index_rows(self):
+        """Switch to an id -> row dict (ids out of order)"""
+        self.rows = {}
+        alive = self.columns['alive']
+        for row, record_id in enumerate(self.columns['id'][:self.size].tolist()):
+            if alive[row]:
+                if record_id in self.rows:
+                    self.duplicates = True
+                else:
+                    self.rows[record_id] = row
+
+    # Writing rows
+
+    def _grow(self, needed):
+        if needed <= self.capacity:
+            return
+        while self.capacity < needed:
+            self.capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros(self.capacity, column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def extend(self, records):
+        """Append records, converting each field column by column"""
+        records = list(records)
+        if not records:
+            return
+        start, end = self.size, self.size + len(records)
+        self._grow(end)
+        columns = self.columns
+        columns['id'][start:end] = [record['id'] for record in records]
+        columns['quantity'][start:end] = [record['quantity'] for record in records]
+        columns['price'][start:end] = [record['price'] for record in records]
+        columns['paid'][start:end] = [bool(record.get('paid')) for record in records]
+        columns['type'][start:end] = self.types.encode([record.get('type', ABSENT) for record in records])
+        columns['alive'][start:end] = True
+        self.size = end
+
+        if self.rows is None:
+            ids = columns['id'][max(start - 1, 0):end]
+            if not (ids[1:] > ids[:-1]).all():
+                self._index_rows()
+        else:
+            for row, record in enumerate(records, start):
+                if record['id'] in self.rows:
+                    self.duplicates = True
+                else:
+                    self.rows[record['id']] = row
+
+    def _write(self, row, record):
+        columns = self.columns
+        columns['quantity'][row] = record['quantity']
+        columns['price'][row] = record['price']
+        columns['paid'][row] = bool(record.get('paid'))
+        columns['type'][row] = self.types.code(record.get('type', ABSENT))
+
+    def _kill(self, row):
+        self.columns['alive'][row] = False
+        if self.rows is not None:
+            del self.rows[int(self.columns['id'][row])]
+        self.dead += 1
+        if self.dead * 2 > self.size:
+            self.compact()
+
+    def compact(self):
+        """Drop dead rows"""
+        positions = np.flatnonzero(self.columns['alive'][:self.size])
+        size = len(positions)
+        for column in self.columns.values():
+            column[:size] = column[positions]
+        self.size = size
+        self.dead = 0
+        if self.rows is not None:
+            self._index_rows()
+
+    # Vectorized aggregates
+
+    def _is(self, txn_type):
+        """Row mask of rows of one transaction type"""
+        code = self.types.codes.get(txn_type)
+        if code is None:
+            return np.zeros(self.size, np.bool_)
+        return self.columns['type'][:self.size] == code
+
+    def financial_totals(self):
+        """Same totals as FinancialTotals, over the whole ledger"""
+        alive = self.columns['alive'][:self.size]
+        quantity = self.columns['quantity'][:self.size]
+        amount = self.columns['price'][:self.size] * quantity
+        paid = self.columns['paid'][:self.size]
+        direct = alive & self._is('Direct Sale')
+        personal = alive & self._is('Personal Use')
+        consignment = alive & self._is('Consignment')
+
+        return {
+            'cash_on_hand': float(amount[direct].sum() + amount[consignment & paid].sum()),
+            'total_receivables': float(amount[consignment & ~paid].sum()),
+            'personal_use_recovery': float(amount[personal].sum()),
+            'units_sold': int(quantity[direct | personal | consignment].sum())
+        }
@@ -0,0 +1,45 @@
+"""
+One-shot migration of vape_data.json into the SQLite storage backend
+"""
+import argparse
+import sys
+
+from datastore import JsonFileBackend, SQLiteBackend
+
+
+def migrate(json_path, db_path, force=False):
+    data = JsonFileBackend(json_path).load()
+    if data is None:
+        print(f"✗ {json_path} not found")
+        return False
+
+    backend = SQLiteBackend(db_path)
+    if backend.load() is not None and not force:
+        print(f"✗ {db_path} already contains data (use --force to overwrite)")
+        backend.close()
+        return False
+
+    backend.save(data)
+    migrated = backend.load()
+    backend.close()
+
+    if migrated != data:
+        print("✗ Verification failed: migrated data does not match the JSON file")
+        return False
+
+    print(f"✓ Migrated {json_path} -> {db_path}")
+    print(f"  {len(data.get('transactions', []))} transactions, "
+          f"{len(data.get('pending_transactions', []))} pending, "
+          f"{len(data.get('consignees', {}))} consignees, "
+          f"{len(data.get('transaction_history', []))} history events")
+    print("\nStart the backend with VAPE_STORAGE=sqlite to use it.")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate vape_data.json to SQLite")
+    parser.add_argument('json_path', nargs='?', default='vape_data.json')
+    parser.add_argument('db_path', nargs='?', default='vape_data.db')
+    parser.add_argument('--force', action='store_true', help="overwrite an existing database")
+    args = parser.parse_args()
+    sys.exit(0 if migrate(args.json_path, args.db_path, args.force) else 1)
@@ -0,0 +1,103 @@
+"""
+Keyset pagination, filtering and field projection for list endpoints.
+
+Lists in the datastore are append-ordered, so pages are taken by walking the
+list from a cursor (the id of the last record on the previous page) instead
+of sorting or slicing the whole list. Newest-first pages walk it backwards.
+"""
+
+
+def parse_fields(value):
+    """Parse a ``fields=a,b,c`` query value into a tuple (None = all fields)"""
+    if not value:
+        return None
+    return tuple(field.strip() for field in value.split(',') if field.strip())
+
+
+def project(record, fields):
+    """Return only the requested top-level fields of a record"""
+    if not fields:
+        return record
+    return {field: record[field] for field in fields if field in record}
+
+
+def in_time_range(timestamp, start=None, end=None):
+    """True if an ISO timestamp falls in [start, end]; end matches by prefix,
+    so ``end=2024-01-31`` includes the whole day"""
+    if start and timestamp < start:
+        return False
+    if end and timestamp[:len(end)] > end:
+        return False
+    return True
+
+
+def _first_index(items, predicate):
+    """Index of the first item for which predicate is true (predicate must be monotonic)"""
+    low, high = 0, len(items)
+    while low < high:
+        mid = (low + high) // 2
+        if predicate(items[mid]):
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+
+def time_bounds(items, start=None, end=None):
+    """Slice bounds of a time-ordered list for [start, end] (binary search)"""
+    low = _first_index(items, lambda r: r['timestamp'] >= start) if start else 0
+    high = _first_index(items, lambda r: r['timestamp'][:len(end)] > end) if end else len(items)
+    return low, max(low, high)
+
+
+def cursor_position(items, cursor, newest_first=False):
+    """Where the page after the cursor starts walking.
+
+    That is the index of the first record with an id above the cursor, or
+    newest first, the end of the records with ids below it. The cursor's own
+    record need not exist any more (it may have been deleted since). Ids
+    normally increase along the list, so this is a binary search; if the
+    record it lands next to is not the cursor's, older data whose ids are
+    out of order is scanned for it.
+    """
+    if newest_first:
+        index = _first_index(items, lambda r: r['id'] >= cursor)
+        found = index < len(items) and items[index]['id'] == cursor
+    else:
+        index = _first_index(items, lambda r: r['id'] > cursor)
+        found = index > 0 and items[index - 1]['id'] == cursor
+    if not found:
+        for position, record in enumerate(items):
+            if record['id'] == cursor:
+                return position if newest_first else position + 1
+    return index
+
+
+def paginate(items, page_size=None, cursor=None, newest_first=False,
+             predicate=None, bounds=None):
+    """Walk items from the cursor and return (page, next_cursor).
+
+    ``bounds`` limits the walk to ``items[low:high]``; ``predicate`` filters
+    records. The walk stops as soon as the page is full, so the cost depends
+    on the page size (and filter selectivity), not the list length.
+    ``next_cursor`` is None once the end of the list has been reached.
+    """
+    low, high = bounds or (0, len(items))
+    if cursor is not None:
+        position = cursor_position(items, cursor, newest_first)
+        if newest_first:
+            high = min(high, position)
+        else:
+            low = max(low, position)
+
+    indexes = range(high - 1, low - 1, -1) if newest_first else range(low, high)
+    page = []
+    for index in indexes:
+        record = items[index]
+        if predicate and not predicate(record):
+            continue
+        page.append(record)
+        if page_size and len(page) == page_size:
+            is_last = index == (low if newest_first else high - 1)
+            return page, None if is_last else record['id']
+    return page, None
@@ -0,0 +1,100 @@
+"""
+Serialized response bodies for read endpoints that are pure functions of the
+datastore document.
+
+The cache is a store view: every committed transaction (including ones
+caught up from other workers) invalidates exactly the keys its changes can
+affect, so an entry stays valid across commits that do not touch it and is
+never served after one that does. Bodies are kept as the bytes sent to the
+client, so a hit costs a dictionary lookup and no serialization.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Size-bounded LRU of response bodies, invalidated by store commits.
+
+    ``affected(changes)`` maps the changes of one commit to the cache keys
+    they invalidate, or None to drop everything. Keys are tuples; a key
+    ending in None (e.g. ``('payments', None)``) stands for every key with
+    that prefix.
+    """
+
+    def __init__(self, affected, max_bytes=8 * 1024 * 1024):
+        self.affected = affected
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Cached body for key, or None"""
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        """Store body under key, evicting least recently used entries"""
+        if len(body) > self.max_bytes:
+            return body
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+        return body
+
+    def _discard(self, key):
+        body = self.entries.pop(key, None)
+        if body is not None:
+            self.size -= len(body)
+            self.invalidations += 1
+
+    def invalidate(self, keys=None):
+        """Drop the given keys (or prefixes), or everything"""
+        with self.lock:
+            if keys is None:
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                return
+            for key in keys:
+                if key[-1] is None:
+                    prefix = key[:-1]
+                    for cached in [cached for cached in self.entries if cached[:len(prefix)] == prefix]:
+                        self._discard(cached)
+                else:
+                    self._discard(key)
+
+    def rebuild(self, data):
+        self.invalidate()
+
+    def apply(self, data, changes):
+        self.invalidate(self.affected(changes))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
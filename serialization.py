@@ -0,0 +1,74 @@
+"""
+JSON encoding shared by persistence and API responses.
+
+orjson is used when it is installed (``pip install orjson``); otherwise the
+stdlib encoder writes compact output, which is what keeps it close behind:
+most of the cost of ``json.dump(..., indent=2)`` is the indentation itself,
+and it more than doubles the size of the data file. Both produce UTF-8 bytes
+and read back each other's output, so switching serializer (or turning
+pretty printing on or off) needs no migration.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StdlibSerializer:
+    """The standard library json module, compact unless pretty"""
+
+    name = 'stdlib'
+
+    def __init__(self, pretty=False, sort_keys=False):
+        self.pretty = pretty
+        if pretty:
+            self.options = {'indent': 2}
+        else:
+            self.options = {'separators': (',', ':')}
+        self.options['sort_keys'] = sort_keys
+
+    def dumps(self, obj, default=None):
+        """Encode obj as UTF-8 JSON bytes"""
+        return json.dumps(obj, ensure_ascii=False, default=default, **self.options).encode()
+
+    def loads(self, payload):
+        """Decode JSON from bytes or str"""
+        return json.loads(payload)
+
+
+class OrjsonSerializer:
+    """orjson, compact unless pretty"""
+
+    name = 'orjson'
+
+    def __init__(self, pretty=False, sort_keys=False):
+        self.pretty = pretty
+        # Dicts with int keys are written with string keys, as json does
+        self.option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            self.option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            self.option |= orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj, default=None):
+        """Encode obj as UTF-8 JSON bytes"""
+        return orjson.dumps(obj, default=default, option=self.option)
+
+    def loads(self, payload):
+        """Decode JSON from bytes or str"""
+        return orjson.loads(payload)
+
+
+def get_serializer(name='auto', pretty=False, sort_keys=False):
+    """Serializer by name: 'orjson', 'stdlib', or 'auto' for orjson when installed"""
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError('orjson is not installed')
+        return OrjsonSerializer(pretty, sort_keys)
+    if name == 'stdlib':
+        return StdlibSerializer(pretty, sort_keys)
+    raise ValueError(f'Unknown serializer: {name}')
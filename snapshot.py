@@ -0,0 +1,78 @@
+"""
+Compact binary snapshots of the document, for fast startup.
+
+Parsing the JSON data file is a large part of what a worker does before it
+can serve a request on a big ledger. A snapshot holds the same document
+encoded with the stdlib ``marshal`` module, which reads plain dicts, lists,
+strings and numbers back about 1.5-2.5x faster than the stdlib JSON decoder.
+Only plain data is written, but marshal is not secure against crafted
+input: it can load code objects and makes no promises about malformed data.
+The checksum only catches damage, not tampering, so a snapshot must only be
+read from a location the app itself wrote and nobody else can write to.
+
+A snapshot file is a fixed header followed by the payload::
+
+    magic (8 bytes) | format version (u16) | marshal version (u16)
+    | payload length (u64) | CRC-32 of the payload (u32) | payload
+
+Anything that does not check out (wrong magic, a newer format or marshal
+version, a short or corrupt payload) raises ``SnapshotError``. The JSON files
+stay the source of truth: a snapshot next to ``vape_data.json`` is only used
+while it matches the file, and is rebuilt from it otherwise.
+"""
+import marshal
+import os
+import struct
+import zlib
+
+MAGIC = b'VAPESNAP'
+FORMAT_VERSION = 1
+MARSHAL_VERSION = marshal.version
+
+_HEADER = struct.Struct('<8sHHQI')
+
+
+class SnapshotError(ValueError):
+    """A snapshot that is missing, truncated, corrupt or from a newer version"""
+
+
+def dumps(obj):
+    """Encode a document (plain JSON-compatible data) as snapshot bytes"""
+    payload = marshal.dumps(obj, MARSHAL_VERSION)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, MARSHAL_VERSION, len(payload), zlib.crc32(payload))
+    return header + payload
+
+
+def loads(blob):
+    """Decode snapshot bytes, checking the header and checksum"""
+    if len(blob) < _HEADER.size:
+        raise SnapshotError('Snapshot is truncated')
+    magic, version, marshal_version, length, checksum = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise SnapshotError('Not a snapshot file')
+    if version > FORMAT_VERSION or marshal_version > MARSHAL_VERSION:
+        raise SnapshotError(f'Snapshot format {version} (marshal {marshal_version}) is newer than this version')
+    payload = memoryview(blob)[_HEADER.size:]
+    if len(payload) != length:
+        raise SnapshotError('Snapshot is truncated')
+    if zlib.crc32(payload) != checksum:
+        raise SnapshotError('Snapshot checksum mismatch')
+    return marshal.loads(payload)
+
+
+def read(path):
+    """Decode the snapshot at path"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def write(path, obj, sync=False):
+    """Write a snapshot atomically (temp file + rename)"""
+    # Per-process temp name: several workers may refresh the same snapshot
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(dumps(obj))
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
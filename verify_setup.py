@@ -37,23 +37,14 @@ def check_dependencies():
         errors.append("Flask-CORS not installed")
         print("  ✗ Flask-CORS not found")
     
-    # Check Pandas
-    print("\n✓ Checking Pandas...")
+    # Check NumPy
+    print("\n✓ Checking NumPy...")
     try:
-        import pandas as pd
-        print(f"  ✓ Pandas {pd.__version__}")
+        import numpy
+        print(f"  ✓ NumPy {numpy.__version__}")
     except ImportError:
-        errors.append("Pandas not installed")
-        print("  ✗ Pandas not found")
-    
-    # Check openpyxl
-    print("\n✓ Checking openpyxl...")
-    try:
-        import openpyxl
-        print(f"  ✓ openpyxl {openpyxl.__version__}")
-    except ImportError:
-        errors.append("openpyxl not installed")
-        print("  ✗ openpyxl not found")
+        errors.append("NumPy not installed")
+        print("  ✗ NumPy not found")
     
     # Check xlsxwriter
     print("\n✓ Checking xlsxwriter...")